@@ -62,12 +62,18 @@ _last_event_time = 0
 _default_clock = None
 
 
-def next_frame(max_fps=20, idle_timeout=20, clock=None, pause=pause):
+def next_frame(max_fps=20, idle_timeout=20, clock=None, pause=pause,
+               world=None, idle_wait=None):
     """Limit maximum frame rate of pygame.  Returns True.
 
     If idle longer than the idle_timeout (in seconds), then we'll put up a
     "paused" message and the XO will suspend.  This ensures that we don't
-    burn up all of our battery running an animation!"""
+    burn up all of our battery running an animation!
+
+    If a physics world is given and it is at rest (see
+    Elements.is_idle()), wait for the next input event instead of drawing
+    the same picture again, at most idle_wait seconds (default: until an
+    event arrives)."""
     import pygame
     global _last_event_time, _default_clock
     if _default_clock is None:
@@ -76,6 +82,17 @@ def next_frame(max_fps=20, idle_timeout=20, clock=None, pause=pause):
         clock = _default_clock
     clock.tick(max_fps)
 
+    if world is not None and world.is_idle() and not pygame.event.peek():
+        if idle_wait is None:
+            event = pygame.event.wait()
+        else:
+            event = pygame.event.wait(int(idle_wait * 1000))
+        if event.type != pygame.NOEVENT:
+            # leave it for the program's event loop
+            pygame.event.post(event)
+        # don't count the time at rest as a long frame
+        clock.tick()
+
     if pygame.event.peek(list(range(pygame.NOEVENT, pygame.USEREVENT))):
         # we're not idle anymore.
         _last_event_time = pygame.time.get_ticks()
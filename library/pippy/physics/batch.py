@@ -0,0 +1,145 @@
+"""Run many simulations of one scene with different parameters.
+
+For experiments like "how does the restitution change the bounce", a
+scene is built and stepped once for every combination of parameters,
+without a display, spread over several processes:
+
+    from pippy.physics import batch
+
+    def scene(world, restitution, gravity):
+        world.world.gravity = (0, gravity)
+        world.add.ground()
+        world.add.ball((400, 100), 20, restitution=restitution)
+
+    results = batch.sweep(scene, {'restitution': [0.2, 0.5, 0.8],
+                                  'gravity': [-9.8, -1.6]})
+    print(results['time_to_rest'])
+
+The scene function has to be defined at the top level of a module (not
+in the interactive interpreter), so the worker processes can find it.
+"""
+import itertools
+import multiprocessing
+
+from .myelements import Elements
+from .myelements.elements import numpy
+
+SCREEN_SIZE = (1200, 900)
+
+
+def grid_points(grid):
+    """ All combinations of a parameter grid
+
+        Parameters:
+          grid ... dict of name: list of values
+
+        Return: list of dicts of name: value
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[n] for n in names])]
+
+
+def simulate(build, params, steps=500, fps=50.0, size=SCREEN_SIZE):
+    """ Build one scene and step it
+
+        Parameters:
+          build .... function(world, **params) adding the bodies
+          params ... dict of parameters for build
+          steps .... maximum number of steps
+          fps ...... steps per second of simulated time
+          size ..... screen size for the pixel coordinates of build
+
+        Return: dict of
+          positions .... [(x, y), ...] of the bodies in meters, in the
+                         order they were created
+          angles ....... [angle, ...] of the bodies in radians
+          steps ........ number of steps done
+          time_to_rest . simulated seconds until all bodies were asleep,
+                         None if they never came to rest
+    """
+    world = Elements(size, renderer='null')
+    build(world, **params)
+
+    # The registry keeps the bodies in the order they were created
+    world.registry.sync()
+    bodies = [body for body in world.registry.bodies
+              if body is not None and body != world.world.groundBody]
+
+    time_to_rest = None
+    step = 0
+    while step < steps:
+        world.update(fps)
+        step += 1
+        if world.is_idle():
+            # Nothing moves anymore (static bodies never fall asleep, so
+            # is_idle() skips them), further steps change nothing
+            time_to_rest = step / float(fps)
+            break
+
+    return {
+        'positions': [body.position.tuple for body in bodies],
+        'angles': [body.angle for body in bodies],
+        'steps': step,
+        'time_to_rest': time_to_rest,
+    }
+
+
+def _simulate(job):
+    # Pool.map only passes one argument
+    return simulate(*job)
+
+
+def sweep(build, grid, steps=500, fps=50.0, processes=None,
+          size=SCREEN_SIZE):
+    """ Simulate a scene for every combination of parameters of a grid,
+        in a pool of worker processes
+
+        Parameters:
+          build ....... function(world, **params) adding the bodies, it
+                        has to be defined at the top level of a module
+          grid ........ dict of name: list of values for build
+          steps ....... maximum number of steps per simulation
+          fps ......... steps per second of simulated time
+          processes ... number of worker processes (default: one per CPU,
+                        1 runs everything in this process)
+          size ........ screen size for the pixel coordinates of build
+
+        Return: dict of
+          params ........ [dict of name: value, ...], one per simulation
+          positions ..... final positions (runs, bodies, 2) in meters
+          angles ........ final angles (runs, bodies) in radians
+          steps ......... steps done per simulation (runs)
+          time_to_rest .. simulated seconds until all bodies were asleep,
+                          per simulation (runs), NaN (None without NumPy)
+                          if they never came to rest
+        The values are NumPy arrays if NumPy is available (and all scenes
+        have the same number of bodies), lists otherwise.
+    """
+    params = grid_points(grid)
+    jobs = [(build, p, steps, fps, size) for p in params]
+
+    if processes == 1:
+        results = [_simulate(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_simulate, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = {'params': params}
+    for key in ('positions', 'angles', 'steps', 'time_to_rest'):
+        summary[key] = [result[key] for result in results]
+
+    if numpy is not None:
+        summary['steps'] = numpy.array(summary['steps'])
+        summary['time_to_rest'] = numpy.array(
+            [numpy.nan if t is None else t for t in summary['time_to_rest']])
+        if len(set(len(p) for p in summary['positions'])) <= 1:
+            summary['positions'] = numpy.array(summary['positions'],
+                                               dtype=float)
+            summary['angles'] = numpy.array(summary['angles'], dtype=float)
+
+    return summary
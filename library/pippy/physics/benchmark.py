@@ -0,0 +1,284 @@
+"""Benchmarks for pippy.physics.
+
+Builds standard scenes and measures how fast they step and draw, without
+a display. Run it with the Pippy library in the python path:
+
+    python -m pippy.physics.benchmark --bodies 100 500 --output bench.json
+
+The results are written as JSON, so they can be compared between runs.
+Without --output the JSON is the only thing written to stdout (the
+messages of the renderers go to stderr), so it can be piped:
+
+    python -m pippy.physics.benchmark | python -m json.tool
+
+--geometry adds the time taken by the polygon helpers (tools_poly and
+tools.points_in_poly) to the report.
+"""
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+from .myelements import Elements
+from .myelements import tools
+from .myelements import tools_poly
+from .myelements.elements import box2d
+
+SCREEN_SIZE = (1200, 900)
+RENDERERS = ['null', 'pygame', 'cairo']
+
+
+def balls(world, n):
+    """ n balls falling onto the ground """
+    world.add.ground()
+    columns = 40
+    for i in range(n):
+        x = 100 + (i % columns) * 25
+        y = 50 + (i // columns) * 25
+        world.add.ball((x, y), 10)
+
+
+def rects(world, n):
+    """ n rectangles, stacked in columns of 10 """
+    world.add.ground()
+    for i in range(n):
+        x = 100 + (i // 10) * 45
+        y = 880 - (i % 10) * 41
+        world.add.rect((x, y), 20, 20)
+
+
+def chain(world, n):
+    """ a chain of n links, hanging from a pin """
+    world.add.ground()
+    x, y = 100, 100
+    previous = world.add.ball((x, y), 5)
+    world.add.joint(previous, (x, y))
+    for i in range(1, n):
+        x += 12
+        link = world.add.ball((x, y), 5)
+        world.add.joint(previous, link, (x - 12, y), (x, y))
+        previous = link
+
+
+SCENES = {'balls': balls, 'rects': rects, 'chain': chain}
+
+
+def heap_in_use():
+    """ Bytes allocated with malloc (Box2D and large Python objects),
+        None if unknown (needs glibc 2.33 or newer)
+    """
+    import ctypes
+    import ctypes.util
+
+    class mallinfo2(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_size_t) for name in (
+            'arena', 'ordblks', 'smblks', 'hblks', 'hblkhd', 'usmblks',
+            'fsmblks', 'uordblks', 'fordblks', 'keepcost')]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.mallinfo2.restype = mallinfo2
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    info = libc.mallinfo2()
+    return info.uordblks + info.hblkhd
+
+
+def set_renderer(world, name):
+    """ Select a renderer for world, drawing into an offscreen surface
+
+        Return: True if ok, False if the renderer is not available
+    """
+    if name == 'pygame':
+        # Use the dummy video driver, so no display is needed
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        try:
+            import pygame
+        except ImportError:
+            return False
+        pygame.display.init()
+        surface = pygame.display.set_mode(SCREEN_SIZE)
+        if not world.set_drawingMethod('pygame'):
+            return False
+        world.renderer.set_surface(surface)
+        return True
+
+    if name == 'cairo':
+        try:
+            import cairo
+        except ImportError:
+            return False
+        if not world.set_drawingMethod('cairo'):
+            return False
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *SCREEN_SIZE)
+        world.renderer.set_target(surface)
+        return True
+
+    return world.set_drawingMethod(name)
+
+
+def run_scene(scene, n, steps=200, frames=100, renderers=RENDERERS):
+    """ Build a scene with n bodies and measure it
+
+        Parameters:
+          scene ...... name of the scene (see SCENES)
+          n .......... number of bodies (links for the chain)
+          steps ...... number of physics steps to time
+          frames ..... number of frames to time per renderer
+          renderers .. renderers to time draw() with
+
+        Return: dict with the results
+    """
+    gc.collect()
+    heap = heap_in_use()
+    tracemalloc.start()
+
+    world = Elements(SCREEN_SIZE, renderer='null')
+    SCENES[scene](world, n)
+    bodies = len(world.world.bodies)
+
+    python = tracemalloc.get_traced_memory()[0] / float(bodies)
+    tracemalloc.stop()
+    if heap is not None:
+        heap = (heap_in_use() - heap) / float(bodies)
+
+    start = time.time()
+    for i in range(steps):
+        world.update()
+    steps_per_sec = steps / (time.time() - start)
+
+    draw_ms = {}
+    for name in renderers:
+        if not set_renderer(world, name):
+            draw_ms[name] = None
+            continue
+
+        total = 0.0
+        for i in range(frames):
+            world.update()
+            start = time.time()
+            world.draw()
+            total += time.time() - start
+        draw_ms[name] = total * 1000.0 / frames
+
+    return {
+        'scene': scene,
+        'bodies': bodies,
+        'fixtures': sum(len(body.fixtures) for body in world.world.bodies),
+        'joints': len(world.world.joints),
+        'steps_per_sec': steps_per_sec,
+        'draw_ms': draw_ms,
+        'heap_per_body': heap,
+        'python_per_body': python,
+    }
+
+
+def run_geometry(sizes=(8, 30, 200), points=(10, 100, 2000)):
+    """ Time the polygon helpers of tools_poly on random polygons, and
+        tools.points_in_poly against testing the points one by one
+
+        Parameters:
+          sizes .... numbers of vertices of the polygons
+          points ... numbers of points to test against a pentagon
+
+        Return: dict of name: {size: ms per call}
+    """
+    rnd = random.Random(0)
+
+    def random_points(n):
+        return [(rnd.uniform(0, 500), rnd.uniform(0, 500))
+                for i in range(n)]
+
+    def ms(func):
+        number, total = 1, 0.0
+        while total < 0.05:
+            number *= 2
+            total = timeit.timeit(func, number=number)
+        return total * 1000.0 / number
+
+    results = {}
+    for n in sizes:
+        vertices = random_points(n)
+        for name, func in [
+                ('calc_center', lambda: tools_poly.calc_center(vertices)),
+                ('is_convex', lambda: tools_poly.is_convex(vertices)),
+                ('convex_hull', lambda: tools_poly.convex_hull(vertices)),
+                ('reduce_poly_by_angle',
+                 lambda: tools_poly.reduce_poly_by_angle(vertices))]:
+            results.setdefault(name, {})[n] = ms(func)
+
+    poly = [(100, 100), (400, 120), (450, 380), (250, 450), (80, 300)]
+    for n in points:
+        tested = random_points(n)
+        results.setdefault('points_in_poly', {})[n] = ms(
+            lambda: tools.points_in_poly(tested, poly))
+        results.setdefault('point_in_poly_loop', {})[n] = ms(
+            lambda: [tools.point_in_poly(p, poly) for p in tested])
+
+    return results
+
+
+def run(scenes=sorted(SCENES), sizes=(100, 500), steps=200, frames=100,
+        renderers=RENDERERS):
+    """ Run all combinations of scenes and sizes
+
+        Return: dict with information about the system and the results
+    """
+    results = []
+    for scene in scenes:
+        for n in sizes:
+            results.append(run_scene(scene, n, steps, frames, renderers))
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'box2d': getattr(box2d, '__version__', None),
+        'steps': steps,
+        'frames': frames,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure the speed of pippy.physics')
+    parser.add_argument('--scenes', nargs='+', choices=sorted(SCENES),
+                        default=sorted(SCENES))
+    parser.add_argument('--bodies', nargs='+', type=int, default=[100, 500])
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--renderers', nargs='+', choices=RENDERERS,
+                        default=RENDERERS)
+    parser.add_argument('--geometry', action='store_true',
+                        help='also time the polygon helpers')
+    parser.add_argument('--output', help='write the JSON to this file')
+    args = parser.parse_args(argv)
+
+    # The renderers print a line when they are selected (and pygame when
+    # it is imported), keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args.scenes, args.bodies, args.steps, args.frames,
+                     args.renderers)
+        if args.geometry:
+            report['geometry'] = run_geometry()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -26,15 +26,31 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from .locals import *
 from .elements import box2d
+from .elements import numpy
 
 # Imports
+from functools import wraps
 from math import pi
 from math import sqrt
 from math import asin
+from math import atan2
+from math import fabs
 
 from . import tools_poly
 
 
+def world_locked(method):
+    # Hold the lock of the stepper thread while method changes the world,
+    # Box2D must not create or destroy anything while it steps. The
+    # body is returned right away, instead of queuing it with
+    # stepper.call()
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.parent.stepper.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class Add:
     element_count = 0
 
@@ -48,6 +64,206 @@ class Add:
         """
         return self._rect((-10.0, 0.0), 50.0, 0.1, dynamic=False)
 
+    def _to_meters(self, positions, screenCoord=True):
+        """ Bring many positions into the world coordinate system, in
+            meters -- the same as ball(), rect() and poly() do for one
+
+            Return: [(x, y), ...]
+        """
+        parent = self.parent
+        if numpy is None:
+            if screenCoord:
+                positions = [parent.to_world(pos) for pos in positions]
+            if parent.input_unit == INPUT_PIXELS:
+                return [(x / parent.ppm, y / parent.ppm)
+                        for x, y in positions]
+            return [tuple(pos) for pos in positions]
+
+        points = numpy.array(positions, dtype=float).reshape(-1, 2)
+        if screenCoord:
+            # See Elements.to_world()
+            points = numpy.round(points / parent.camera.scale_factor)
+            if parent.inputAxis_x_left:
+                points[:, 0] = parent.display_width - points[:, 0]
+            if parent.inputAxis_y_down:
+                points[:, 1] = parent.display_height - points[:, 1]
+            points += parent.screen_offset_pixel
+        if parent.input_unit == INPUT_PIXELS:
+            points /= parent.ppm
+        return [tuple(pos) for pos in points.tolist()]
+
+    def _lengths(self, values, n):
+        # One length, or one per body, in meters
+        if not hasattr(values, '__len__'):
+            values = [values] * n
+        elif len(values) != n:
+            raise ValueError('%i values for %i bodies' % (len(values), n))
+        if self.parent.input_unit == INPUT_PIXELS:
+            return [value / self.parent.ppm for value in values]
+        return list(values)
+
+    def _body_defs(self, dynamic, density, restitution, friction, shape):
+        # Body and fixture definition, to be reused for many bodies
+        bodyDef = box2d.b2BodyDef()
+        if not dynamic:
+            density = 0
+        else:
+            bodyDef.type = box2d.b2_dynamicBody
+
+        fixtureDef = box2d.b2FixtureDef()
+        fixtureDef.shape = shape
+        fixtureDef.density = density
+        fixtureDef.restitution = restitution
+        fixtureDef.friction = friction
+        return bodyDef, fixtureDef
+
+    @world_locked
+    def balls(self, positions, radii, dynamic=True, density=1.0,
+              restitution=0.16, friction=0.5, screenCoord=True):
+        """ Add many balls at once, like ball() for each position, but
+            converting all coordinates at once and reusing the Box2D
+            definitions
+
+            Parameters:
+              positions .. [(x, y), ...] (or an array of shape (n, 2))
+              radii ...... one radius for all, or one per ball
+              other ...... see [physics parameters]
+
+            Return: [box2d.b2Body, ...]
+        """
+        positions = self._to_meters(positions, screenCoord)
+        radii = self._lengths(radii, len(positions))
+
+        bodyDef, circleDef = self._body_defs(
+            dynamic, density, restitution, friction, box2d.b2CircleShape())
+
+        world = self.parent.world
+        registry = self.parent.registry
+        colors = self.parent.get_colors(len(positions))
+        bodies = []
+        for pos, radius, clr in zip(positions, radii, colors):
+            bodyDef.position = pos
+            bodyDef.userData = {'color': clr}
+            body = world.CreateBody(bodyDef)
+            registry.add(body, clr)
+            circleDef.shape.radius = radius
+            body.CreateFixture(circleDef)
+            bodies.append(body)
+
+        self.parent.element_count += len(bodies)
+        return bodies
+
+    @world_locked
+    def rects(self, positions, widths, heights, angles=0, dynamic=True,
+              density=1.0, restitution=0.16, friction=0.5,
+              screenCoord=True):
+        """ Add many rectangles at once, like rect() for each position
+
+            Parameters:
+              positions .. [(x, y), ...] (or an array of shape (n, 2))
+              widths ..... one width for all, or one per rectangle
+              heights .... one height for all, or one per rectangle
+              angles ..... one angle for all, or one per rectangle, in
+                           degrees (0 .. 360)
+              other ...... see [physics parameters]
+
+            Return: [box2d.b2Body, ...]
+        """
+        positions = self._to_meters(positions, screenCoord)
+        n = len(positions)
+        widths = self._lengths(widths, n)
+        heights = self._lengths(heights, n)
+        if not hasattr(angles, '__len__'):
+            angles = [angles] * n
+
+        bodyDef, boxDef = self._body_defs(
+            dynamic, density, restitution, friction, box2d.b2PolygonShape())
+
+        world = self.parent.world
+        registry = self.parent.registry
+        colors = self.parent.get_colors(n)
+        bodies = []
+        for pos, width, height, angle, clr in zip(positions, widths, heights,
+                                                  angles, colors):
+            bodyDef.position = pos
+            bodyDef.userData = {'color': clr}
+            body = world.CreateBody(bodyDef)
+            registry.add(body, clr)
+            boxDef.shape.SetAsBox(width, height, (0, 0), angle * pi / 180)
+            body.CreateFixture(boxDef)
+            bodies.append(body)
+
+        self.parent.element_count += len(bodies)
+        return bodies
+
+    @world_locked
+    def chain(self, points, link_len, thickness=None, pin_start=True,
+              pin_end=False, density=1.0, restitution=0.16, friction=0.5,
+              screenCoord=True):
+        """ Add a chain of rectangular links along a line, each joined to
+            the next one with a revolute joint
+
+            Parameters:
+              points ..... line [(x, y), ...] the chain follows
+              link_len ... length of a link
+              thickness .. thickness of a link (default: link_len / 4)
+              pin_start .. pin the first link to the ground
+              pin_end .... pin the last link to the ground
+              other ...... see [physics parameters]
+
+            Return: [box2d.b2Body, ...] the links
+        """
+        points = self._to_meters(points, screenCoord)
+        link_len, = self._lengths(link_len, 1)
+        if thickness is None:
+            thickness = link_len / 4.0
+        else:
+            thickness, = self._lengths(thickness, 1)
+
+        # Ends of the links, every link_len along the line
+        ends = [points[0]]
+        rest = 0.0  # Length of the segment already used
+        for (x1, y1), (x2, y2) in zip(points[:-1], points[1:]):
+            length = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+            d = link_len - rest
+            while d <= length:
+                ends.append((x1 + (x2 - x1) * d / length,
+                             y1 + (y2 - y1) * d / length))
+                d += link_len
+            rest = length - (d - link_len)
+
+        bodyDef, linkDef = self._body_defs(
+            True, density, restitution, friction, box2d.b2PolygonShape())
+        jointDef = box2d.b2RevoluteJointDef()
+
+        world = self.parent.world
+        registry = self.parent.registry
+        colors = self.parent.get_colors(len(ends) - 1)
+        links = []
+        for (x1, y1), (x2, y2), clr in zip(ends[:-1], ends[1:], colors):
+            bodyDef.position = ((x1 + x2) / 2.0, (y1 + y2) / 2.0)
+            bodyDef.userData = {'color': clr}
+            link = world.CreateBody(bodyDef)
+            registry.add(link, clr)
+            linkDef.shape.SetAsBox(link_len / 2.0, thickness / 2.0, (0, 0),
+                                   atan2(y2 - y1, x2 - x1))
+            link.CreateFixture(linkDef)
+
+            if links:
+                jointDef.Initialize(links[-1], link, (x1, y1))
+                world.CreateJoint(jointDef)
+            elif pin_start:
+                jointDef.Initialize(world.groundBody, link, (x1, y1))
+                world.CreateJoint(jointDef)
+            links.append(link)
+
+        if links and pin_end:
+            jointDef.Initialize(world.groundBody, links[-1], ends[-1])
+            world.CreateJoint(jointDef)
+
+        self.parent.element_count += len(links)
+        return links
+
     def triangle(self, pos, sidelength, dynamic=True, density=1.0,
                  restitution=0.16, friction=0.5, screenCoord=True):
         """ Add a triangle | pos & a in the current input unit system
@@ -93,6 +309,7 @@ class Add:
         return self._ball((x, y), radius, dynamic, density, restitution,
                           friction)
 
+    @world_locked
     def _ball(self, pos, radius, dynamic=True, density=1.0, restitution=0.16,
               friction=0.5):
         # Add a ball without correcting any settings
@@ -112,6 +329,7 @@ class Add:
             bodyDef.type = box2d.b2_dynamicBody
 
         body = self.parent.world.CreateBody(bodyDef)
+        self.parent.registry.add(body, userData['color'])
 
         self.parent.element_count += 1
 
@@ -205,6 +423,7 @@ class Add:
             return self._rect((halfX, halfY), length, width, angle, False,
                               density, restitution, friction)
 
+    @world_locked
     def _rect(self, pos, width, height, angle=0, dynamic=True, density=1.0,
               restitution=0.16, friction=0.5):
         # Add a rect without correcting any settings
@@ -224,6 +443,7 @@ class Add:
             bodyDef.type = box2d.b2_dynamicBody
 
         body = self.parent.world.CreateBody(bodyDef)
+        self.parent.registry.add(body, userData['color'])
 
         self.parent.element_count += 1
 
@@ -277,6 +497,7 @@ class Add:
         return self._poly((x, y), vertices, dynamic, density, restitution,
                           friction)
 
+    @world_locked
     def _poly(self, pos, vertices, dynamic=True, density=1.0,
               restitution=0.16, friction=0.5):
         # add a centered poly at pos without correcting any settings
@@ -295,6 +516,7 @@ class Add:
             bodyDef.type = box2d.b2_dynamicBody
 
         body = self.parent.world.CreateBody(bodyDef)
+        self.parent.registry.add(body, userData['color'])
 
         self.parent.element_count += 1
 
@@ -311,6 +533,7 @@ class Add:
 
         return body
 
+    @world_locked
     def concavePoly(self, vertices, dynamic=True, density=1.0,
                     restitution=0.16, friction=0.5, screenCoord=True):
         # 1. Step: Reduce
@@ -351,29 +574,72 @@ class Add:
             bodyDef.type = box2d.b2_dynamicBody
 
         body = self.parent.world.CreateBody(bodyDef)
+        self.parent.registry.add(body, userData['color'])
 
         self.parent.element_count += 1
 
-        # Create the reusable Box2D polygon and circle definitions
         polyDef = box2d.b2FixtureDef()
-
-        polygonShape = box2d.b2PolygonShape()
-        polygonShape.vertexCount = 4  # rectangle
-        polyDef.shape = polygonShape
+        polyDef.shape = box2d.b2PolygonShape()
         polyDef.density = density
         polyDef.restitution = restitution
         polyDef.friction = friction
 
+        # Half the thickness of open strokes
+        factor = 8.0
+
+        # 2. Step: Split into as few convex polygons as possible. A closed
+        # shape is filled, an open stroke gets a thickness.
+        if is_closed:
+            outline = vertices[:-1]
+        else:
+            # Segments shorter than the thickness would only add fixtures
+            stroke = tools_poly.reduce_poly(vertices, 2 * factor)
+            if stroke[-1] != vertices[-1]:
+                stroke.append(vertices[-1])
+            outline = tools_poly.stroke_outline(stroke, 2 * factor)
+
+        pieces = []
+        if len(outline) >= 3:
+            try:
+                pieces = tools_poly.convex_partition(
+                    outline, box2d.b2_maxPolygonVertices)
+            except ValueError:
+                # The shape intersects itself
+                pieces = []
+
+        # Leave out slivers Box2D would reject
+        pieces = [piece for piece in pieces
+                  if fabs(tools_poly.poly_area(piece)) > 1.0]
+
+        if not pieces:
+            if not self._stroke_fixtures(body, vertices, is_closed, polyDef,
+                                         factor):
+                return None
+            return body
+
+        for piece in pieces:
+            polyDef.shape.vertices = [(px / self.parent.ppm,
+                                       py / self.parent.ppm)
+                                      for px, py in piece]
+            body.CreateFixture(polyDef)
+
+        # Return hard and soft reduced vertices
+        return body
+
+    def _stroke_fixtures(self, body, vertices, is_closed, polyDef, factor):
+        """ Fallback for concavePoly, if the shape cannot be split into
+            convex polygons: one rectangle per segment of the line and a
+            circle between two segments
+
+            Return: True if ok, False if a rectangle was invalid
+        """
         circleShape = box2d.b2CircleShape()
         circleShape.radius = 0.086
         circleDef = box2d.b2FixtureDef()
         circleDef.shape = circleShape
-        circleDef.density = density
-        circleDef.restitution = restitution
-        circleDef.friction = friction
-
-        # Set the scale factor
-        factor = 8.0
+        circleDef.density = polyDef.density
+        circleDef.restitution = polyDef.restitution
+        circleDef.friction = polyDef.friction
 
         v2 = box2d.b2Vec2(*vertices[0])
         for v in vertices[1:]:
@@ -396,7 +662,7 @@ class Add:
                 polyDef.shape.valid
             except ValueError:
                 print("concavePoly: Created an invalid polygon!")
-                return None
+                return False
 
             body.CreateFixture(polyDef)
 
@@ -409,8 +675,7 @@ class Add:
             circleDef.localPosition = v2 / self.parent.ppm
             body.CreateFixture(circleDef)
 
-        # Return hard and soft reduced vertices
-        return body
+        return True
 
     def complexPoly(self, vertices, dynamic=True, density=1.0,
                     restitution=0.16, friction=0.5):
@@ -441,6 +706,9 @@ class Add:
 
         if is_convex:
             # print "convex"
+            # The first and the last vertex are the same
+            vertices = tools_poly.simplify_poly(
+                vertices, box2d.b2_maxPolygonVertices + 1, closed=False)
             return self.convexPoly(vertices, dynamic, density, restitution,
                                    friction), vertices
         else:
@@ -462,29 +730,18 @@ class Add:
             Return: box2d.b2Body
         """
         # NOTE: Box2D has a maximum poly vertex count, defined in
-        # Common/box2d.b2Settings.h (box2d.b2_maxPolygonVertices) We
-        # need to make sure, that we reach that by reducing the poly
-        # with increased tolerance Reduce Polygon
-        tolerance = 10  # 5
-        v_new = vertices
-        while len(v_new) > box2d.b2_maxPolygonVertices:
-            tolerance += 1
-            v_new = tools_poly.reduce_poly(vertices, tolerance)
-
-        # print "convexPoly: Polygon reduced from %i to %i vertices |
-        # tolerance: %i" % (len(vertices), len(v_new), tolerance)
-        vertices = v_new
-
-        # So poly should be alright now
-        # Continue reducing the vertecs
-        vertices_orig_reduced = vertices
-        vertices = tools_poly.poly_center_vertices(vertices)
-
+        # Common/box2d.b2Settings.h (box2d.b2_maxPolygonVertices). Removing
+        # vertices of the hull keeps it convex.
         vertices = tools_poly.convex_hull(vertices)
+        vertices = tools_poly.simplify_poly(
+            vertices, box2d.b2_maxPolygonVertices, closed=True)
 
         if len(vertices) < 3:
             return
 
+        vertices_orig_reduced = vertices
+        vertices = tools_poly.poly_center_vertices(vertices)
+
         # Define the body
         x, y = tools_poly.calc_center(vertices_orig_reduced)
         return self.poly((x, y), vertices, dynamic, density, restitution,
@@ -499,6 +756,7 @@ class Add:
         pt = box2d.b2Vec2(ptx, pty)
         return pt
 
+    @world_locked
     def joint(self, *args):
 
         if len(args) == 5:
@@ -562,6 +820,7 @@ class Add:
             except AssertionError:
                 pass
 
+    @world_locked
     def motor(self, body, pt, torque=900, speed=-10):
         # Revolute joint to the background with motor torque applied
         b1 = self.parent.world.groundBody
@@ -576,6 +835,10 @@ class Add:
         self.parent.world.CreateJoint(jointDef)
 
     def mouseJoint(self, body, pos, jointForce=100.0):
+        # Queued while the stepper thread steps the world
+        self.parent.stepper.call(self._mouseJoint, body, pos, jointForce)
+
+    def _mouseJoint(self, body, pos, jointForce):
         pos = self.parent.to_world(pos)
         x, y = pos
         x /= self.parent.ppm
@@ -594,6 +857,9 @@ class Add:
         body.awake = True
 
     def remove_mouseJoint(self):
+        self.parent.stepper.call(self._remove_mouseJoint)
+
+    def _remove_mouseJoint(self):
         if self.parent.mouseJoint:
             self.parent.world.DestroyJoint(self.parent.mouseJoint)
             self.parent.mouseJoint = None
@@ -29,28 +29,42 @@ from .elements import box2d
 
 
 class CallbackHandler:
-    # List of contact callbacks and shapes to start them - sorted by
-    # type for quicker access Callbacks are saved as
-    # callbacks[callback_type][[function, parameters], ...]
-    callbacks = {}
 
     def __init__(self, parent):
         self.parent = parent
 
+        # List of contact callbacks and shapes to start them - sorted by
+        # type for quicker access Callbacks are saved as
+        # callbacks[callback_type][[function, parameters], ...]
+        # (one dict per world, so several worlds can run side by side)
+        self.callbacks = {}
+
+        # Index of the contact callbacks for the listener:
+        # universal[callback_type] = [function, ...] for all bodies and
+        # by_body[callback_type][body] = [function, ...] for specified bodies
+        self.universal = {}
+        self.by_body = {}
+
         # init callback dict to avoid those slow try
         # (especially for self.get, as it is called *often*)
         for i in range(10):
             self.callbacks[i] = []
+            self.universal[i] = []
+            self.by_body[i] = {}
 
     def add(self, callback_type, callback_handler, *args):
         """ Users can add callbacks for certain (or all) collisions
 
            Parameters:
-             callback_type ......... CALLBACK_CONTACT
-                                     (nothing else for now)
-             callback_handler ...... a callback function
-             args (optional) ....... a list of parameters which can be
-                                     used with callbacks.get
+             callback_type ......... CALLBACK_CONTACT_ADD,
+                                     CALLBACK_CONTACT_PERSIST,
+                                     CALLBACK_CONTACT_REMOVE,
+                                     CALLBACK_DRAWING_START or
+                                     CALLBACK_DRAWING_END
+             callback_handler ...... a callback function, contact callbacks
+                                     are called with the box2d.b2Contact
+             args (optional) ....... the bodies for which a contact callback
+                                     is started (all bodies if empty)
 
            Return:
              callback_id ... used to remove a callback later (int)
@@ -60,10 +74,20 @@ class CallbackHandler:
                              CALLBACK_CONTACT_PERSIST,
                              CALLBACK_CONTACT_REMOVE]:
             if self.parent.listener is None:
-                self.parent.listener = kContactListener(self.get)
-                self.parent.world.SetContactListener(self.parent.listener)
+                self.parent.listener = kContactListener(self)
+                self.parent.world.contactListener = self.parent.listener
                 print("* ContactListener added")
 
+            if len(args) == 0:
+                # Without bodylist it's a universal callback (for all bodies)
+                self.universal[callback_type].append(callback_handler)
+            else:
+                index = self.by_body[callback_type]
+                for body in args:
+                    callbacks = index.setdefault(body, [])
+                    if callback_handler not in callbacks:
+                        callbacks.append(callback_handler)
+
         # Get callback dict for this callback_type
         c = self.callbacks[callback_type]
 
@@ -75,6 +99,16 @@ class CallbackHandler:
         # ID = callback_type.callback_index (1...n)
         return "%i.%i" % (callback_type, len(c))
 
+    def remove_body(self, body):
+        """ Forget the contact callbacks of a destroyed body (called by
+            the destruction listener of the world). Box2D reuses the
+            memory, a new body could otherwise get its callbacks.
+
+            Return: -
+        """
+        for index in self.by_body.values():
+            index.pop(body, None)
+
     def get(self, callback_type):
         return self.callbacks[callback_type]
 
@@ -87,43 +121,48 @@ class CallbackHandler:
 
 class kContactListener(box2d.b2ContactListener):
 
-    def __init__(self, get_callbacks):
+    def __init__(self, handler):
         # Init the Box2D b2ContactListener
         box2d.b2ContactListener.__init__(self)
 
-        # Function to get the current callbacks
-        self.get_callbacks = get_callbacks
+        # Callback index of the CallbackHandler
+        self.universal = handler.universal
+        self.by_body = handler.by_body
+        self.profiler = handler.parent.profiler
 
-    def check_contact(self, contact_type, point):
-        # Checks if a callback should be started with this contact point
-        contacts = self.get_callbacks(contact_type)
+    def check_contact(self, contact_type, contact):
+        self.profiler.call('contacts', self.dispatch, contact_type, contact)
 
-        # Step through all callbacks for this type (eg ADD, PERSIST, REMOVE)
-        for c in contacts:
-            callback, bodylist = c
-            if len(bodylist) == 0:
-                # Without bodylist it's a universal callback (for all bodies)
-                callback(point)
+    def dispatch(self, contact_type, contact):
+        # Start the callbacks for all bodies and the ones registered for
+        # the two bodies of this contact (each callback only once)
+        for callback in self.universal[contact_type]:
+            callback(contact)
 
-            else:
-                # This is a callback with specified bodies
-                # See if this contact involves one of the specified
-                b1 = str(point.shape1.GetBody())
-                b2 = str(point.shape2.GetBody())
-                for s in bodylist:
-                    s = str(s)
-                    if b1 == s or b2 == s:
-                        # Yes, that's the one :)
-                        callback(point)
-
-    def Add(self, point):
-        """Called when a contact point is created"""
-        self.check_contact(CALLBACK_CONTACT_ADD, point)
-
-    def Persist(self, point):
-        """Called when a contact point persists for more than a time step"""
-        self.check_contact(CALLBACK_CONTACT_PERSIST, point)
-
-    def Remove(self, point):
-        """Called when a contact point is removed"""
-        self.check_contact(CALLBACK_CONTACT_REMOVE, point)
+        index = self.by_body[contact_type]
+        if not index:
+            return
+
+        callbacks1 = index.get(contact.fixtureA.body)
+        callbacks2 = index.get(contact.fixtureB.body)
+
+        if callbacks1:
+            for callback in callbacks1:
+                callback(contact)
+
+        if callbacks2:
+            for callback in callbacks2:
+                if not callbacks1 or callback not in callbacks1:
+                    callback(contact)
+
+    def BeginContact(self, contact):
+        """Called when two fixtures begin to touch"""
+        self.check_contact(CALLBACK_CONTACT_ADD, contact)
+
+    def PreSolve(self, contact, oldManifold):
+        """Called for touching fixtures before the contact is solved"""
+        self.check_contact(CALLBACK_CONTACT_PERSIST, contact)
+
+    def EndContact(self, contact):
+        """Called when two fixtures cease to touch"""
+        self.check_contact(CALLBACK_CONTACT_REMOVE, contact)
@@ -24,6 +24,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+from collections import OrderedDict
+from math import ceil
 from math import pi
 from math import cos
 from math import sin
@@ -39,10 +41,13 @@ from . import tools
 #    draw_polygon
 #    draw_lines
 #    set_lineWidth
+#    draw_circles
+#    draw_polygons
 #
 # renderer-specific mandatory functions:
 # for pygame:
 #    set_surface
+#    start_layer, end_layer, draw_layer (if cache_layer is True)
 # for cairo:
 #    draw_text
 # for opengl:
@@ -51,14 +56,54 @@ from . import tools
 # IMPORTANT
 # The drawing functions get the coordinates in their screen coordinate system
 # no need for translations anymore :)
+#
+# draw_circles and draw_polygons are called by Elements.draw() if NumPy is
+# available. They get all shapes of a frame at once:
+#    clrs ...... one color per shape
+#    centers ... circle centers, (n, 2) array
+#    points .... vertices of all polygons, (n, 2) array
+#    starts .... index of the first vertex of each polygon in points
+
+
+def split_polygons(points, starts):
+    """ Split the vertices passed to draw_polygons into one list of
+        [x, y] points per polygon
+    """
+    points = points.tolist()
+    starts = starts.tolist()
+    ends = starts[1:] + [len(points)]
+    return [points[start:end] for start, end in zip(starts, ends)]
 
 
 class draw_pygame(object):
 
     """ This class handles the drawing with pygame, which is really
         simple since we only need draw_ellipse and draw_polygon.
+
+        Static and sleeping bodies are drawn onto a cached layer, which
+        Elements.draw() only redraws if one of them (or the camera) changed.
+
+        Filled circles can be blitted from antialiased sprites instead
+        (sprite_circles), which are rendered once per color and size
+        (rounded to half pixels) and kept in a least recently used cache.
     """
     lineWidth = 0
+    surface = None
+    target = None
+
+    # Blit circles from cached sprites. Off by default: with SDL 2, filling
+    # an ellipse is about as fast as blitting a sprite with alpha.
+    sprite_circles = False
+    sprite_cache_size = 256  # Number of sprites to keep
+    sprite_max_radius = 100  # Larger circles are drawn directly
+
+    # Cache the static and sleeping bodies (set to False to disable)
+    cache_layer = True
+    layer = None
+    layer_canvas = None
+    layer_key = None
+    # Transparent color of the layer (should not be used by any body)
+    layer_colorkey = (254, 1, 253)
 
     def __init__(self):
         """ Load pygame.draw and pygame.Rect, and reference it for
@@ -73,25 +118,118 @@ class draw_pygame(object):
         print("* Pygame selected as renderer")
         from pygame import draw
         from pygame import Rect
+        from pygame import Surface
+        from pygame import RLEACCEL
+        from pygame import SRCALPHA
+        from pygame import error
+        from pygame.transform import smoothscale
 
         self.draw = draw
         self.Rect = Rect
+        self.Surface = Surface
+        self.RLEACCEL = RLEACCEL
+        self.SRCALPHA = SRCALPHA
+        self.error = error
+        self.smoothscale = smoothscale
+
+        # (size in half pixels, color) -> sprite, least recently used first
+        self.sprites = OrderedDict()
+        self.fonts = {}
 
     def set_lineWidth(self, lw):
         """
         """
         self.lineWidth = lw
+        self.layer_key = None
+
+    def get_circle_sprite(self, clr, radius):
+        """ Get the antialiased sprite of a filled circle
+
+            Parameters:
+              clr ....... color in rgb ((r), (g), (b))
+              radius .... circle radius
+
+            Return: pygame.Surface with the circle in the center
+        """
+        key = (int(radius * 2 + 0.5), tuple(clr))
+        try:
+            sprite = self.sprites[key]
+        except KeyError:
+            pass
+        else:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        # Draw four times as large and scale it down, to smooth the edge
+        radius = key[0] / 2.0
+        size = 2 * int(ceil(radius)) + 2
+        big = self.Surface((size * 4, size * 4), self.SRCALPHA)
+        self.draw.circle(big, clr, (size * 2, size * 2), radius * 4)
+        sprite = self.smoothscale(big, (size, size))
+        try:
+            sprite = sprite.convert_alpha()
+        except self.error:
+            # No display mode set yet
+            pass
+        sprite.set_alpha(255, self.RLEACCEL)
+
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.sprite_cache_size:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def use_sprites(self):
+        # The semi-transparent edge of a sprite would take the colorkey
+        # of the cached layer, so the layer gets plain circles
+        return self.sprite_circles and self.lineWidth == 0 and \
+            self.target is None
 
     def set_surface(self, surface):
         """
         """
         self.surface = surface
+        self.layer_key = None
 
     def get_surface(self):
         """
         """
         return self.surface
 
+    def start_layer(self, key):
+        """ Redirect the drawing to the (cleared) cached layer
+
+            Parameters:
+              key ... describes the content, see Elements._layer_key()
+
+            Return: -
+        """
+        size = self.surface.get_size()
+        if self.layer_canvas is None or self.layer_canvas.get_size() != size:
+            self.layer_canvas = self.Surface(size)
+
+        self.layer_canvas.fill(self.layer_colorkey)
+        self.layer_key = key
+        self.target, self.surface = self.surface, self.layer_canvas
+
+    def end_layer(self):
+        """ Continue drawing to the surface
+        """
+        # A run-length encoded colorkey surface blits a lot faster than a
+        # per-pixel alpha one, as the layer is mostly empty. Drawing to it
+        # would encode it again on every call, so we draw to the canvas and
+        # only blit this copy.
+        self.layer = self.layer_canvas.copy()
+        self.layer.set_colorkey(self.layer_colorkey, self.RLEACCEL)
+
+        self.surface = self.target
+        self.target = None
+
+    def draw_layer(self):
+        """ Blit the cached layer onto the surface
+        """
+        if self.layer is not None:
+            self.surface.blit(self.layer, (0, 0))
+
     def start_drawing(self):
         pass
 
@@ -111,11 +249,17 @@ class draw_pygame(object):
         """
         x, y = pt
 
-        x1 = x - radius
-        y1 = y - radius
+        if self.use_sprites() and radius <= self.sprite_max_radius:
+            sprite = self.get_circle_sprite(clr, radius)
+            half = sprite.get_width() / 2.0
+            self.surface.blit(sprite, (int(round(x - half)),
+                                       int(round(y - half))))
+        else:
+            x1 = x - radius
+            y1 = y - radius
 
-        rect = self.Rect([x1, y1, 2 * radius, 2 * radius])
-        self.draw.ellipse(self.surface, clr, rect, self.lineWidth)
+            rect = self.Rect([x1, y1, 2 * radius, 2 * radius])
+            self.draw.ellipse(self.surface, clr, rect, self.lineWidth)
 
         # draw the orientation vector
         if radius > 10:
@@ -136,6 +280,76 @@ class draw_pygame(object):
         self.draw.polygon(self.surface, clr, points, self.lineWidth)
         # self.draw.lines(self.surface, clr, True, points)
 
+    def draw_circles(self, clrs, centers, radii, angles):
+        if not self.use_sprites():
+            for clr, pt, radius, angle in zip(clrs, centers.tolist(),
+                                              radii.tolist(), angles.tolist()):
+                self.draw_circle(clr, pt, radius, angle)
+            return
+
+        # Overlapping circles (eg. of a static scene) have to be drawn in
+        # order, so the batch of sprites is blitted before every circle
+        # drawn directly and before every orientation line
+        surface = self.surface
+        blits = []
+        for clr, pt, radius, angle in zip(clrs, centers.tolist(),
+                                          radii.tolist(), angles.tolist()):
+            if radius > self.sprite_max_radius:
+                if blits:
+                    surface.blits(blits, doreturn=False)
+                    blits = []
+                self.draw_circle(clr, pt, radius, angle)
+                continue
+
+            sprite = self.get_circle_sprite(clr, radius)
+            half = sprite.get_width() / 2.0
+            x, y = pt
+            blits.append((sprite, (int(round(x - half)),
+                                   int(round(y - half)))))
+
+            # the orientation vector, only visible on larger circles
+            if radius > 10:
+                surface.blits(blits, doreturn=False)
+                blits = []
+                self.draw.line(surface, (255, 255, 255), pt,
+                               (x + cos(angle) * radius,
+                                y - sin(angle) * radius))
+
+        if blits:
+            surface.blits(blits, doreturn=False)
+
+    def draw_polygons(self, clrs, points, starts):
+        for clr, polygon in zip(clrs, split_polygons(points, starts)):
+            self.draw.polygon(self.surface, clr, polygon, self.lineWidth)
+
+    def draw_text(self, text, center, clr=(0, 0, 0), size=12,
+                  fontname=None):
+        """ Draw a line of text
+
+            Parameters:
+              text ...... the text
+              center .... (x, y) of the center of the text
+              clr ....... color in rgb ((r), (g), (b))
+              size ...... font size in pixels
+              fontname .. system font (default: pygame's font)
+
+            Return: -
+        """
+        key = (fontname, size)
+        font = self.fonts.get(key)
+        if font is None:
+            from pygame import font as pygame_font
+            if not pygame_font.get_init():
+                pygame_font.init()
+            if fontname is None:
+                font = pygame_font.Font(None, size)
+            else:
+                font = pygame_font.SysFont(fontname, size)
+            self.fonts[key] = font
+
+        image = font.render(text, True, clr)
+        self.surface.blit(image, image.get_rect(center=center))
+
     def draw_lines(self, clr, closed, points, width=None):
         """ Draw a polygon
 
@@ -157,11 +371,17 @@ class draw_cairo(object):
 
     """ This class handles the drawing with cairo, which is really
         simple since we only need draw_ellipse and draw_polygon.
+
+        The frame is drawn into one image surface, which is kept as long as
+        the size of the drawing area does not change. Circles and polygons
+        are collected per color and filled with one path per color when
+        the frame is finished (or something else is drawn in between).
     """
-    window = None
     da = None
+    target = None
     circle_surface = None
     box_surface = None
+    lineWidth = 1
 
     def __init__(self, drawMethod="filled"):
         """ Load cairo.draw and cairo.Rect, and reference it for
@@ -172,52 +392,135 @@ class draw_cairo(object):
         print("* Cairo selected as renderer")
         import cairo
         self.cairo = cairo
+        self.imagesurface = None
+        self.ctx = None
+        self.ctx_surface = None
+        self.width = self.height = 0
+
+        # color -> float color, and float color -> [shape, ...] of the frame
+        self.float_colors = {}
+        self.paths = {}
+
         self.set_drawing_method(drawMethod)
         # self.draw_box = self.draw_box_image
 
-    def set_lineWidth(self, lw):  # unused
+    def set_lineWidth(self, lw):
         self.lineWidth = lw
 
     def set_drawing_area(self, da):
-        """ Set the area for Cairo to draw to
+        """ Set the area for Cairo to draw to. The frame is painted in the
+            draw signal of the area.
 
-            da ...... drawing area (gtk.DrawingArea)
+            da ...... drawing area (Gtk.DrawingArea)
 
             Return: -
         """
         self.da = da
-        self.window = da.window
+        self.target = None
+        da.connect('draw', self._draw_cb)
         print("* Cairo renderer drawing area set")
 
+    def set_target(self, surface):
+        """ Draw directly into a cairo surface (eg. an ImageSurface, to draw
+            without a display), instead of a drawing area
+
+            Return: -
+        """
+        self.target = surface
+        self.da = None
+
     def set_drawing_method(self, type):
         """ type = filled, image """
         self.draw_circle = getattr(self, "draw_circle_%s" % type)
         # self.draw_box    = getattr(self, "draw_box_%s" % type)
 
-    def start_drawing(self):
-        self.width, self.height = self.window.get_size()
-        self.imagesurface = self.cairo.ImageSurface(
-            self.cairo.FORMAT_ARGB32, self.width, self.height)
-        self.ctx = ctx = self.cairo.Context(self.imagesurface)
+    def get_float_color(self, clr):
+        """ Get a color as (0..1, 0..1, 0..1), converted only once """
+        key = tuple(clr) if isinstance(clr, list) else clr
+        try:
+            return self.float_colors[key]
+        except KeyError:
+            if isinstance(clr, str):
+                clr = tools.hex2rgb(clr)
+            floats = self.float_colors[key] = tuple(tools.rgb2floats(clr))
+            return floats
 
+    def start_drawing(self):
+        if self.target is not None:
+            surface = self.target
+        else:
+            width = max(1, self.da.get_allocated_width())
+            height = max(1, self.da.get_allocated_height())
+
+            # Reuse the surface of the last frame, if the size is the same
+            if self.imagesurface is None or \
+                    (width, height) != (self.width, self.height):
+                self.imagesurface = self.cairo.ImageSurface(
+                    self.cairo.FORMAT_ARGB32, width, height)
+            surface = self.imagesurface
+
+        if self.ctx is None or self.ctx_surface is not surface:
+            self.ctx_surface = surface
+            self.ctx = self.cairo.Context(surface)
+            self.ctx.set_tolerance(0.1)
+            self.ctx.set_line_join(self.cairo.LINE_JOIN_MITER)
+            # LINE_CAP_BUTT, LINE_CAP_ROUND, LINE_CAP_SQUARE,
+            # LINE_JOIN_BEVEL, LINE_JOIN_MITER, LINE_JOIN_ROUND
+            # ctx.set_dash([20/4.0, 20/4.0], 0)
+
+        self.width = surface.get_width()
+        self.height = surface.get_height()
+        self.paths = {}
+
+        ctx = self.ctx
         ctx.set_source_rgb(1, 1, 1)  # background color
         ctx.paint()
 
         ctx.move_to(0, 0)
         ctx.set_source_rgb(0, 0, 0)  # defaults for the rest of the drawing
         ctx.set_line_width(1)
-        ctx.set_tolerance(0.1)
-
-        ctx.set_line_join(self.cairo.LINE_CAP_BUTT)
-        # LINE_CAP_BUTT, LINE_CAP_ROUND, LINE_CAP_SQUARE,
-        # LINE_JOIN_BEVEL, LINE_JOIN_MITER, LINE_JOIN_ROUND
-
-        # ctx.set_dash([20/4.0, 20/4.0], 0)
 
     def after_drawing(self):
-        dest_ctx = self.window.cairo_create()
-        dest_ctx.set_source_surface(self.imagesurface)
-        dest_ctx.paint()
+        self.fill_paths()
+        if self.target is not None:
+            self.target.flush()
+        elif self.da is not None:
+            self.da.queue_draw()
+
+    def _draw_cb(self, widget, cr):
+        # Paint the last frame into the drawing area
+        if self.imagesurface is not None:
+            cr.set_source_surface(self.imagesurface)
+            cr.paint()
+        return False
+
+    def fill_paths(self):
+        """ Fill the collected circles and polygons, one path per color
+        """
+        ctx = self.ctx
+        for clr, shapes in self.paths.items():
+            ctx.set_source_rgb(*clr)
+            for shape in shapes:
+                if isinstance(shape, tuple):
+                    x, y, radius = shape
+                    ctx.new_sub_path()
+                    ctx.arc(x, y, radius, 0, 2 * pi)
+                else:
+                    ctx.move_to(*shape[0])
+                    for pt in shape[1:]:
+                        ctx.line_to(*pt)
+                    ctx.close_path()
+            ctx.fill()
+        self.paths = {}
+
+    def add_shape(self, clr, shape):
+        # Collect a shape for fill_paths(): a circle (x, y, radius) or
+        # a polygon [(x, y), ...]
+        clr = self.get_float_color(clr)
+        try:
+            self.paths[clr].append(shape)
+        except KeyError:
+            self.paths[clr] = [shape]
 
     def set_circle_image(self, filename):
         self.circle_surface = self.cairo.ImageSurface.create_from_png(filename)
@@ -229,17 +532,13 @@ class draw_cairo(object):
 
     def draw_circle_filled(self, clr, pt, radius, angle=0):
         x, y = pt
-
-        clr = tools.rgb2floats(clr)
-        self.ctx.set_source_rgb(*clr)
-        self.ctx.move_to(x, y)
-        self.ctx.arc(x, y, radius, 0, 2 * pi)
-        self.ctx.fill()
+        self.add_shape(clr, (x, y, radius))
 
     def draw_circle():
         pass
 
     def draw_circle_image(self, clr, pt, radius, angle=0, sf=None):
+        self.fill_paths()
         if sf is None:
             sf = self.circle_surface
         x, y = pt
@@ -255,6 +554,7 @@ class draw_cairo(object):
         self.ctx.restore()
 
     def draw_image(self, source, pt, scale=1.0, rot=0, sourcepos=(0, 0)):
+        self.fill_paths()
         self.ctx.save()
         self.ctx.rotate(rot)
         self.ctx.scale(scale, scale)
@@ -275,19 +575,30 @@ class draw_cairo(object):
 
             Return: -
         """
-        clr = tools.rgb2floats(clr)
-        self.ctx.set_source_rgb(clr[0], clr[1], clr[2])
+        # All shapes of a path have to run in the same direction as the
+        # circles, else the overlapping parts would be left empty
+        if len(points) < 3:
+            return
 
-        pt = points[0]
-        self.ctx.move_to(pt[0], pt[1])
-        for pt in points[1:]:
-            self.ctx.line_to(pt[0], pt[1])
+        (x0, y0), (x1, y1), (x2, y2) = points[:3]
+        if (x1 - x0) * (y2 - y1) - (y1 - y0) * (x2 - x1) < 0:
+            points = points[::-1]
 
-        self.ctx.fill()
+        self.add_shape(clr, [tuple(pt) for pt in points])
+
+    def draw_circles(self, clrs, centers, radii, angles):
+        for clr, pt, radius, angle in zip(clrs, centers.tolist(),
+                                          radii.tolist(), angles.tolist()):
+            self.draw_circle(clr, pt, radius, angle)
+
+    def draw_polygons(self, clrs, points, starts):
+        for clr, polygon in zip(clrs, split_polygons(points, starts)):
+            self.draw_polygon(clr, polygon)
 
     def draw_text(self, text, center, clr=(0, 0, 0), size=12,
                   fontname="Georgia"):
-        clr = tools.rgb2floats(clr)
+        self.fill_paths()
+        clr = self.get_float_color(clr)
         self.ctx.set_source_rgb(clr[0], clr[1], clr[2])
 
         self.ctx.select_font_face(fontname, self.cairo.FONT_SLANT_NORMAL,
@@ -298,17 +609,20 @@ class draw_cairo(object):
                          center[1] + 0.5 - height / 2 - y_bearing)
         self.ctx.show_text(text)
 
-    def draw_lines(self, clr, closed, points):
+    def draw_lines(self, clr, closed, points, width=None):
         """ Draw a polygon
 
             Parameters:
               clr ....... color in rgb ((r), (g), (b))
               closed .... whether or not to close the lines (as a polygon)
               points .... polygon points in normal (x,y) positions
+              width ..... line width (default: 1)
             Return: -
         """
-        clr = tools.rgb2floats(clr)
+        self.fill_paths()
+        clr = self.get_float_color(clr)
         self.ctx.set_source_rgb(clr[0], clr[1], clr[2])
+        self.ctx.set_line_width(width or 1)
 
         pt = points[0]
         self.ctx.move_to(pt[0], pt[1])
@@ -380,7 +694,16 @@ class draw_opengl_pyglet(object):
 
         self.gl.glEnd()
 
-    def draw_lines(self, clr, closed, points):
+    def draw_circles(self, clrs, centers, radii, angles):
+        for clr, pt, radius, angle in zip(clrs, centers.tolist(),
+                                          radii.tolist(), angles.tolist()):
+            self.draw_circle(clr, pt, radius, angle)
+
+    def draw_polygons(self, clrs, points, starts):
+        for clr, polygon in zip(clrs, split_polygons(points, starts)):
+            self.draw_polygon(clr, polygon)
+
+    def draw_lines(self, clr, closed, points, width=None):
         pass
 
     def start_drawing(self):
@@ -388,3 +711,39 @@ class draw_opengl_pyglet(object):
 
     def after_drawing(self):
         pass
+
+
+class draw_null(object):
+
+    """ This class draws nothing. Elements.draw() still does all the
+        transformations, so physics programs can run (and be measured)
+        without a display.
+    """
+    lineWidth = 0
+
+    def __init__(self):
+        print("* Null selected as renderer")
+
+    def set_lineWidth(self, lw):
+        self.lineWidth = lw
+
+    def start_drawing(self):
+        pass
+
+    def after_drawing(self):
+        pass
+
+    def draw_circle(self, clr, pt, radius, angle=0):
+        pass
+
+    def draw_polygon(self, clr, points):
+        pass
+
+    def draw_lines(self, clr, closed, points, width=None):
+        pass
+
+    def draw_circles(self, clrs, centers, radii, angles):
+        pass
+
+    def draw_polygons(self, clrs, points, starts):
+        pass
@@ -40,7 +40,17 @@ except:
     exit()
 
 # Standard Imports
+from math import cos
+from math import sin
 from random import shuffle
+from time import monotonic
+from time import perf_counter
+
+# NumPy is optional, it speeds up the transformation of the shapes in draw()
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Load Elements Definitions
 from .locals import *
@@ -51,6 +61,11 @@ from . import drawing
 from . import add_objects
 from . import callbacks
 from . import camera
+from . import snapshot
+from . import recorder
+from . import stepper
+from . import profiler
+from . import registry
 
 # Main Class
 
@@ -61,6 +76,16 @@ class Elements:
     """
     # Settings
     run_physics = True  # Can pause the simulation
+    batch_drawing = True  # Transform all shapes at once (requires NumPy)
+    cull_offscreen = True  # Only draw bodies and joints on the screen
+
+    # Fixed timestep mode (see set_fixedTimestep)
+    fixed_timestep = False
+    max_substeps = 5  # Maximum number of steps per update()
+    interpolate = True  # Draw between the last two steps
+    adaptive = False  # Lower the solver iterations if the steps are slow
+    step_budget = 0.010  # Seconds per update() for the adaptive mode
+    min_iterations = (3, 2)  # Lowest velocity and position iterations
     element_count = 0  # Element Count
     renderer = None  # Drawing class (from drawing.py)
     # Default Input in Pixels! (can change to INPUT_METERS)
@@ -98,9 +123,13 @@ class Elements:
         self.set_drawingMethod(renderer)
 
         # Create Subclasses
+        self.profiler = profiler.Profiler(self)
         self.add = add_objects.Add(self)
         self.callbacks = callbacks.CallbackHandler(self)
         self.camera = camera.Camera(self)
+        self.recorder = recorder.Recorder(self)
+        self.stepper = stepper.Stepper(self)
+        self.registry = registry.Registry(self)
 
         # Gravity + Bodies will sleep on outside
         self.gravity = gravity
@@ -111,6 +140,7 @@ class Elements:
         self.world = box2d.b2World(self.gravity, self.doSleep)
         bodyDef = box2d.b2BodyDef()
         self.world.groundBody = self.world.CreateBody(bodyDef)
+        self.registry.attach(self.world)
 
         # Init Colors
         self.init_colors()
@@ -118,6 +148,10 @@ class Elements:
         # Set Pixels per Meter
         self.ppm = ppm
 
+        # State of the fixed timestep and the adaptive mode
+        self.reset_timestep()
+        self.reset_quality()
+
     def set_inputUnit(self, input_unit):
         """ Change the input unit to either meter or pixels
 
@@ -144,7 +178,7 @@ class Elements:
         """ Set a drawing method (from drawing.py)
 
             Parameters:
-              m .... 'pygame' or 'cairo'
+              m .... 'pygame', 'cairo' or 'null' (draw nothing)
               *kw .. keywords to pass to the initializer of the drawing method
 
             Return: True if ok, False if no method identifier m found
@@ -155,6 +189,111 @@ class Elements:
         except AttributeError:
             return False
 
+    def set_fixedTimestep(self, fixed=True, max_substeps=5,
+                          interpolate=True):
+        """ Step the physics with the real elapsed time instead of once
+            per update(). Each update() then runs as many steps of 1/fps
+            as fit into the time since the last call (zero or more), so
+            the simulation speed does not depend on the speed of the loop.
+
+            Parameters:
+              fixed .......... True or False -- use the fixed timestep mode
+              max_substeps ... maximum steps per update(); time beyond that
+                               is dropped, so a slow machine runs slower
+                               instead of falling further behind
+              interpolate .... True or False -- draw the bodies between
+                               the last two steps for smooth movement
+
+            Return: -
+        """
+        self.fixed_timestep = fixed
+        self.max_substeps = max_substeps
+        self.interpolate = interpolate
+        self.reset_timestep()
+        self.reset_quality()
+
+    def reset_timestep(self):
+        """ Forget the time of the last update(), eg. after a pause
+
+            Return: -
+        """
+        self.last_update = None
+        self.step_accumulator = 0.0
+        self.interpolation_alpha = 1.0
+        self.previous_transforms = {}
+
+    def set_adaptiveQuality(self, adaptive=True, budget=0.010,
+                            min_iterations=(3, 2)):
+        """ Keep the time update() spends stepping within a budget: if it
+            takes longer, first the solver iterations are lowered, then
+            (in the fixed timestep mode) the steps per update(). With time
+            to spare, the steps and then the iterations come back.
+
+            The values in use are world.iterations (velocity and position
+            iterations), world.substep_limit and world.step_time (smoothed
+            seconds per update()).
+
+            Parameters:
+              adaptive ......... True or False -- use the adaptive mode
+              budget ........... seconds per update() for stepping
+              min_iterations ... lowest (velocity, position) iterations
+
+            Return: -
+        """
+        self.adaptive = adaptive
+        self.step_budget = budget
+        self.min_iterations = min_iterations
+        self.reset_quality()
+
+    def reset_quality(self):
+        """ Go back to the full solver iterations and substeps
+
+            Return: -
+        """
+        self.quality = 1.0  # Share of the requested iterations, <= 1.0
+        self.iterations = None  # (velocity, position) of the last update
+        self._lowest_quality = 0.0  # Quality of min_iterations, last update
+        self.substep_limit = self.max_substeps
+        self.step_time = 0.0
+
+    def _adapt_quality(self, elapsed):
+        # Smooth the time, a single slow frame should not change much
+        self.step_time += (elapsed - self.step_time) * 0.2
+
+        at_minimum = self.quality <= self._lowest_quality
+        if self.step_time > self.step_budget:
+            if not at_minimum:
+                # No need to go below the minimum, it only delays the
+                # recovery
+                self.quality = max(self.quality * 0.75, self._lowest_quality)
+            elif self.fixed_timestep and self.substep_limit > 1:
+                self.substep_limit -= 1
+                self.step_time = self.step_budget
+        elif self.step_time < self.step_budget * 0.6:
+            if self.fixed_timestep and \
+                    self.substep_limit < self.max_substeps:
+                self.substep_limit += 1
+                self.step_time = self.step_budget * 0.6
+            elif self.quality < 1.0:
+                self.quality = min(1.0, self.quality + 0.05)
+
+    def _get_iterations(self, vel_iterations, pos_iterations):
+        # Iterations for this update, lowered in the adaptive mode
+        if self.adaptive:
+            vel_min, pos_min = self.min_iterations
+            # A call with fewer iterations than min_iterations runs them
+            # all, without changing the quality of the next calls
+            self._lowest_quality = min(
+                1.0, float(vel_min) / max(vel_iterations, 1),
+                float(pos_min) / max(pos_iterations, 1))
+            quality = max(self.quality, self._lowest_quality)
+            vel_iterations = max(min(vel_min, vel_iterations),
+                                 int(round(vel_iterations * quality)))
+            pos_iterations = max(min(pos_min, pos_iterations),
+                                 int(round(pos_iterations * quality)))
+        self.iterations = (vel_iterations, pos_iterations)
+        return vel_iterations, pos_iterations
+
     def set_screenSize(self, size):
         """ Set the current screen size
 
@@ -215,6 +354,33 @@ class Elements:
         self.cur_color += 1
         return clr
 
+    def get_colors(self, n):
+        """ Get the next n colors at once, the same as n calls of
+            get_color()
+
+            Return: [clr, ...]
+        """
+        if self.fixed_color is not None:
+            return [self.fixed_color] * n
+
+        colors = []
+        while len(colors) < n:
+            if self.cur_color == len(self.colors):
+                self.cur_color = 0
+                shuffle(self.colors)
+
+            more = self.colors[self.cur_color:
+                               self.cur_color + n - len(colors)]
+            colors.extend(more)
+            self.cur_color += len(more)
+
+        # Convert each hex color only once
+        rgb = {}
+        for clr in set(clr for clr in colors if clr[0] == "#"):
+            rgb[clr] = tools.hex2rgb(clr)
+        return [rgb.get(clr, clr) if clr[0] == "#" else clr
+                for clr in colors]
+
     def update(self, fps=50.0, vel_iterations=10, pos_iterations=8):
         """ Update the physics, if not paused (self.run_physics)
 
@@ -227,8 +393,119 @@ class Elements:
 
             Return: -
         """
-        if self.run_physics:
-            self.world.Step(1.0 / fps, vel_iterations, pos_iterations)
+        if self.stepper.running:
+            # The stepper thread steps the world
+            return
+
+        if not self.run_physics:
+            # Don't catch up with the paused time afterwards
+            self.last_update = None
+            return
+
+        vel_iterations, pos_iterations = self._get_iterations(
+            vel_iterations, pos_iterations)
+        if self.adaptive:
+            start = perf_counter()
+
+        if not self.fixed_timestep:
+            self.profiler.call('step', self.world.Step, 1.0 / fps,
+                               vel_iterations, pos_iterations)
+            if self.recorder.recording:
+                self.recorder.record()
+            if self.adaptive:
+                self._adapt_quality(perf_counter() - start)
+            return
+
+        dt = 1.0 / fps
+        now = monotonic()
+        if self.last_update is None:
+            self.step_accumulator = dt
+        else:
+            self.step_accumulator += now - self.last_update
+        self.last_update = now
+
+        steps = int(self.step_accumulator / dt)
+        max_substeps = self.substep_limit if self.adaptive else \
+            self.max_substeps
+        if steps > max_substeps:
+            # Avoid the spiral of death: drop the time we cannot catch up with
+            steps = max_substeps
+            self.step_accumulator = steps * dt
+
+        for i in range(steps):
+            if i == steps - 1 and self.interpolate:
+                self.save_transforms()
+            self.profiler.call('step', self.world.Step, dt, vel_iterations,
+                               pos_iterations)
+
+        self.step_accumulator -= steps * dt
+        self.interpolation_alpha = self.step_accumulator / dt
+
+        if steps and self.recorder.recording:
+            self.recorder.record()
+
+        if self.adaptive and steps:
+            self._adapt_quality(perf_counter() - start)
+
+    def is_idle(self):
+        """ Check whether the world is at rest: all bodies are asleep (or
+            the physics are paused) and nothing is being dragged, so
+            update() and draw() would not change the picture until some
+            input wakes a body
+
+            Return: True if idle, False otherwise
+        """
+        if self.mouseJoint or not self.stepper.commands.empty():
+            return False
+
+        if not self.run_physics:
+            return True
+
+        with self.stepper.lock:
+            for body in self.world.bodies:
+                if body.awake and body.type != box2d.b2_staticBody:
+                    return False
+
+        return True
+
+    def stats(self):
+        """ Time taken by the phases of the last frames (see profiler.py),
+            after world.profiler.start()
+
+            Return: dict of phase: dict of count, p50, p95, mean (in ms)
+                    and frames
+        """
+        return self.profiler.stats()
+
+    def save_transforms(self):
+        """ Remember position and angle of all awake bodies, to
+            interpolate between them and the next step in draw()
+
+            Return: -
+        """
+        self.previous_transforms = dict(
+            (body, (body.position.tuple, body.angle))
+            for body in self.world.bodies if body.awake)
+
+    def get_transform(self, body):
+        """ Get the position and angle of a body to draw. In the fixed
+            timestep mode this is interpolated between the last two steps.
+
+            Return: x, y, angle -- in meters and radians
+        """
+        x, y = body.position.tuple
+        angle = body.angle
+
+        if self.fixed_timestep and self.interpolate:
+            previous = self.previous_transforms.get(body)
+            if previous is not None:
+                (px, py), pangle = previous
+                a = self.interpolation_alpha
+                x = px + (x - px) * a
+                y = py + (y - py) * a
+                angle = pangle + (angle - pangle) * a
+
+        return x, y, angle
 
     def translate_coord(self, point):
         """ Flips the coordinates in another coordinate system orientation,
@@ -284,9 +561,14 @@ class Elements:
     def meter_to_screen(self, i):
         return i * self.ppm * self.camera.scale_factor
 
-    def get_bodies_at_pos(self, search_point, include_static=False, area=0.01):
+    def get_bodies_at_pos(self, search_point, include_static=False, area=0.01,
+                          tag=None):
         """ Check if given point (screen coordinates) is inside any body.
-            If yes, return all found bodies, if not found return False
+            If yes, return all found bodies (the topmost drawn first), if
+            not found an empty list
+
+            Parameters:
+              tag ... only bodies with this tag (see registry.py)
         """
         sx, sy = self.to_world(search_point)
         sx /= self.ppm
@@ -300,21 +582,30 @@ class Elements:
 
         query_cb = Query_CB()
 
-        self.world.QueryAABB(query_cb, AABB)
+        registry = self.registry
+        with self.stepper.lock:
+            self.world.QueryAABB(query_cb, AABB)
 
-        bodylist = []
-        for s in query_cb.fixtures:
-            body = s.body
-            if body is None:
-                continue
-            if not include_static:
-                if body.type == box2d.b2_staticBody or body.mass == 0.0:
+            handles = set()
+            for s in query_cb.fixtures:
+                body = s.body
+                if body is None:
+                    continue
+                handle = registry.get_handle(body)
+                if handle in handles:
                     continue
+                if tag is not None and tag not in registry.tags[handle]:
+                    continue
+                if not include_static:
+                    if body.type == box2d.b2_staticBody or body.mass == 0.0:
+                        continue
 
-            if s.TestPoint((sx, sy)):
-                bodylist.append(body)
+                if s.TestPoint((sx, sy)):
+                    handles.add(handle)
 
-        return bodylist
+        # Bodies registered later are drawn on top
+        return [registry.bodies[handle]
+                for handle in sorted(handles, reverse=True)]
 
     def draw(self):
         """ If a drawing method is specified, this function passes the objects
@@ -323,15 +614,28 @@ class Elements:
             Return: True if the objects were successfully drawn
               False if the renderer was not set or another error occurred
         """
-        self.callbacks.start(CALLBACK_DRAWING_START)
+        result = self.profiler.call('draw', self._draw)
+        if self.profiler.enabled:
+            self.profiler.end_frame()
+        return result
+
+    def _draw(self):
+        call = self.profiler.call
+        call('hooks', self.callbacks.start, CALLBACK_DRAWING_START)
 
         # No need to run through the loop if there's no way to draw
         if not self.renderer:
             return False
 
+        # While the stepper thread runs, only its snapshots are drawn
+        snapshot = self.stepper.snapshot if self.stepper.running else None
+
         if self.camera.track_body:
             # Get Body Center
-            p1 = self.camera.track_body.GetWorldCenter()
+            if snapshot is not None:
+                p1 = box2d.b2Vec2(*snapshot.track_center)
+            else:
+                p1 = self.camera.track_body.GetWorldCenter()
 
             # Center the Camera There, False = Don't stop the tracking
             self.camera.center(self.to_screen((p1.x * self.ppm,
@@ -339,19 +643,142 @@ class Elements:
                                stopTrack=False)
 
         # Walk through all known elements
-        self.renderer.start_drawing()
+        call('render', self.renderer.start_drawing)
 
-        for body in self.world.bodies:
-            xform = body.transform
-            shape = body.fixtures
-            angle = body.angle
+        if snapshot is not None:
+            self._draw_snapshot(snapshot)
+            self._end_drawing()
+            return True
 
-            if shape:
-                userdata = body.userData
-                if 'color' in userdata:
-                    clr = userdata['color']
+        # The bodies are passed around by their handle in the registry,
+        # which also keeps their color
+        self.registry.sync()
+        if self.cull_offscreen:
+            handles = self._get_visible_handles()
+        else:
+            handles = self.registry.get_live_handles()
+
+        if getattr(self.renderer, 'cache_layer', False):
+            # Static and sleeping bodies are drawn from the renderer's
+            # cached layer, which is only redrawn if one of them changed
+            bodies = self.registry.bodies
+            resting = []
+            awake = []
+            for handle in handles:
+                body = bodies[handle]
+                if body.type == box2d.b2_staticBody or not body.awake:
+                    resting.append(handle)
                 else:
-                    clr = self.colors[0]
+                    awake.append(handle)
+
+            key = self._layer_key(resting)
+            if key != self.renderer.layer_key:
+                self.renderer.start_layer(key)
+                self._draw_bodies(resting)
+                call('render', self.renderer.end_layer)
+
+            call('render', self.renderer.draw_layer)
+            handles = awake
+
+        self._draw_bodies(handles)
+        self._draw_joints()
+        self._end_drawing()
+
+        return True
+
+    def _end_drawing(self):
+        self.profiler.call('hooks', self.callbacks.start,
+                           CALLBACK_DRAWING_END)
+        if self.profiler.overlay:
+            self.profiler.draw_overlay()
+        self.profiler.call('render', self.renderer.after_drawing)
+
+    def get_visible_aabb(self):
+        """ The part of the world which is on the screen, with the current
+            camera offset and zoom
+
+            Return: box2d.b2AABB in meters
+        """
+        (sx, sy), (ox, oy) = self._screen_transform()
+        x1, x2 = sorted((-ox / sx, (self.display_width - ox) / sx))
+        y1, y2 = sorted((-oy / sy, (self.display_height - oy) / sy))
+
+        aabb = box2d.b2AABB()
+        aabb.lowerBound = (x1, y1)
+        aabb.upperBound = (x2, y2)
+        return aabb
+
+    def get_visible_bodies(self, bodies=None):
+        """ Find the bodies with a fixture on the screen, with the
+            broadphase of Box2D
+
+            Parameters:
+              bodies ... bodies to choose from (default: all)
+
+            Return: [body, ...] in the order of bodies (default: in the
+                    order of drawing)
+        """
+        if bodies is None:
+            self.registry.sync()
+            return [self.registry.bodies[handle]
+                    for handle in self._get_visible_handles()]
+
+        query_cb = Query_CB()
+        self.world.QueryAABB(query_cb, self.get_visible_aabb())
+
+        visible = set(fixture.body for fixture in query_cb.fixtures)
+        return [body for body in bodies if body in visible]
+
+    def _get_visible_handles(self):
+        """ Return: sorted handles of the bodies on the screen """
+        query_cb = Query_CB()
+        self.world.QueryAABB(query_cb, self.get_visible_aabb())
+
+        # Sorted by handle is the order of drawing
+        get_handle = self.registry.get_handle
+        return sorted(set(get_handle(fixture.body)
+                          for fixture in query_cb.fixtures))
+
+    def _layer_key(self, handles):
+        """ Describe everything the picture of the given (resting) bodies
+            depends on: the camera, which bodies rest, and the version of
+            the registry, which changes when a body is added, removed or
+            recolored. Bodies falling asleep or waking up change the
+            handles. Resting bodies moved by hand need a call to
+            world.registry.touch().
+
+            Return: key (tuple) -- equal keys give equal pictures
+        """
+        return (self.screen_offset_pixel, self.camera.scale_factor,
+                self.ppm, self.display_width, self.display_height,
+                self.inputAxis_x_left, self.inputAxis_y_down,
+                self.registry.version, tuple(handles))
+
+    def _draw_bodies(self, handles):
+        if self.batch_drawing and numpy is not None:
+            self._draw_batch(handles)
+        else:
+            self._draw_shapes(handles)
+
+    def _draw_shapes(self, handles):
+        """ Transform and draw the shapes one by one (fallback if NumPy
+            is not available)
+        """
+        interpolate = self.fixed_timestep and self.interpolate
+        bodies = self.registry.bodies
+        colors = self.registry.colors
+
+        for handle in handles:
+            body = bodies[handle]
+            clr = colors[handle]
+            if interpolate:
+                x, y, angle = self.get_transform(body)
+                xform = box2d.b2Transform()
+                xform.position = (x, y)
+                xform.angle = angle
+            else:
+                xform = body.transform
+                angle = body.angle
 
             for shape in body.fixtures:
                 type_ = shape.type
@@ -379,11 +806,207 @@ class Elements:
                 else:
                     print("unknown shape type:%d" % shape.type)
 
+    def _draw_batch(self, handles):
+        """ Collect the transforms and vertices of all bodies into arrays,
+            bring them to the screen with one affine transformation and pass
+            them to the renderer in one call per shape type
+        """
+        transforms = []  # (x, y, angle) per body
+        circle_body, circle_local, circle_radius, circle_clrs = [], [], [], []
+        poly_body, poly_local, poly_counts, poly_clrs = [], [], [], []
+        bodies = self.registry.bodies
+        colors = self.registry.colors
+
+        for handle in handles:
+            body = bodies[handle]
+            fixtures = body.fixtures
+            if not fixtures:
+                continue
+
+            clr = colors[handle]
+            index = len(transforms)
+            transforms.append(self.get_transform(body))
+
+            for fixture in fixtures:
+                type_ = fixture.type
+                shape = fixture.shape
+
+                if type_ == box2d.b2Shape.e_circle:
+                    circle_body.append(index)
+                    circle_local.append(shape.pos.tuple)
+                    circle_radius.append(shape.radius)
+                    circle_clrs.append(clr)
+
+                elif type_ == box2d.b2Shape.e_polygon:
+                    vertices = shape.vertices
+                    poly_body.extend([index] * len(vertices))
+                    poly_local.extend(vertices)
+                    poly_counts.append(len(vertices))
+                    poly_clrs.append(clr)
+
+                else:
+                    print("unknown shape type:%d" % type_)
+
+        self._render_batch(transforms,
+                           (circle_body, circle_local, circle_radius,
+                            circle_clrs),
+                           (poly_body, poly_local, poly_counts, poly_clrs))
+
+    def _render_batch(self, transforms, circles, polygons):
+        """ Bring the collected shapes to the screen with NumPy and pass
+            them to the renderer
+
+            Parameters:
+              transforms .. [(x, y, angle), ...] per body
+              circles ..... body index, local center, radius, color lists
+              polygons .... body index (per vertex), local vertices,
+                            vertex count, color lists
+        """
+        circle_body, circle_local, circle_radius, circle_clrs = circles
+        poly_body, poly_local, poly_counts, poly_clrs = polygons
+
+        if not transforms:
+            return
+
+        bodies = numpy.array(transforms, dtype=float)
+        rot = numpy.empty((len(bodies), 2, 2))
+        rot[:, 0, 0] = rot[:, 1, 1] = numpy.cos(bodies[:, 2])
+        rot[:, 1, 0] = numpy.sin(bodies[:, 2])
+        rot[:, 0, 1] = -rot[:, 1, 0]
+
+        scale, offset = self._screen_transform()
+
+        if poly_counts:
+            index = numpy.array(poly_body, dtype=numpy.intp)
+            points = numpy.einsum('nij,nj->ni', rot[index],
+                                  numpy.array(poly_local, dtype=float))
+            points += bodies[index, :2]
+            points *= scale
+            points += offset
+
+            # Index of the first vertex of every polygon
+            starts = numpy.zeros(len(poly_counts), dtype=numpy.intp)
+            numpy.cumsum(poly_counts[:-1], out=starts[1:])
+
+            self.profiler.call('render', self.renderer.draw_polygons,
+                               poly_clrs, numpy.ascontiguousarray(points),
+                               starts)
+
+        if circle_body:
+            index = numpy.array(circle_body, dtype=numpy.intp)
+            centers = numpy.einsum('nij,nj->ni', rot[index],
+                                   numpy.array(circle_local, dtype=float))
+            centers += bodies[index, :2]
+            centers *= scale
+            centers += offset
+
+            radii = numpy.array(circle_radius, dtype=float)
+            radii *= self.ppm * self.camera.scale_factor
+
+            self.profiler.call('render', self.renderer.draw_circles,
+                               circle_clrs, numpy.ascontiguousarray(centers),
+                               radii, bodies[index, 2])
+
+    def _render_lists(self, transforms, circles, polygons):
+        """ Same as _render_batch, without NumPy """
+        circle_body, circle_local, circle_radius, circle_clrs = circles
+        poly_body, poly_local, poly_counts, poly_clrs = polygons
+        (sx, sy), (ox, oy) = self._screen_transform()
+        rotations = [(cos(angle), sin(angle)) for x, y, angle in transforms]
+
+        def to_screen(index, local):
+            x, y, angle = transforms[index]
+            c, s = rotations[index]
+            lx, ly = local
+            return [(x + c * lx - s * ly) * sx + ox,
+                    (y + s * lx + c * ly) * sy + oy]
+
+        start = 0
+        for count, clr in zip(poly_counts, poly_clrs):
+            points = [to_screen(poly_body[i], poly_local[i])
+                      for i in range(start, start + count)]
+            self.renderer.draw_polygon(clr, points)
+            start += count
+
+        factor = self.ppm * self.camera.scale_factor
+        for index, local, radius, clr in zip(*circles):
+            self.renderer.draw_circle(clr, to_screen(index, local),
+                                      radius * factor, transforms[index][2])
+
+    def _draw_snapshot(self, snapshot):
+        """ Draw the bodies and joints of a snapshot published by the
+            stepper thread (see stepper.py), without touching the world
+        """
+        transforms = []
+        circles = ([], [], [], [])
+        polygons = ([], [], [], [])
+
+        for clr, transform, shapes in snapshot.bodies:
+            index = len(transforms)
+            transforms.append(transform)
+            for shape in shapes:
+                if shape[0] == 'circle':
+                    circles[0].append(index)
+                    circles[1].append(shape[1])
+                    circles[2].append(shape[2])
+                    circles[3].append(clr)
+                else:
+                    vertices = shape[1]
+                    polygons[0].extend([index] * len(vertices))
+                    polygons[1].extend(vertices)
+                    polygons[2].append(len(vertices))
+                    polygons[3].append(clr)
+
+        if self.batch_drawing and numpy is not None:
+            self._render_batch(transforms, circles, polygons)
+        else:
+            self._render_lists(transforms, circles, polygons)
+
+        for revolute, (x2, y2), (x1, y1) in snapshot.joints:
+            p2 = self.to_screen((x2 * self.ppm, y2 * self.ppm))
+            p1 = self.to_screen((x1 * self.ppm, y1 * self.ppm))
+            if revolute:
+                self.renderer.draw_circle((255, 255, 255), p1,
+                                          self.PIN_MOTOR_RADIUS, 0)
+            else:
+                self.renderer.draw_lines((0, 0, 0), False, [p1, p2], 3)
+
+    def _screen_transform(self):
+        """ Get the affine transformation from world coordinates (meters)
+            to the screen (pixels), including the screen offset, the scale
+            factor and the axis orientation: screen = world * scale + offset
+
+            Return: scale, offset -- (x, y) each
+        """
+        dx, dy = self.screen_offset_pixel
+        f = self.camera.scale_factor
+
+        sx = sy = self.ppm * f
+        ox, oy = -dx * f, -dy * f
+
+        if self.inputAxis_x_left:
+            sx, ox = -sx, (self.display_width + dx) * f
+
+        if self.inputAxis_y_down:
+            sy, oy = -sy, (self.display_height + dy) * f
+
+        return (sx, sy), (ox, oy)
+
+    def _draw_joints(self):
+        if self.cull_offscreen:
+            aabb = self.get_visible_aabb()
+            (x1, y1), (x2, y2) = aabb.lowerBound.tuple, aabb.upperBound.tuple
+
         for joint in self.world.joints:
             p2 = joint.anchorA
-            p2 = self.to_screen((p2.x * self.ppm, p2.y * self.ppm))
-
             p1 = joint.anchorB
+
+            if self.cull_offscreen and (
+                    max(p1.x, p2.x) < x1 or min(p1.x, p2.x) > x2
+                    or max(p1.y, p2.y) < y1 or min(p1.y, p2.y) > y2):
+                continue
+
+            p2 = self.to_screen((p2.x * self.ppm, p2.y * self.ppm))
             p1 = self.to_screen((p1.x * self.ppm, p1.y * self.ppm))
 
             if isinstance(joint, box2d.b2RevoluteJoint):
@@ -392,11 +1015,6 @@ class Elements:
             else:
                 self.renderer.draw_lines((0, 0, 0), False, [p1, p2], 3)
 
-        self.callbacks.start(CALLBACK_DRAWING_END)
-        self.renderer.after_drawing()
-
-        return True
-
     def set_pin_motor_radius(self, radius):
         self.PIN_MOTOR_RADIUS = radius
 
@@ -406,8 +1024,11 @@ class Elements:
         x /= self.ppm
         y /= self.ppm
 
+        self.stepper.call(self._set_mouse_target, (x, y))
+
+    def _set_mouse_target(self, target):
         if self.mouseJoint:
-            self.mouseJoint.target = (x, y)
+            self.mouseJoint.target = target
 
     def pickle_save(self, fn, additional_vars={}):
         import pickle as pickle
@@ -443,7 +1064,11 @@ class Elements:
             print('Error while loading world: ', s)
             return
 
-        self.world = world
+        with self.stepper.lock:
+            self.world = world
+            self.registry.attach(world)
+        self.reset_timestep()
+        self.recorder.restart()
 
         if set_vars:
             # reset the additional saved variables:
@@ -461,19 +1086,26 @@ class Elements:
         import json
         worldmodel = {}
 
-        save_id_index = 1
-        self.world.groundBody.userData = {"saveid": 0}
+        # The save ids only go into the file, the userData stays as it is
+        registry = self.registry
+        registry.number_bodies()
 
         bodylist = []
         for body in self.world.bodies:
             if not body == self.world.groundBody:
-                body.userData["saveid"] = save_id_index  # set temporary data
-                save_id_index += 1
+                handle = registry.get_handle(body)
                 shapelist = body.fixtures
                 modelbody = {}
                 modelbody['position'] = body.position.tuple
                 modelbody['dynamic'] = body.type == box2d.b2_dynamicBody
-                modelbody['userData'] = body.userData
+                userdata = body.userData
+                userdata = dict(userdata) if userdata else {}
+                userdata['saveid'] = registry.saveids[handle]
+                if 'color' not in userdata:
+                    userdata['color'] = registry.colors[handle]
+                modelbody['userData'] = userdata
+                if registry.tags[handle]:
+                    modelbody['tags'] = sorted(registry.tags[handle], key=str)
                 modelbody['angle'] = body.angle
                 modelbody['angularVelocity'] = body.angularVelocity
                 modelbody['linearVelocity'] = body.linearVelocity.tuple
@@ -515,8 +1147,8 @@ class Elements:
                 modeljoint['anchor1'] = joint.anchorA.tuple
                 modeljoint['anchor2'] = joint.anchorB.tuple
 
-            modeljoint['body1'] = joint.bodyA.userData['saveid']
-            modeljoint['body2'] = joint.bodyB.userData['saveid']
+            modeljoint['body1'] = registry.get_saveid(joint.bodyA)
+            modeljoint['body2'] = registry.get_saveid(joint.bodyB)
             modeljoint['collideConnected'] = joint.collideConnected
             modeljoint['userData'] = joint.userData
 
@@ -534,8 +1166,8 @@ class Elements:
             for key, info in backup.items():
                 if not info[3]:
                     try:
-                        trackinfo[key][0] = info[0].userData['saveid']
-                        trackinfo[key][1] = info[1].userData['saveid']
+                        trackinfo[key][0] = registry.get_saveid(info[0])
+                        trackinfo[key][1] = registry.get_saveid(info[1])
                     except AttributeError:
                         pass
                 else:
@@ -549,80 +1181,93 @@ class Elements:
         f.write(json.dumps(worldmodel))
         f.close()
 
-        for body in self.world.bodies:
-            del body.userData['saveid']  # remove temporary data
-
     def json_load(self, path, serialized=False):
         import json
 
-        self.world.groundBody.userData = {"saveid": 0}
-
         f = open(path, 'r')
         worldmodel = json.loads(f.read())
         f.close()
-        # clean world
-        for joint in self.world.joints:
-            self.world.DestroyJoint(joint)
-        for body in self.world.bodies:
-            if body != self.world.groundBody:
-                self.world.DestroyBody(body)
-
-        # load bodies
-        for body in worldmodel['bodylist']:
-            bodyDef = box2d.b2BodyDef()
-            if body['dynamic']:
-                bodyDef.type = box2d.b2_dynamicBody
-            bodyDef.position = body['position']
-            bodyDef.userData = body['userData']
-            bodyDef.angle = body['angle']
-            newBody = self.world.CreateBody(bodyDef)
-            # _logger.debug(newBody)
-            newBody.angularVelocity = body['angularVelocity']
-            newBody.linearVelocity = body['linearVelocity']
-            if 'shapes' in body:
-                for shape in body['shapes']:
-                    if shape['type'] == 'polygon':
-                        polyDef = box2d.b2FixtureDef()
-                        polyShape = box2d.b2PolygonShape()
-                        polyShape.vertices = shape['vertices']
-                        polyDef.shape = polyShape
-                        polyDef.density = shape['density']
-                        polyDef.restitution = shape['restitution']
-                        polyDef.friction = shape['friction']
-                        newBody.CreateFixture(polyDef)
-                    if shape['type'] == 'circle':
-                        circleDef = box2d.b2FixtureDef()
-                        circleShape = box2d.b2CircleShape()
-                        circleShape.radius = shape['radius']
-                        circleShape.pos = shape['localPosition']
-                        circleDef.shape = circleShape
-                        circleDef.density = shape['density']
-                        circleDef.restitution = shape['restitution']
-                        circleDef.friction = shape['friction']
-                        newBody.CreateFixture(circleDef)
-
-        for joint in worldmodel['jointlist']:
-            if joint['type'] == 'distance':
-                jointDef = box2d.b2DistanceJointDef()
-                body1 = self.getBodyWithSaveId(joint['body1'])
-                anch1 = joint['anchor1']
-                body2 = self.getBodyWithSaveId(joint['body2'])
-                anch2 = joint['anchor2']
-                jointDef.collideConnected = joint['collideConnected']
-                jointDef.Initialize(body1, body2, anch1, anch2)
-                jointDef.userData = joint['userData']
-                self.world.CreateJoint(jointDef)
-            if joint['type'] == 'revolute':
-                jointDef = box2d.b2RevoluteJointDef()
-                body1 = self.getBodyWithSaveId(joint['body1'])
-                body2 = self.getBodyWithSaveId(joint['body2'])
-                anchor = joint['anchor']
-                jointDef.Initialize(body1, body2, anchor)
-                jointDef.userData = joint['userData']
-                jointDef.motorEnabled = joint['enableMotor']
-                jointDef.motorSpeed = joint['motorSpeed']
-                jointDef.maxMotorTorque = joint['maxMotorTorque']
-                self.world.CreateJoint(jointDef)
+        # The stepper thread must not step the world while it is rebuilt
+        with self.stepper.lock:
+            # clean world
+            for joint in self.world.joints:
+                self.world.DestroyJoint(joint)
+            for body in self.world.bodies:
+                if body != self.world.groundBody:
+                    self.world.DestroyBody(body)
+            self.reset_timestep()
+
+            registry = self.registry
+            registry.clear()
+            self.world.groundBody.userData = {}
+            registry.add(self.world.groundBody, saveid=0)
+
+            # load bodies
+            for body in worldmodel['bodylist']:
+                userdata = body['userData']
+                saveid = userdata.pop('saveid')
+                if isinstance(userdata.get('color'), list):
+                    # JSON has no tuples, hex strings stay as they are
+                    userdata['color'] = tuple(userdata['color'])
+
+                bodyDef = box2d.b2BodyDef()
+                if body['dynamic']:
+                    bodyDef.type = box2d.b2_dynamicBody
+                bodyDef.position = body['position']
+                bodyDef.userData = userdata
+                bodyDef.angle = body['angle']
+                newBody = self.world.CreateBody(bodyDef)
+                registry.add(newBody, tags=body.get('tags', ()), saveid=saveid)
+                # _logger.debug(newBody)
+                newBody.angularVelocity = body['angularVelocity']
+                newBody.linearVelocity = body['linearVelocity']
+                if 'shapes' in body:
+                    for shape in body['shapes']:
+                        if shape['type'] == 'polygon':
+                            polyDef = box2d.b2FixtureDef()
+                            polyShape = box2d.b2PolygonShape()
+                            polyShape.vertices = shape['vertices']
+                            polyDef.shape = polyShape
+                            polyDef.density = shape['density']
+                            polyDef.restitution = shape['restitution']
+                            polyDef.friction = shape['friction']
+                            newBody.CreateFixture(polyDef)
+                        if shape['type'] == 'circle':
+                            circleDef = box2d.b2FixtureDef()
+                            circleShape = box2d.b2CircleShape()
+                            circleShape.radius = shape['radius']
+                            circleShape.pos = shape['localPosition']
+                            circleDef.shape = circleShape
+                            circleDef.density = shape['density']
+                            circleDef.restitution = shape['restitution']
+                            circleDef.friction = shape['friction']
+                            newBody.CreateFixture(circleDef)
+
+            for joint in worldmodel['jointlist']:
+                if joint['type'] == 'distance':
+                    jointDef = box2d.b2DistanceJointDef()
+                    body1 = self.getBodyWithSaveId(joint['body1'])
+                    anch1 = joint['anchor1']
+                    body2 = self.getBodyWithSaveId(joint['body2'])
+                    anch2 = joint['anchor2']
+                    jointDef.collideConnected = joint['collideConnected']
+                    jointDef.Initialize(body1, body2, anch1, anch2)
+                    jointDef.userData = joint['userData']
+                    self.world.CreateJoint(jointDef)
+                if joint['type'] == 'revolute':
+                    jointDef = box2d.b2RevoluteJointDef()
+                    body1 = self.getBodyWithSaveId(joint['body1'])
+                    body2 = self.getBodyWithSaveId(joint['body2'])
+                    anchor = joint['anchor']
+                    jointDef.Initialize(body1, body2, anchor)
+                    jointDef.userData = joint['userData']
+                    jointDef.motorEnabled = joint['enableMotor']
+                    jointDef.motorSpeed = joint['motorSpeed']
+                    jointDef.maxMotorTorque = joint['maxMotorTorque']
+                    self.world.CreateJoint(jointDef)
+
+        # The recorder takes the new bodies (and handles)
+        self.recorder.restart()
 
         self.additional_vars = {}
         addvars = {}
@@ -643,13 +1288,39 @@ class Elements:
 
         self.additional_vars = addvars
 
-        for body in self.world.bodies:
-            del body.userData['saveid']  # remove temporary data
-
     def getBodyWithSaveId(self, saveid):
-        for body in self.world.bodies:
-            if body.userData['saveid'] == saveid:
-                return body
+        # The save ids of the last json_save or json_load
+        return self.registry.get_body_with_saveid(saveid)
+
+    def snapshot_save(self, path, additional_vars={}):
+        """ Save the world into a compact binary snapshot (see snapshot.py)
+
+            Parameters:
+              path ............. file name
+              additional_vars .. dict of (JSON compatible) values to save
+
+            Return: -
+        """
+        self.add.remove_mouseJoint()
+        snapshot.save(self, path, additional_vars)
+
+    def snapshot_load(self, path, use_mmap=False):
+        """ Replace the world with a snapshot saved by snapshot_save()
+
+            Parameters:
+              path ....... file name
+              use_mmap ... True or False -- memory-map the file instead of
+                           reading it
+
+            Return: the additional_vars saved with the snapshot
+        """
+        with self.stepper.lock:
+            self.mouseJoint = None
+            self.registry.clear()
+            variables = snapshot.load(self, path, use_mmap)
+        self.reset_timestep()
+        self.recorder.restart()
+        return variables
 
 
 class Query_CB(box2d.b2QueryCallback):
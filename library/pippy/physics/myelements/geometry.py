@@ -0,0 +1,65 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+# Polygon geometry on NumPy arrays
+#
+# Only for work on many points at once: for the vertices of one polygon
+# the conversion to an array costs more than it saves, so tools_poly
+# stays with lists. tools uses this module when NumPy is available;
+# importing it fails without.
+import numpy
+
+
+def as_points(points):
+    """ Points as a float array of shape (N, 2) """
+    return numpy.asarray(points, dtype=float).reshape(-1, 2)
+
+
+def points_in_poly(points, poly):
+    """ Test many points at once with the even-odd rule (ray casting)
+
+        Parameters:
+          points ... array (M, 2) of points to test
+          poly ..... array (N, 2) of polygon vertices
+
+        Return: bool array (M,)
+    """
+    points = as_points(points)
+    poly = as_points(poly)
+    x = points[:, 0, None]
+    y = points[:, 1, None]
+
+    # Every edge p1 -> p2 of the polygon, as rows
+    x1, y1 = poly[:, 0], poly[:, 1]
+    x2, y2 = numpy.roll(x1, -1), numpy.roll(y1, -1)
+
+    crosses = (y > numpy.minimum(y1, y2)) & (y <= numpy.maximum(y1, y2)) & \
+        (x <= numpy.maximum(x1, x2))
+    dy = numpy.where(y1 != y2, y2 - y1, 1.0)
+    xinters = (y - y1) * (x2 - x1) / dy + x1
+    crosses &= (x1 == x2) | (x <= xinters)
+
+    return crosses.sum(axis=1) % 2 == 1
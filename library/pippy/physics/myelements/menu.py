@@ -97,9 +97,6 @@ class MenuClass:
     # current active menu point it
     focus = False
 
-    # each item is stored as MenuItem
-    items = []
-
     # where to start drawing
     start_at = (0, 0)
 
@@ -112,6 +109,9 @@ class MenuClass:
     def __init__(self):
         self.draw_at = self.start_at
 
+        # each item is stored as MenuItem (one list per menu)
+        self.items = []
+
     def set_width(self, width):
         self.setWidth = True
         self.width = width
@@ -0,0 +1,172 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import csv
+from collections import deque
+from time import perf_counter
+
+# Phases of a frame:
+#   step ...... world.Step() in update(), including the contact callbacks
+#   contacts .. the contact callbacks (CALLBACK_CONTACT_*)
+#   draw ...... all of draw()
+#   render .... the renderer's work in draw() (the batch calls, the layer,
+#               start and end of the frame; without NumPy the renderer is
+#               called per shape, which counts to transform)
+#   hooks ..... the CALLBACK_DRAWING_START/END callbacks
+#   transform . draw() without render and hooks: collecting and
+#               transforming the shapes
+PHASES = ['step', 'contacts', 'draw', 'render', 'hooks', 'transform']
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of values (0 <= p <= 100) """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+class Profiler:
+
+    """ Measures how long the phases of each frame take (see PHASES), for
+        the last frames. Off by default, it costs next to nothing then.
+
+        Typical use:
+          world.profiler.start()
+          ... world.update(), world.draw() ...
+          print(world.stats())
+          world.profiler.save_csv('frames.csv')
+
+        A frame ends with each draw(). The stepper thread is not measured.
+    """
+    enabled = False
+    overlay = False  # Draw the stats in the corner of the screen
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.frames = deque(maxlen=300)
+        self.counts = dict((phase, 0) for phase in PHASES)
+        self.current = {}
+
+    def start(self, frames=300, overlay=False):
+        """ Start measuring, keeping the last frames frames
+
+            Return: -
+        """
+        self.frames = deque(maxlen=frames)
+        self.counts = dict((phase, 0) for phase in PHASES)
+        self.current = {}
+        self.overlay = overlay
+        self.enabled = True
+
+    def stop(self):
+        """ Stop measuring, the measured frames are kept """
+        self.enabled = False
+        self.overlay = False
+
+    def add(self, phase, seconds):
+        """ Add the time of one call to the current frame """
+        self.current[phase] = self.current.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def call(self, phase, func, *args):
+        """ Call func(*args), measuring it if enabled
+
+            Return: what func returns
+        """
+        if not self.enabled:
+            return func(*args)
+
+        start = perf_counter()
+        result = func(*args)
+        self.add(phase, perf_counter() - start)
+        return result
+
+    def end_frame(self):
+        """ Finish the current frame (called by Elements.draw()) """
+        frame = self.current
+        if 'draw' in frame:
+            frame['transform'] = max(0.0, frame['draw']
+                                     - frame.get('render', 0.0)
+                                     - frame.get('hooks', 0.0))
+            self.counts['transform'] += 1
+        self.frames.append(frame)
+        self.current = {}
+
+    def stats(self):
+        """ Summary of the measured frames
+
+            Return: dict of phase: dict of
+              count ... number of calls since start()
+              p50 ..... median time per frame, in ms
+              p95 ..... 95th percentile of the time per frame, in ms
+              mean .... mean time per frame, in ms
+              frames .. number of frames measured
+        """
+        stats = {}
+        for phase in PHASES:
+            if not self.counts.get(phase):
+                continue
+            times = [frame.get(phase, 0.0) * 1000.0 for frame in self.frames]
+            stats[phase] = {
+                'count': self.counts[phase],
+                'p50': percentile(times, 50),
+                'p95': percentile(times, 95),
+                'mean': sum(times) / len(times) if times else 0.0,
+                'frames': len(times),
+            }
+        return stats
+
+    def save_csv(self, path):
+        """ Write the time of every phase in every measured frame (in ms)
+            as CSV, one line per frame
+
+            Return: -
+        """
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + PHASES)
+            for i, frame in enumerate(self.frames):
+                writer.writerow([i] + ['%.4f' % (frame.get(phase, 0.0)
+                                                 * 1000.0)
+                                       for phase in PHASES])
+
+    def draw_overlay(self):
+        """ Draw the p50 and p95 of each phase in the upper left corner,
+            if the renderer can draw text
+
+            Return: -
+        """
+        renderer = self.parent.renderer
+        if not hasattr(renderer, 'draw_text'):
+            return
+
+        y = 10
+        for phase, values in sorted(self.stats().items()):
+            text = '%-9s p50 %6.2f ms  p95 %6.2f ms' % (
+                phase, values['p50'], values['p95'])
+            renderer.draw_text(text, (130, y), (255, 0, 0), 12)
+            y += 14
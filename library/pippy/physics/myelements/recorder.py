@@ -0,0 +1,289 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from .elements import numpy
+
+# Values recorded per body and frame
+X, Y, ANGLE, VX, VY, OMEGA = list(range(6))
+
+
+class Recorder:
+
+    """ Records position, angle and velocity of every body after each
+        Elements.update() into a NumPy ring buffer, to rewind the world,
+        replay it at any speed or export the trajectories.
+
+        Typical use:
+          world.recorder.start(frames=500)
+          ... world.update() ...
+          world.recorder.rewind(100)
+
+        Every body has a column in the buffer, found by its handle in the
+        registry (see registry.py). Bodies added later get a new column,
+        frames from before they existed (or after they were destroyed)
+        hold NaN for them. Rewinding moves the bodies which still exist,
+        it does not bring back destroyed ones.
+    """
+    recording = False
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.buffer = None
+        self.handles = []  # column: handle of the body
+        self.columns = {}  # handle: column
+        self.count = 0  # Number of recorded frames in the buffer
+        self.head = 0  # Index of the next frame in the buffer
+
+    @property
+    def bodies(self):
+        """ The bodies of the columns, None for destroyed ones """
+        bodies = self.parent.registry.bodies
+        return [bodies[handle] for handle in self.handles]
+
+    def start(self, frames=1000):
+        """ Start recording, keeping the last frames updates
+
+            Return: True if ok, False if NumPy is not available
+        """
+        if numpy is None:
+            print("Recording requires NumPy")
+            return False
+
+        registry = self.parent.registry
+        registry.sync()
+        self.handles = registry.get_live_handles()
+        self.columns = dict((handle, column)
+                            for column, handle in enumerate(self.handles))
+        self.buffer = numpy.full((frames, max(len(self.handles), 16), 6),
+                                 numpy.nan)
+        self.count = 0
+        self.head = 0
+        self.recording = True
+        return True
+
+    def stop(self):
+        """ Stop recording, the recorded frames are kept """
+        self.recording = False
+
+    def restart(self):
+        """ Start again with the current bodies, eg. after loading a world
+            (the handles of the registry start again, too)
+        """
+        if self.recording:
+            self.start(len(self.buffer))
+        else:
+            self.handles = []
+            self.columns = {}
+            self.clear()
+
+    def clear(self):
+        """ Forget the recorded frames """
+        self.count = 0
+        self.head = 0
+
+    def __len__(self):
+        return self.count
+
+    def _recorded(self):
+        # Buffer indices of the recorded frames, oldest first
+        return (self.head - self.count + numpy.arange(self.count)) % \
+            len(self.buffer)
+
+    def _add_columns(self, handles):
+        # Make room for new bodies: first drop the columns of destroyed
+        # bodies which are not in any recorded frame any more, then grow
+        registry_bodies = self.parent.registry.bodies
+        dead = [column for column, handle in enumerate(self.handles)
+                if registry_bodies[handle] is None]
+        if dead:
+            gone = numpy.isnan(
+                self.buffer[self._recorded()][:, dead, X]).all(axis=0)
+            drop = set(numpy.array(dead)[gone].tolist())
+            if drop:
+                keep = [column for column in range(len(self.handles))
+                        if column not in drop]
+                self.buffer[:, :len(keep)] = self.buffer[:, keep]
+                self.buffer[:, len(keep):] = numpy.nan
+                self.handles = [self.handles[column] for column in keep]
+
+        needed = len(self.handles) + len(handles)
+        capacity = self.buffer.shape[1]
+        if needed > capacity:
+            grown = numpy.full((len(self.buffer), max(needed, capacity * 2),
+                                6), numpy.nan)
+            grown[:, :capacity] = self.buffer
+            self.buffer = grown
+
+        self.handles.extend(handles)
+        self.columns = dict((handle, column)
+                            for column, handle in enumerate(self.handles))
+
+    def record(self):
+        """ Add the current state of the bodies as the newest frame
+            (called by Elements.update())
+        """
+        registry = self.parent.registry
+        registry.sync()
+        live = registry.handles  # body: handle, only existing bodies
+
+        columns = self.columns
+        new = [handle for handle in live.values() if handle not in columns]
+        if new:
+            self._add_columns(new)
+            columns = self.columns
+
+        indices = []
+        values = []
+        for body, handle in live.items():
+            position = body.position
+            velocity = body.linearVelocity
+            indices.append(columns[handle])
+            values.append((position.x, position.y, body.angle,
+                           velocity.x, velocity.y, body.angularVelocity))
+
+        frame = self.buffer[self.head]
+        frame[:] = numpy.nan
+        if indices:
+            frame[indices] = values
+
+        self.head = (self.head + 1) % len(self.buffer)
+        self.count = min(self.count + 1, len(self.buffer))
+
+    def _index(self, k):
+        # Buffer index of frame k (0 = oldest, -1 = newest)
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError('frame %i not recorded' % k)
+        return (self.head - self.count + k) % len(self.buffer)
+
+    def frame(self, k):
+        """ Get a recorded frame, k may be a float between two frames
+
+            Parameters:
+              k ... frame number (0 = oldest, -1 = newest)
+
+            Return: array (columns, 6) of x, y, angle, vx, vy, omega, NaN
+                    for bodies which did not exist (see handles)
+        """
+        n = len(self.handles)
+        i = int(k)
+        a = k - i
+        frame = self.buffer[self._index(i), :n]
+        if a == 0:
+            return frame.copy()
+        return frame + (self.buffer[self._index(i + 1), :n] - frame) * a
+
+    def show(self, k):
+        """ Move the bodies to recorded frame k (a float interpolates
+            between two frames), without changing the recording
+
+            Return: -
+        """
+        frame = self.frame(k)
+        for body, state in zip(self.bodies, frame.tolist()):
+            x, y, angle, vx, vy, omega = state
+            if body is None or x != x:  # Destroyed, or not there yet
+                continue
+            body.transform = ((x, y), angle)
+            body.linearVelocity = (vx, vy)
+            body.angularVelocity = omega
+            body.awake = True
+
+    def rewind(self, k):
+        """ Go back to frame k and forget all newer frames, so recording
+            continues from there. A float k (eg. from replay()) goes back
+            to the frame before it, k is clamped to the recorded frames.
+
+            Return: -
+        """
+        if not self.count:
+            raise IndexError('no frames recorded')
+        k = int(k)
+        if k < 0:
+            k += self.count
+        k = max(0, min(k, self.count - 1))
+        self.show(k)
+        self.head = (self._index(k) + 1) % len(self.buffer)
+        self.count = k + 1
+
+    def replay(self, speed=1.0, start=None, end=None):
+        """ Generator that moves the bodies through the recorded frames.
+            Draw the world for each step:
+
+              for k in world.recorder.replay(0.5):
+                  world.draw()
+
+            Parameters:
+              speed ... frames per step (may be a float, eg. 0.5 for
+                        slow motion, or negative to play backwards)
+              start ... first frame (default: the oldest, or the newest
+                        if playing backwards)
+              end ..... last frame (default: the other end)
+
+            Yield: current frame number (float)
+        """
+        if speed == 0:
+            raise ValueError('replay speed must not be 0')
+
+        if start is None:
+            start = 0 if speed > 0 else self.count - 1
+        if end is None:
+            end = self.count - 1 if speed > 0 else 0
+        if start < 0:
+            start += self.count
+        if end < 0:
+            end += self.count
+
+        k = float(start)
+        while min(start, end) <= k <= max(start, end):
+            self.show(k)
+            yield k
+            k += speed
+
+    def trajectory(self, body=None):
+        """ Export the recorded frames in chronological order
+
+            Parameters:
+              body ... only the frames of this body (default: all bodies,
+                       in the order of handles)
+
+            Return: array (frames, columns, 6) -- or (frames, 6) for a
+                    body -- of x, y, angle, vx, vy, omega in meters and
+                    radians, NaN where a body did not exist
+        """
+        indices = self._recorded()
+        if body is None:
+            return self.buffer[indices, :len(self.handles)]
+
+        handle = self.parent.registry.handles.get(body)
+        if handle not in self.columns:
+            raise ValueError('body not recorded')
+        return self.buffer[indices, self.columns[handle]]
+
+    def save(self, path):
+        """ Save the trajectories (see trajectory()) as a .npy file """
+        numpy.save(path, self.trajectory())
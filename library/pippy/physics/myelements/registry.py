@@ -0,0 +1,361 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from .elements import box2d
+from . import tools
+
+
+class Registry:
+
+    """ Gives every body a stable integer handle, and keeps the color,
+        tags and save id of the bodies in lists indexed by that handle.
+        draw(), picking and serialization read them from here instead of
+        looking into the userData dict of each body.
+
+        Bodies made with world.add are registered when they are created,
+        other bodies when they are first drawn (with the color of their
+        userData). Destroyed bodies are removed by a destruction listener.
+
+        The userData dict of a registered body is replaced by a BodyData,
+        a dict which passes body.userData['color'] = ... on to the
+        registry, so draw() never has to look into the userData.
+
+        Typical use:
+          world.registry.set_color(body, (255, 0, 0))
+          world.registry.tag(body, 'player')
+          world.get_bodies_at_pos(pos, tag='player')
+
+        Handles are never reused, a removed body leaves None in the lists
+        until clear().
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        """ Forget all bodies (the world was replaced or emptied) """
+        self.handles = {}  # body: handle
+        self.bodies = []  # handle: body, None if removed
+        self.colors = []  # handle: (r, g, b)
+        self.userdata = []  # handle: userData dict of the body, or None
+        self.tags = []  # handle: set of tags
+        self.saveids = []  # handle: save id, None if not saved
+        self.saveid_handles = {}  # save id: handle
+        # Changes whenever a body is added or removed or its color changes
+        self.version += 1
+
+    def attach(self, world):
+        """ Watch a (new) world for destroyed bodies """
+        self.clear()
+        world.destructionListener = kDestructionListener(self)
+
+    def add(self, body, color=None, tags=(), saveid=None):
+        """ Register a body, or update the values of a registered one
+
+            Parameters:
+              body ..... box2d body
+              color .... (r, g, b), default: the color of the userData
+              tags ..... tags of the body
+              saveid ... id of the body in a saved file
+
+            Return: handle (int)
+        """
+        userdata = body.userData
+        if not isinstance(userdata, dict):
+            userdata = None
+
+        if color is None:
+            if userdata is not None and 'color' in userdata:
+                color = userdata['color']
+            else:
+                color = self.parent.colors[0]
+        color = to_rgb(color)
+
+        handle = self.handles.get(body)
+        if handle is None:
+            handle = len(self.bodies)
+            self.handles[body] = handle
+            self.bodies.append(body)
+            self.colors.append(color)
+            self.userdata.append(None)
+            self.tags.append(set(tags))
+            self.saveids.append(None)
+        else:
+            self.colors[handle] = color
+            self.tags[handle].update(tags)
+
+        if userdata is not None and userdata is not self.userdata[handle]:
+            # Color changes in the userData go through the registry
+            userdata = BodyData(userdata)
+            userdata.registry = self
+            userdata.handle = handle
+            body.userData = userdata
+            self.userdata[handle] = userdata
+        self.version += 1
+
+        if saveid is not None:
+            self.set_saveid(handle, saveid)
+
+        return handle
+
+    def remove(self, body):
+        """ Forget a body (it was destroyed)
+
+            Return: -
+        """
+        handle = self.handles.pop(body, None)
+        if handle is None:
+            return
+
+        saveid = self.saveids[handle]
+        if saveid is not None:
+            del self.saveid_handles[saveid]
+        self.version += 1
+
+        userdata = self.userdata[handle]
+        if userdata is not None:
+            userdata.registry = None
+
+        self.bodies[handle] = None
+        self.colors[handle] = None
+        self.userdata[handle] = None
+        self.tags[handle] = None
+        self.saveids[handle] = None
+
+    def get_handle(self, body):
+        """ The handle of a body, registering it if necessary
+
+            Return: handle (int)
+        """
+        handle = self.handles.get(body)
+        if handle is None:
+            handle = self.add(body)
+        return handle
+
+    def sync(self):
+        """ Register the bodies which were not created by world.add, and
+            drop those destroyed without a fixture (which the destruction
+            listener does not see). Only walks the bodies if the count of
+            the world differs from ours.
+
+            Return: -
+        """
+        world = self.parent.world
+        if len(self.handles) == world.bodyCount:
+            return
+
+        alive = set(world.bodies)
+        for body in list(self.handles):
+            if body not in alive:
+                self.remove(body)
+
+        for body in world.bodies:
+            if body not in self.handles:
+                self.add(body)
+
+    def items(self):
+        """ All registered bodies with their color, in the order they were
+            registered (which is the order of world.bodies for bodies made
+            with world.add)
+
+            Return: [(body, color), ...]
+        """
+        colors = self.colors
+        return [(body, colors[handle])
+                for body, handle in self.handles.items()]
+
+    def get_live_handles(self):
+        """ Return: [handle, ...] of the bodies which were not destroyed,
+                    in the order they were registered
+        """
+        return list(self.handles.values())
+
+    def get_color(self, body):
+        """ Return: (r, g, b) """
+        return self.colors[self.get_handle(body)]
+
+    def get_colors(self, bodies):
+        """ The colors of many bodies at once
+
+            Return: [(r, g, b), ...] in the order of bodies
+        """
+        handles = self.handles
+        result = []
+        for body in bodies:
+            handle = handles.get(body)
+            if handle is None:
+                handle = self.add(body)
+            result.append(self.colors[handle])
+        return result
+
+    def set_color(self, body, color):
+        """ Change the color of a body (also in its userData, which is
+            saved with the world)
+
+            Return: -
+        """
+        color = to_rgb(color)
+        self.colors[self.get_handle(body)] = color
+        self.version += 1
+
+        userdata = body.userData
+        if isinstance(userdata, dict):
+            dict.__setitem__(userdata, 'color', color)
+
+    def tag(self, body, *tags):
+        """ Add tags (any hashable values) to a body
+
+            Return: -
+        """
+        self.tags[self.get_handle(body)].update(tags)
+
+    def untag(self, body, *tags):
+        """ Remove tags from a body
+
+            Return: -
+        """
+        self.tags[self.get_handle(body)].difference_update(tags)
+
+    def has_tag(self, body, tag):
+        """ Return: True if the body has the tag, False otherwise """
+        handle = self.handles.get(body)
+        return handle is not None and tag in self.tags[handle]
+
+    def get_tags(self, body):
+        """ Return: set of tags (a copy) """
+        return set(self.tags[self.get_handle(body)])
+
+    def get_bodies_with_tag(self, tag):
+        """ Return: [body, ...] in the order they were registered """
+        return [body for body, tags in zip(self.bodies, self.tags)
+                if body is not None and tag in tags]
+
+    def touch(self):
+        """ Mark the bodies as changed, eg. after moving a static or
+            sleeping body by hand, so the renderer's cached layer of the
+            resting bodies is drawn again
+
+            Return: -
+        """
+        self.version += 1
+
+    def _color_changed(self, handle, userdata, color):
+        # Called by BodyData; a stale BodyData (of a removed body, or from
+        # before clear()) must not change the color of another body
+        if handle < len(self.userdata) and self.userdata[handle] is userdata:
+            self.colors[handle] = to_rgb(color)
+            self.version += 1
+
+    def number_bodies(self):
+        """ Give the bodies of the world consecutive save ids, the ground
+            body 0 and the others 1, 2, ... in the order of world.bodies
+
+            Return: -
+        """
+        world = self.parent.world
+        for saveid in self.saveid_handles:
+            self.saveids[self.saveid_handles[saveid]] = None
+        self.saveid_handles = {}
+
+        self.set_saveid(self.get_handle(world.groundBody), 0)
+        saveid = 1
+        for body in world.bodies:
+            if body != world.groundBody:
+                self.set_saveid(self.get_handle(body), saveid)
+                saveid += 1
+
+    def set_saveid(self, handle, saveid):
+        old = self.saveids[handle]
+        if old is not None:
+            self.saveid_handles.pop(old, None)
+
+        self.saveids[handle] = saveid
+        self.saveid_handles[saveid] = handle
+
+    def get_saveid(self, body):
+        """ Return: save id of the body (see number_bodies), None if it has
+                    none
+        """
+        handle = self.handles.get(body)
+        if handle is None:
+            return None
+        return self.saveids[handle]
+
+    def get_body_with_saveid(self, saveid):
+        """ Return: body or None """
+        handle = self.saveid_handles.get(saveid)
+        if handle is None:
+            return None
+        return self.bodies[handle]
+
+
+def to_rgb(color):
+    """ Convert a color to (r, g, b), from '#rrggbb' or any sequence """
+    if isinstance(color, str):
+        return tools.hex2rgb(color)
+    return tuple(color)
+
+
+class BodyData(dict):
+
+    """ The userData dict of a registered body: setting its 'color' also
+        changes the color in the registry. Saved and pickled as a plain
+        dict.
+    """
+    registry = None
+    handle = None
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        if key == 'color' and self.registry is not None:
+            self.registry._color_changed(self.handle, self, value)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        if 'color' in self and self.registry is not None:
+            self.registry._color_changed(self.handle, self, self['color'])
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class kDestructionListener(box2d.b2DestructionListener):
+
+    """ Box2D says goodbye to every fixture of a body it destroys, that is
+        when the body leaves the registry and its contact callbacks are
+        dropped
+    """
+
+    def __init__(self, registry):
+        box2d.b2DestructionListener.__init__(self)
+        self.registry = registry
+
+    def SayGoodbye(self, obj):
+        if isinstance(obj, box2d.b2Fixture):
+            self.registry.remove(obj.body)
+            self.registry.parent.callbacks.remove_body(obj.body)
@@ -0,0 +1,290 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+# Binary world snapshots
+#
+# A snapshot stores the bodies, fixtures and joints of a world as packed
+# arrays, instead of one dict per object like Elements.json_save:
+#
+#    magic ........ SNAPSHOT_MAGIC
+#    header size .. uint32
+#    header ....... JSON: array layout, userData, additional_vars
+#    arrays ....... raw machine values, each aligned to 8 bytes
+#
+# Bodies are referred to by their index in the body arrays (the ground
+# body is -1), so loading needs no search for the bodies of a joint.
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from .elements import box2d
+
+SNAPSHOT_MAGIC = b'ELEMSNAP'
+SNAPSHOT_VERSION = 1
+
+JOINT_REVOLUTE = 0
+JOINT_DISTANCE = 1
+
+# name: typecode, values per item
+ARRAYS = [
+    # type, first fixture, fixture count
+    ('body_int', 'i', 3),
+    # x, y, angle, angular velocity, linear velocity x, y
+    ('body_float', 'd', 6),
+    # shape type, first vertex, vertex count
+    ('fixture_int', 'i', 3),
+    # density, restitution, friction, radius, local position x, y
+    ('fixture_float', 'd', 6),
+    # x, y (polygon vertices)
+    ('vertex', 'd', 2),
+    # type, body 1, body 2, collideConnected, enableMotor
+    ('joint_int', 'i', 5),
+    # anchor 1 x, y, anchor 2 x, y, motorSpeed, maxMotorTorque
+    ('joint_float', 'd', 6),
+]
+
+
+def save(elements, path, additional_vars={}):
+    """ Write the world of elements to the file path
+
+        Return: -
+    """
+    world = elements.world
+    ground = world.groundBody
+    data = dict((name, array(typecode)) for name, typecode, n in ARRAYS)
+
+    body_int = data['body_int']
+    body_float = data['body_float']
+    fixture_int = data['fixture_int']
+    fixture_float = data['fixture_float']
+    vertex = data['vertex']
+
+    index = {}
+    body_userdata = []
+    for body in world.bodies:
+        if body == ground:
+            continue
+
+        index[body] = len(index)
+        body_userdata.append(body.userData)
+
+        fixtures = body.fixtures
+        body_int.extend((body.type, len(fixture_int) // 3, len(fixtures)))
+        position = body.position
+        velocity = body.linearVelocity
+        body_float.extend((position.x, position.y, body.angle,
+                           body.angularVelocity, velocity.x, velocity.y))
+
+        for fixture in fixtures:
+            shape = fixture.shape
+            if fixture.type == box2d.b2Shape.e_circle:
+                fixture_int.extend((fixture.type, 0, 0))
+                x, y = shape.pos.tuple
+                radius = shape.radius
+            else:
+                vertices = shape.vertices
+                fixture_int.extend((fixture.type, len(vertex) // 2,
+                                    len(vertices)))
+                for v in vertices:
+                    vertex.extend(v)
+                x = y = radius = 0.0
+            fixture_float.extend((fixture.density, fixture.restitution,
+                                  fixture.friction, radius, x, y))
+
+    joint_int = data['joint_int']
+    joint_float = data['joint_float']
+    joint_userdata = []
+    for joint in world.joints:
+        if isinstance(joint, box2d.b2RevoluteJoint):
+            a1 = a2 = joint.anchorA
+            values = (JOINT_REVOLUTE, joint.motorEnabled)
+            motor = (joint.motorSpeed, joint.GetMaxMotorTorque())
+        elif isinstance(joint, box2d.b2DistanceJoint):
+            a1 = joint.anchorA
+            a2 = joint.anchorB
+            values = (JOINT_DISTANCE, False)
+            motor = (0.0, 0.0)
+        else:
+            continue
+
+        joint_int.extend((values[0], index.get(joint.bodyA, -1),
+                          index.get(joint.bodyB, -1),
+                          joint.collideConnected, values[1]))
+        joint_float.extend((a1.x, a1.y, a2.x, a2.y) + motor)
+        joint_userdata.append(joint.userData)
+
+    layout = []
+    offset = 0
+    for name, typecode, n in ARRAYS:
+        size = len(data[name]) * data[name].itemsize
+        layout.append([name, typecode, len(data[name]) // n, offset])
+        offset += size + (-size % 8)
+
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'byteorder': sys.byteorder,
+        'arrays': layout,
+        'body_userdata': body_userdata,
+        'joint_userdata': joint_userdata,
+        'additional_vars': additional_vars,
+    }).encode('utf-8')
+    header += b' ' * (-(len(SNAPSHOT_MAGIC) + 4 + len(header)) % 8)
+
+    with open(path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name, typecode, n in ARRAYS:
+            data[name].tofile(f)
+            f.write(b'\0' * (-len(data[name]) * data[name].itemsize % 8))
+
+
+def read(path, use_mmap=False):
+    """ Read the header and the arrays of a snapshot
+
+        Return: header (dict), arrays (dict of name: sequence)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError('%s is not a world snapshot' % path)
+        size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size).decode('utf-8'))
+        start = len(SNAPSHOT_MAGIC) + 4 + size
+
+        if header['version'] > SNAPSHOT_VERSION:
+            raise ValueError('snapshot version %i is not supported' %
+                             header['version'])
+
+        swap = header['byteorder'] != sys.byteorder
+        if use_mmap and not swap:
+            buf = memoryview(mmap.mmap(f.fileno(), 0,
+                                       access=mmap.ACCESS_READ))
+        else:
+            buf = memoryview(f.read())
+            start = 0
+
+    counts = dict((name, n) for name, typecode, n in ARRAYS)
+    arrays = {}
+    for name, typecode, length, offset in header['arrays']:
+        itemsize = array(typecode).itemsize
+        end = start + offset + length * counts[name] * itemsize
+        values = buf[start + offset:end]
+        if swap:
+            values = array(typecode, values.tobytes())
+            values.byteswap()
+        else:
+            values = values.cast(typecode)
+        arrays[name] = values
+
+    return header, arrays
+
+
+def load(elements, path, use_mmap=False):
+    """ Replace the world of elements with the snapshot in the file path
+
+        Return: additional_vars (dict)
+    """
+    header, data = read(path, use_mmap)
+
+    world = elements.world
+    for joint in world.joints:
+        world.DestroyJoint(joint)
+    for body in world.bodies:
+        if body != world.groundBody:
+            world.DestroyBody(body)
+
+    body_int = data['body_int']
+    body_float = data['body_float']
+    fixture_int = data['fixture_int']
+    fixture_float = data['fixture_float']
+    vertex = data['vertex']
+
+    # Reuse the definitions for all bodies and fixtures
+    bodyDef = box2d.b2BodyDef()
+    circleDef = box2d.b2FixtureDef()
+    circleDef.shape = box2d.b2CircleShape()
+    polyDef = box2d.b2FixtureDef()
+    polyDef.shape = box2d.b2PolygonShape()
+
+    bodies = []
+    for i, userdata in enumerate(header['body_userdata']):
+        type_, first, count = body_int[i * 3:i * 3 + 3]
+        x, y, angle, omega, vx, vy = body_float[i * 6:i * 6 + 6]
+
+        bodyDef.type = type_
+        bodyDef.position = (x, y)
+        bodyDef.angle = angle
+        bodyDef.userData = userdata
+        body = world.CreateBody(bodyDef)
+        body.angularVelocity = omega
+        body.linearVelocity = (vx, vy)
+        bodies.append(body)
+
+        for j in range(first, first + count):
+            shape_type, v_first, v_count = fixture_int[j * 3:j * 3 + 3]
+            density, restitution, friction, radius, px, py = \
+                fixture_float[j * 6:j * 6 + 6]
+
+            if shape_type == box2d.b2Shape.e_circle:
+                fixtureDef = circleDef
+                fixtureDef.shape.radius = radius
+                fixtureDef.shape.pos = (px, py)
+            else:
+                fixtureDef = polyDef
+                v = vertex[v_first * 2:(v_first + v_count) * 2]
+                fixtureDef.shape.vertices = list(zip(v[0::2], v[1::2]))
+
+            fixtureDef.density = density
+            fixtureDef.restitution = restitution
+            fixtureDef.friction = friction
+            body.CreateFixture(fixtureDef)
+
+    joint_int = data['joint_int']
+    joint_float = data['joint_float']
+    for i, userdata in enumerate(header['joint_userdata']):
+        type_, b1, b2, collide, motor = joint_int[i * 5:i * 5 + 5]
+        x1, y1, x2, y2, speed, torque = joint_float[i * 6:i * 6 + 6]
+
+        body1 = bodies[b1] if b1 >= 0 else world.groundBody
+        body2 = bodies[b2] if b2 >= 0 else world.groundBody
+
+        if type_ == JOINT_REVOLUTE:
+            jointDef = box2d.b2RevoluteJointDef()
+            jointDef.Initialize(body1, body2, (x1, y1))
+            jointDef.enableMotor = bool(motor)
+            jointDef.motorSpeed = speed
+            jointDef.maxMotorTorque = torque
+        else:
+            jointDef = box2d.b2DistanceJointDef()
+            jointDef.Initialize(body1, body2, (x1, y1), (x2, y2))
+
+        jointDef.collideConnected = bool(collide)
+        jointDef.userData = userdata
+        world.CreateJoint(jointDef)
+
+    return header['additional_vars']
@@ -0,0 +1,233 @@
+"""
+This file is part of the 'Elements' Project
+Elements is a 2D Physics API for Python (supporting Box2D2)
+
+Copyright (C) 2008, The Elements Team, <elements@linuxuser.at>
+
+Home:  http://elements.linuxuser.at
+IRC:   #elements on irc.freenode.org
+
+Code:  http://www.assembla.com/wiki/show/elements
+       svn co http://svn2.assembla.com/svn/elements
+
+License:  GPLv3 | See LICENSE for the full text
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import queue
+import threading
+import traceback
+from collections import namedtuple
+from time import monotonic
+
+from .elements import box2d
+
+# What the render loop gets from the stepper thread:
+#   bodies ........ ((color, (x, y, angle), shapes), ...) in meters, with
+#                   shapes (('circle', (x, y), radius) or
+#                           ('polygon', ((x, y), ...)), ...) in body
+#                   coordinates
+#   joints ........ ((revolute, anchorA, anchorB), ...) in meters
+#   track_center .. world center of camera.track_body, or None
+#   steps ......... number of steps done by the thread
+Snapshot = namedtuple('Snapshot', 'bodies joints track_center steps')
+
+
+class Stepper:
+
+    """ Steps the world in a worker thread at its own rate, so a slow
+        frame does not hold up the physics (and drawing the last step
+        overlaps with computing the next one).
+
+        After every step, the thread publishes an immutable Snapshot of the
+        body transforms, which Elements.draw() draws instead of the world.
+
+        Typical use:
+          world.stepper.start(fps=60)
+          while running:
+              ... events ...
+              world.draw()
+          world.stepper.stop()
+
+        While the thread runs, changes to the world have to wait until it
+        is between two steps: pass them to call() to queue them, or hold
+        the lock. Elements.mouse_move() and add.mouseJoint() queue
+        themselves, the other world.add methods and the load methods
+        hold the lock.
+    """
+    running = False
+    snapshot = None
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.lock = threading.RLock()
+        self.commands = queue.Queue()
+        self.thread = None
+        self.steps = 0
+        self._stop_event = threading.Event()
+        # handle -> shapes, they don't change while stepping. Keyed by the
+        # handle of the registry, as Box2D reuses the memory of destroyed
+        # bodies (and the proxies compare by address). The handles start
+        # again when the registry is cleared, which replaces its lists.
+        self._shapes = {}
+        self._shapes_bodies = None
+
+    def start(self, fps=50.0, vel_iterations=10, pos_iterations=8):
+        """ Start stepping the world in the worker thread
+
+            Parameters:
+              fps ............. steps per second
+              vel_iterations .. velocity substeps per step
+              pos_iterations .. position substeps per step
+
+            Return: True if started, False if already running
+        """
+        if self.running:
+            return False
+
+        self.fps = fps
+        self.iterations = (vel_iterations, pos_iterations)
+        self.publish()
+
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run,
+                                       name='elements-stepper')
+        self.thread.daemon = True
+        self.running = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """ Stop the worker thread, the queued commands are applied.
+            Afterwards Elements.update() steps the world again.
+
+            Return: -
+        """
+        if not self.running:
+            return
+
+        self._stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.running = False
+        self.apply_commands()
+        self.parent.reset_timestep()
+
+    def call(self, func, *args, **kwargs):
+        """ Call func(*args, **kwargs) between two steps of the worker
+            thread -- right away if the thread is not running
+
+            Return: -
+        """
+        if not self.running or threading.current_thread() is self.thread:
+            func(*args, **kwargs)
+        else:
+            self.commands.put((func, args, kwargs))
+
+    def apply_commands(self):
+        """ Run the queued commands (called by the worker thread) """
+        with self.lock:
+            while True:
+                try:
+                    func, args, kwargs = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    # Don't let one broken command end the thread
+                    traceback.print_exc()
+
+                # Bodies may have been added, removed or changed
+                self._shapes.clear()
+
+    def publish(self):
+        """ Make a new Snapshot of the world for the render loop """
+        parent = self.parent
+        bodies = []
+        shapes_cache = {}
+
+        with self.lock:
+            registry = parent.registry
+            registry.sync()
+            if self._shapes_bodies is not registry.bodies:
+                self._shapes = {}
+                self._shapes_bodies = registry.bodies
+
+            colors = registry.colors
+            for body, handle in registry.handles.items():
+                shapes = self._shapes.get(handle)
+                if shapes is None:
+                    shapes = self._get_shapes(body)
+                shapes_cache[handle] = shapes
+                clr = colors[handle]
+                if not shapes:
+                    continue
+
+                x, y = body.position.tuple
+                bodies.append((clr, (x, y, body.angle), shapes))
+
+            joints = tuple(
+                (isinstance(joint, box2d.b2RevoluteJoint),
+                 joint.anchorA.tuple, joint.anchorB.tuple)
+                for joint in parent.world.joints)
+
+            track_body = parent.camera.track_body
+            track_center = track_body.worldCenter.tuple \
+                if track_body else None
+
+        # Only keep the shapes of bodies which still exist
+        self._shapes = shapes_cache
+        self.snapshot = Snapshot(tuple(bodies), joints, track_center,
+                                 self.steps)
+
+    def _get_shapes(self, body):
+        shapes = []
+        for fixture in body.fixtures:
+            type_ = fixture.type
+            shape = fixture.shape
+
+            if type_ == box2d.b2Shape.e_circle:
+                shapes.append(('circle', shape.pos.tuple, shape.radius))
+
+            elif type_ == box2d.b2Shape.e_polygon:
+                shapes.append(('polygon', tuple(shape.vertices)))
+
+            else:
+                print("unknown shape type:%d" % type_)
+
+        return tuple(shapes)
+
+    def _run(self):
+        dt = 1.0 / self.fps
+        parent = self.parent
+        next_step = monotonic()
+
+        while not self._stop_event.is_set():
+            with self.lock:
+                self.apply_commands()
+                if parent.run_physics:
+                    parent.world.Step(dt, *self.iterations)
+                    self.steps += 1
+                    if parent.recorder.recording:
+                        parent.recorder.record()
+                self.publish()
+
+            next_step += dt
+            delay = next_step - monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            elif delay < -parent.max_substeps * dt:
+                # Too slow to keep up: drop the time instead of catching up
+                next_step = monotonic()
@@ -24,6 +24,12 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+# The NumPy version of points_in_poly, if NumPy is available
+try:
+    from . import geometry
+except ImportError:
+    geometry = None
+
 # Some Hex Tools
 
 
@@ -68,3 +74,15 @@ def point_in_poly(point, poly):
                         inside = not inside
         p1x, p1y = p2x, p2y
     return inside
+
+
+def points_in_poly(points, poly):
+    """ Test many points at once, see point_in_poly. With NumPy, all
+        points are tested against all edges at once, which pays off from
+        about 100 point-edge pairs on.
+
+        Return: [True or False, ...]
+    """
+    if geometry is not None and len(points) * len(poly) >= 100:
+        return geometry.points_in_poly(points, poly).tolist()
+    return [point_in_poly(point, poly) for point in points]
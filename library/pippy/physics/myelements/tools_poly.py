@@ -24,7 +24,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from functools import partial
+import heapq
 
 from math import fabs
 from math import sqrt
@@ -111,7 +111,6 @@ def is_line(vertices, tolerance=25.0):
 
     # Get maximum difference
     alpha_diff = fabs(alphas[-1] - alphas[0])
-    print("alpha difference:", alpha_diff)
 
     if alpha_diff < tolerance:
         return True
@@ -326,42 +325,314 @@ def reduce_poly(points, tolerance=50):
     return reduced_ps
 
 
+def simplify_poly(points, count, closed=False):
+    """ Reduce a polyline or polygon to count vertices, removing the
+        vertices which change the shape least first (Visvalingam-Whyatt).
+        Each step removes the vertex with the smallest triangle with its
+        neighbours, so the whole reduction takes O(n log n).
+
+        Parameters:
+          points ... [(x, y), ...]
+          count .... number of vertices to keep
+          closed ... True for a polygon, False to keep the end points of
+                     a line
+
+        Return: [(x, y), ...] with at most count vertices
+    """
+    n = len(points)
+    if n <= count:
+        return list(points)
+
+    prev = [i - 1 for i in range(n)]
+    following = [i + 1 for i in range(n)]
+    if closed:
+        prev[0] = n - 1
+        following[-1] = 0
+
+    def area(i):
+        if prev[i] < 0 or following[i] >= n:
+            # End point of a line
+            return float('inf')
+        (x0, y0), (x1, y1), (x2, y2) = \
+            points[prev[i]], points[i], points[following[i]]
+        return fabs((x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)) / 2.0
+
+    areas = [area(i) for i in range(n)]
+    heap = [(a, i) for i, a in enumerate(areas)]
+    heapq.heapify(heap)
+    removed = [False] * n
+
+    left = n
+    while left > count and heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            # Outdated entry of a vertex whose neighbours changed
+            continue
+        if a == float('inf'):
+            break
+
+        removed[i] = True
+        left -= 1
+        p, q = prev[i], following[i]
+        if p >= 0:
+            following[p] = q
+        if q < n:
+            prev[q] = p
+
+        # The neighbours must not become less important than the removed
+        # vertex, else they would be removed before it in the order
+        for j in (p, q):
+            if 0 <= j < n:
+                areas[j] = max(area(j), a)
+                heapq.heappush(heap, (areas[j], j))
+
+    return [p for i, p in enumerate(points) if not removed[i]]
+
+
 def convex_hull(points):
     """Create a convex hull from a list of points.
-    This function uses the Graham Scan Algorithm.
+    This function uses Andrew's monotone chain algorithm.
 
-    :return: Convex hull as a list of (x,y)
+    :return: Convex hull as a list of (x,y), counter-clockwise
     """
-    # Find lowest rightmost point
-    p0 = points[0]
-    for p in points[1:]:
-        if p[1] < p0[1]:
-            p0 = p
-        elif p[1] == p0[1] and p[0] > p0[0]:
-            p0 = p
-    points.remove(p0)
-
-    # Sort the points angularly about p0 as center
-    f = partial(is_left, p0)
-    points.sort(cmp=f)
-    points.reverse()
-    points.insert(0, p0)
-
-    # Find the hull points
-    hull = [p0, points[1]]
-
-    for p in points[2:]:
-
-        pt1 = hull[-1]
-        pt2 = hull[-2]
-        l = is_left(pt2, pt1, p)
-        if l > 0:
-            hull.append(p)
-        else:
-            while l <= 0 and len(hull) > 2:
+    points = sorted(set(tuple(p) for p in points))
+    if len(points) < 3:
+        return points
+
+    def chain(points):
+        hull = []
+        for p in points:
+            while len(hull) >= 2 and is_left(hull[-2], hull[-1], p) <= 0:
                 hull.pop()
-                pt1 = hull[-1]
-                pt2 = hull[-2]
-                l = is_left(pt2, pt1, p)
             hull.append(p)
-    return hull
+        return hull
+
+    lower = chain(points)
+    upper = chain(reversed(points))
+    return lower[:-1] + upper[:-1]
+
+
+def poly_area(points):
+    """ Signed area of a polygon (shoelace formula)
+
+        Return: area, > 0 if the points run counter-clockwise
+                (with the y axis pointing up)
+    """
+    area = 0.0
+    x1, y1 = points[-1]
+    for x2, y2 in points:
+        area += x1 * y2 - x2 * y1
+        x1, y1 = x2, y2
+    return area / 2.0
+
+
+def _cross(p0, p1, p2):
+    # > 0 if p0, p1, p2 turn left
+    return (p1[0] - p0[0]) * (p2[1] - p0[1]) - \
+        (p1[1] - p0[1]) * (p2[0] - p0[0])
+
+
+def _in_triangle(p, a, b, c):
+    # Inside or on the border of the counter-clockwise triangle a, b, c
+    return _cross(a, b, p) >= 0 and _cross(b, c, p) >= 0 and \
+        _cross(c, a, p) >= 0
+
+
+def triangulate(points):
+    """ Split a simple polygon into triangles by ear clipping
+
+        Parameters:
+          points ... counter-clockwise polygon [(x, y), ...], not closed
+
+        Return: [(i, j, k), ...] indices of counter-clockwise triangles
+        Raises: ValueError if the polygon intersects itself
+    """
+    indices = list(range(len(points)))
+    triangles = []
+
+    i = 0
+    failed = 0  # Vertices in a row which are no ear
+    while len(indices) > 3:
+        n = len(indices)
+        a, b, c = indices[(i - 1) % n], indices[i % n], indices[(i + 1) % n]
+        pa, pb, pc = points[a], points[b], points[c]
+
+        turn = _cross(pa, pb, pc)
+        if turn == 0:
+            # b lies on the line from a to c, drop it
+            del indices[i % n]
+            failed = 0
+            continue
+
+        is_ear = turn > 0
+        if is_ear:
+            for j in indices:
+                if j not in (a, b, c) and points[j] not in (pa, pb, pc) \
+                        and _in_triangle(points[j], pa, pb, pc):
+                    is_ear = False
+                    break
+
+        if is_ear:
+            triangles.append((a, b, c))
+            del indices[i % n]
+            failed = 0
+        else:
+            i += 1
+            failed += 1
+            if failed > n:
+                raise ValueError('polygon intersects itself')
+
+    if len(indices) == 3 and \
+            _cross(*[points[j] for j in indices]) > 0:
+        triangles.append(tuple(indices))
+
+    return triangles
+
+
+def remove_collinear(points, tolerance=1e-6):
+    """ Remove the vertices of a polygon which lie on the line between
+        their neighbours (and repeated vertices)
+
+        Parameters:
+          points ...... polygon [(x, y), ...], not closed
+          tolerance ... sine of the angle up to which a corner counts
+                        as straight
+
+        Return: [(x, y), ...]
+    """
+    result = list(points)
+    k = 0
+    while k < len(result) and len(result) > 2:
+        p0, p1, p2 = result[k - 1], result[k], result[(k + 1) % len(result)]
+        a = (p1[0] - p0[0], p1[1] - p0[1])
+        b = (p2[0] - p1[0], p2[1] - p1[1])
+        lengths = sqrt((a[0] * a[0] + a[1] * a[1])
+                       * (b[0] * b[0] + b[1] * b[1]))
+        if fabs(a[0] * b[1] - a[1] * b[0]) <= tolerance * lengths:
+            del result[k]
+            # The previous vertex has a new neighbour now
+            k = max(k - 1, 0)
+        else:
+            k += 1
+    return result
+
+
+def convex_partition(points, max_vertices=8):
+    """ Split a simple polygon into few convex polygons: triangulate it,
+        then remove diagonals as long as the merged pieces stay convex
+        (Hertel-Mehlhorn, at most four times the optimal number of pieces)
+
+        Parameters:
+          points ......... polygon [(x, y), ...], not closed
+          max_vertices ... maximum vertices per piece
+
+        Return: [[(x, y), ...], ...] counter-clockwise convex polygons
+        Raises: ValueError if the polygon intersects itself
+    """
+    points = remove_collinear([tuple(p) for p in points])
+    if len(points) < 3:
+        return []
+    if poly_area(points) < 0:
+        points.reverse()
+
+    pieces = dict(enumerate(list(t) for t in triangulate(points)))
+
+    # Edge (a, b) -> piece with this edge (counter-clockwise)
+    edges = {}
+    for key, piece in pieces.items():
+        for k in range(len(piece)):
+            edges[(piece[k - 1], piece[k])] = key
+
+    def convex_at(prev, vertex, next):
+        return _cross(points[prev], points[vertex], points[next]) >= 0
+
+    merged = True
+    while merged:
+        merged = False
+        for a, b in list(edges):
+            key = edges.get((a, b))
+            other = edges.get((b, a))
+            if key is None or other is None or other == key:
+                continue
+
+            p1 = pieces[key]
+            p2 = pieces[other]
+            if len(p1) + len(p2) - 2 > max_vertices:
+                continue
+
+            # Walk p1 from b around to a, then p2 from a around to b
+            k = p1.index(b)
+            walk1 = p1[k:] + p1[:k]
+            k = p2.index(a)
+            walk2 = p2[k:] + p2[:k]
+            polygon = walk1 + walk2[1:-1]
+
+            # The corners at a and b must stay convex
+            n = len(polygon)
+            ia = len(walk1) - 1
+            if not convex_at(polygon[ia - 1], a, polygon[(ia + 1) % n]) or \
+                    not convex_at(polygon[-1], b, polygon[1]):
+                continue
+
+            del pieces[other]
+            del edges[(a, b)]
+            del edges[(b, a)]
+            pieces[key] = polygon
+            for k in range(n):
+                edges[(polygon[k - 1], polygon[k])] = key
+            merged = True
+
+    return [[points[i] for i in piece] for piece in pieces.values()]
+
+
+def stroke_outline(points, width):
+    """ Outline of a line along points with a thickness, as a polygon
+
+        Parameters:
+          points .. open polyline [(x, y), ...]
+          width ... thickness of the line
+
+        Return: [(x, y), ...] polygon: one side forwards, the other one
+                backwards
+    """
+    half = width / 2.0
+
+    # Unit normal of each segment
+    normals = []
+    for (x1, y1), (x2, y2) in zip(points[:-1], points[1:]):
+        dx, dy = x2 - x1, y2 - y1
+        length = sqrt(dx * dx + dy * dy)
+        if length == 0.0:
+            continue
+        normals.append((-dy / length, dx / length))
+
+    if not normals:
+        return []
+
+    # Drop repeated points, which have no segment
+    path = [points[0]]
+    for p in points[1:]:
+        if p != path[-1]:
+            path.append(p)
+
+    left, right = [], []
+    for k, (x, y) in enumerate(path):
+        n1 = normals[max(k - 1, 0)]
+        n2 = normals[min(k, len(normals) - 1)]
+
+        # Miter: the offset of both segments meets on the bisector
+        nx, ny = n1[0] + n2[0], n1[1] + n2[1]
+        length = sqrt(nx * nx + ny * ny)
+        if length < 1e-6:
+            nx, ny = n1
+        else:
+            nx /= length
+            ny /= length
+        # Limit the length of sharp corners
+        scale = half / max(nx * n1[0] + ny * n1[1], 0.5)
+
+        left.append((x + nx * scale, y + ny * scale))
+        right.append((x - nx * scale, y - ny * scale))
+
+    right.reverse()
+    return left + right
@@ -17,11 +17,27 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import bisect
+import io
+import hashlib
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import namedtuple
 from gettext import gettext as _
 
 from sugar3 import env
 
+import pippy.soundindex as soundindex
+
+try:
+    import pippy.synth as synth
+except ImportError:
+    synth = None  # NumPy is not installed
+
 '''XXX: This function seems to be broken. (CSA)
 def quit(self):
 perf.Stop()
@@ -30,10 +46,63 @@ cs.Reset()
 cs = None
 '''
 
-orchlines = []
-scorelines = []
-instrlist = []
-fnum = [100]
+# How audioOut renders the score: 'numpy' (in this process, see
+# synth.py) or 'csound'. None uses NumPy if it is installed.
+backend = None
+
+# Rendered scores are kept as WAV files in temp_path/cache, named by a
+# hash of the orchestra, score and options. When the files take more
+# than cache_size bytes, the least recently used ones are removed. 0
+# turns the cache off.
+cache_size = 20 * 1024 * 1024
+
+# The f-tables every score has: the waves of playSine, playSquare,
+# playSawtooth and playComplex, and the default envelopes
+# (number: (gen, size, arguments))
+DEFAULT_TABLES = {
+    1: (10, 2048, (1,)),
+    2: (10, 2048, (1, 0, .33, 0, .2, 0, .143, 0, .111)),
+    3: (10, 2048, (1, .5, .33, .25, .2, .175, .143, .125, .111, .1)),
+    10: (10, 2048, (1, 0, 0, .3, 0, .2, 0, 0, .1)),
+    99: (7, 2048, (1, 2048, 1)),
+    100: (7, 2048, (0., 10, 1., 1900, 1., 132, 0.)),
+}
+
+# The csound orchestra, the instruments a score uses go into the .csd
+INSTRUMENTS = {
+    1: ['instr 1\n',
+        'kpitenv oscil 1, 1/p3, p6\n',
+        'aenv oscil 1, 1/p3, p7\n',
+        'asig oscil p5*aenv, p4*kpitenv, p8\n',
+        'out asig\n',
+        'endin\n\n'],
+    7: ['instr 7\n',
+        'kpitenv oscil 1, 1/p3, p10\n',
+        'kenv oscil 1, 1/p3, p11\n',
+        'kcarenv oscil 1, 1/p3, p12\n',
+        'kmodenv oscil 1, 1/p3, p13\n',
+        'kindenv oscil 1, 1/p3, p14\n',
+        'asig foscil p5*kenv, p4*kpitenv, p6*kcarenv, '
+        'p7*kmodenv, p8*kindenv, p9\n',
+        'out asig\n',
+        'endin\n\n'],
+    8: ['instr 8\n',
+        'kpitenv oscil 1, 1/p3, p6\n',
+        'kenv oscil 1, 1/p3, p7\n',
+        'asig pluck p5*kenv, p4*kpitenv, 40, 0, 6\n',
+        'asig butterlp asig, 4000\n',
+        'out asig\n',
+        'endin\n\n'],
+    9: ['instr 9\n',
+        'kpitenv oscil 1, 1/p3, p8\n',
+        'aenv oscil 1, 1/p3, p9\n',
+        'asig diskin p4, p5*kpitenv, 0, p7\n',
+        'out asig*p6*aenv\n',
+        'endin\n\n'],
+}
+
+# A note of the score, params are the p-fields from p4 on
+Note = namedtuple('Note', ['instrument', 'start', 'duration', 'params'])
 
 
 class SoundLibraryNotFoundError(Exception):
@@ -42,327 +111,567 @@ class SoundLibraryNotFoundError(Exception):
                                    ' Did you install TamTamEdit?'))
 
 
-def finddir():
-    paths = ['/usr/share/sugar/activities', env.get_user_activities_path()]
-
-    sound_candidate_dirs = None
-    for path in paths:
-        if not os.path.exists(path):
-            continue
-        for f in os.listdir(path):
-            if f in ['TamTamMini.activity', 'TamTamJam.activity',
-                     'TamTamEdit.activity', 'TamTamSynthLab.activity',
-                     'MusicKeyboard.activity']:
-                bundle_dir = os.path.join(path, f)
-                tamtam_subdir = str(
-                    os.path.join(bundle_dir, 'common', 'Resources', 'Sounds'))
-                sound_candidate_dirs = [
-                    os.path.expandvars('$SUGAR_PATH/activities') + \
-                    tamtam_subdir,
-                    tamtam_subdir
-                ]
-
-    if sound_candidate_dirs is not None:
-        for directory in sound_candidate_dirs:
-            if os.path.isdir(directory):
-                return directory
-
-    raise SoundLibraryNotFoundError()
-
-
-def defAdsr(attack=0.01, decay=0.1, sustain=0.8, release=0.1):
-    ''' Define an ADSR envelope. fnum = defADSR(attack = [0.01],
-    decay = [0.1], sustain = [0.8], release = [0.1]) '''
-    att = int(2048 * attack)
-    dec = int(2048 * decay)
-    rel = int(2048 * release)
-    bal = 2048 - (att + dec + rel)
-    sus = min(1., sustain)
-
-    fnum[0] += 1
-    scorelines.append('f%ld 0 2048 7 0 %ld 1. %ld %f %ld %f %ld 0\n' %
-                      (fnum[0], att, dec, sus, bal, sus, rel))
-    return fnum[0]
-
-
-def defLineSegments(list=[0, 10, 1, 10, 0, 10, 1, 10, 0]):
-    ''' Define a breakpoints envelope. list begin with the start
-    value of the function and is follow by any pair values (duration,
-    value). The number of elements in the list should be odd. '''
-
-    totalLength = 0
-    newlist = []
-    for i in range(len(list)):
-        if (i % 2) == 1:
-            totalLength += list[i]
-
-    for i in range(len(list)):
-        if (i % 2) == 0:
-            newlist.append(list[i])
-        else:
-            newlist.append(int(2048 * (list[i] / float(totalLength))))
-
-    fnum[0] += 1
-    scorelines.append('f' + str(fnum[0]) + ' 0 2048 -7 ' +
-                      ' '.join([str(n) for n in newlist]) + '\n')
-    return fnum[0]
-
-
-def defComplexWave(list=[1, 0, 0, .3, 0, .2, 0, 0, .1]):
-    ''' Define a complex waveform to be read with 'playComplex'
-    function. list=[1, 0, 0, .3, 0, .2, 0, 0, .1] is a list of
-    amplitude for succesive harmonics of a waveform '''
-    fnum[0] += 1
-    scorelines.append('f' + str(fnum[0]) + ' 0 2048 10 ' +
-                      ' '.join([str(n) for n in list]) + '\n')
-    return fnum[0]
-
-
-def playSine(pitch=1000, amplitude=5000, duration=1, starttime=0,
-             pitch_envelope='default', amplitude_envelope='default'):
-    ''' Play a sine wave
-    (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
-    pitch_envelope=['default'], amplitude_envelope=['default']) '''
-    _play(pitch, amplitude, duration, starttime, pitch_envelope,
-          amplitude_envelope, 1)
+_sound_index = None
 
 
-def playSquare(pitch=1000, amplitude=5000, duration=1, starttime=0,
-               pitch_envelope='default', amplitude_envelope='default'):
-    ''' Play a square wave
-    (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
-    pitch_envelope=['default'], amplitude_envelope=['default']) '''
-    _play(pitch, amplitude, duration, starttime, pitch_envelope,
-          amplitude_envelope, 2)
+def get_sound_index():
+    ''' The index of the sound library (see soundindex.py), read or
+    built once per process '''
+    global _sound_index
+    if _sound_index is None:
+        _sound_index = soundindex.SoundIndex(
+            env.get_user_activities_path(),
+            os.path.join(_get_temp_path(), 'sounds.json'))
+    return _sound_index
 
 
-def playSawtooth(pitch=1000, amplitude=5000, duration=1, starttime=0,
-                 pitch_envelope='default', amplitude_envelope='default'):
-    ''' Play a sawtooth wave (pitch = [1000], amplitude = [5000],
-    duration = [1], starttime = [0], pitch_envelope=['default'],
-    amplitude_envelope=['default']) '''
-    _play(pitch, amplitude, duration, starttime, pitch_envelope,
-          amplitude_envelope, 3)
-
-
-def playComplex(pitch=1000, amplitude=5000, duration=1, starttime=0,
-                pitch_envelope='default', amplitude_envelope='default',
-                wave='default'):
-    ''' Play a complex wave
-    (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
-    pitch_envelope = ['default'], amplitude_envelope, wave = ['default'] ) '''
-    if wave == 'default':
-        wavetable = 10
-    else:
-        wavetable = wave
-    _play(pitch, amplitude, duration, starttime, pitch_envelope,
-          amplitude_envelope, wavetable)
+def finddir():
+    directory = get_sound_index().directory
+    if directory is None:
+        raise SoundLibraryNotFoundError()
+    return directory
 
 
-def _play(pitch, amplitude, duration, starttime, pitch_envelope,
-          amplitude_envelope, instrument):
-    if pitch_envelope == 'default':
-        pitenv = 99
-    else:
-        pitenv = pitch_envelope
+def _envelope(envelope, default):
+    if envelope == 'default':
+        return default
+    return envelope
 
-    if amplitude_envelope == 'default':
-        ampenv = 100
-    else:
-        ampenv = amplitude_envelope
-
-    if not 1 in instrlist:
-        orchlines.append('instr 1\n')
-        orchlines.append('kpitenv oscil 1, 1/p3, p6\n')
-        orchlines.append('aenv oscil 1, 1/p3, p7\n')
-        orchlines.append('asig oscil p5*aenv, p4*kpitenv, p8\n')
-        orchlines.append('out asig\n')
-        orchlines.append('endin\n\n')
-        instrlist.append(1)
-
-    scorelines.append('i1 %s %s %s %s %s %s %s\n' %
-                      (str(starttime), str(duration), str(pitch),
-                       str(amplitude), str(pitenv), str(ampenv),
-                       str(instrument)))
-
-
-def playFrequencyModulation(pitch=500, amplitude=5000, duration=2, starttime=0,
-                            carrier=1, modulator=.5, index=5,
-                            pitch_envelope='default',
-                            amplitude_envelope='default',
-                            carrier_envelope='default',
-                            modulator_envelope='default',
-                            index_envelope='default', wave='default'):
-    ''' Play a frequency modulation synthesis sound (pitch = [100],
-    amplitude = [5000], duration = [2], starttime = [0], carrier =
-    [1], modulator = [.5], index = [5], pitch_envelope = ['default'],
-    amplitude_envelope = ['default'], carrier_envelope = ['default'],
-    modulator_envelope = ['default'], index_envelope = ['default'],
-    wave = ['default'] ) '''
-    if pitch_envelope == 'default':
-        pitenv = 99
-    else:
-        pitenv = pitch_envelope
 
-    if amplitude_envelope == 'default':
-        ampenv = 100
-    else:
-        ampenv = amplitude_envelope
+class Score:
+    ''' The notes and f-tables of a piece, which audioOut renders.
 
-    if carrier_envelope == 'default':
-        carenv = 99
-    else:
-        carenv = carrier_envelope
+    Notes are kept sorted by their start time. F-tables with the same
+    content are only defined once: two defAdsr() calls with the same
+    arguments return the same table number. audioOut() takes the notes
+    out of the score, the tables stay, so a program can render one
+    piece after the other. clear() empties the score.
 
-    if modulator_envelope == 'default':
-        modenv = 99
-    else:
-        modenv = modulator_envelope
+    The module functions (playSine, defAdsr, audioOut ...) use the
+    score of the module, sound.score. '''
 
-    if index_envelope == 'default':
-        indenv = 99
-    else:
-        indenv = index_envelope
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        ''' Remove all notes and the tables defined with defAdsr,
+        defLineSegments and defComplexWave '''
+        self.tables = dict(DEFAULT_TABLES)
+        self.table_numbers = dict((content, number) for number, content
+                                  in DEFAULT_TABLES.items())
+        self.last_table = 100
+        self.notes = []
+        self.starts = []  # start of each note, to keep them sorted
+        self.instruments = set()
+
+    def defTable(self, gen, args, size=2048):
+        ''' Define an f-table of csound's GEN routine gen, or find the
+        table with the same content. Return its number. '''
+        content = (gen, size, tuple(args))
+        number = self.table_numbers.get(content)
+        if number is None:
+            self.last_table += 1
+            number = self.last_table
+            self.tables[number] = content
+            self.table_numbers[content] = number
+        return number
+
+    def addNote(self, instrument, start, duration, *params):
+        ''' Add a note for an instrument of INSTRUMENTS '''
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.notes.insert(index, Note(instrument, start, duration, params))
+        self.instruments.add(instrument)
+
+    def defAdsr(self, attack=0.01, decay=0.1, sustain=0.8, release=0.1):
+        ''' Define an ADSR envelope. fnum = defADSR(attack = [0.01],
+        decay = [0.1], sustain = [0.8], release = [0.1]) '''
+        att = int(2048 * attack)
+        dec = int(2048 * decay)
+        rel = int(2048 * release)
+        bal = 2048 - (att + dec + rel)
+        sus = min(1., sustain)
+        return self.defTable(7, (0, att, 1., dec, sus, bal, sus, rel, 0))
+
+    def defLineSegments(self, list=[0, 10, 1, 10, 0, 10, 1, 10, 0]):
+        ''' Define a breakpoints envelope. list begin with the start
+        value of the function and is follow by any pair values (duration,
+        value). The number of elements in the list should be odd. '''
+
+        totalLength = 0
+        newlist = []
+        for i in range(len(list)):
+            if (i % 2) == 1:
+                totalLength += list[i]
+
+        for i in range(len(list)):
+            if (i % 2) == 0:
+                newlist.append(list[i])
+            else:
+                newlist.append(int(2048 * (list[i] / float(totalLength))))
+
+        return self.defTable(-7, newlist)
+
+    def defComplexWave(self, list=[1, 0, 0, .3, 0, .2, 0, 0, .1]):
+        ''' Define a complex waveform to be read with 'playComplex'
+        function. list=[1, 0, 0, .3, 0, .2, 0, 0, .1] is a list of
+        amplitude for succesive harmonics of a waveform '''
+        return self.defTable(10, list)
+
+    def playSine(self, pitch=1000, amplitude=5000, duration=1, starttime=0,
+                 pitch_envelope='default', amplitude_envelope='default'):
+        ''' Play a sine wave
+        (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
+        pitch_envelope=['default'], amplitude_envelope=['default']) '''
+        self._play(pitch, amplitude, duration, starttime, pitch_envelope,
+                   amplitude_envelope, 1)
+
+    def playSquare(self, pitch=1000, amplitude=5000, duration=1,
+                   starttime=0, pitch_envelope='default',
+                   amplitude_envelope='default'):
+        ''' Play a square wave
+        (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
+        pitch_envelope=['default'], amplitude_envelope=['default']) '''
+        self._play(pitch, amplitude, duration, starttime, pitch_envelope,
+                   amplitude_envelope, 2)
+
+    def playSawtooth(self, pitch=1000, amplitude=5000, duration=1,
+                     starttime=0, pitch_envelope='default',
+                     amplitude_envelope='default'):
+        ''' Play a sawtooth wave (pitch = [1000], amplitude = [5000],
+        duration = [1], starttime = [0], pitch_envelope=['default'],
+        amplitude_envelope=['default']) '''
+        self._play(pitch, amplitude, duration, starttime, pitch_envelope,
+                   amplitude_envelope, 3)
+
+    def playComplex(self, pitch=1000, amplitude=5000, duration=1,
+                    starttime=0, pitch_envelope='default',
+                    amplitude_envelope='default', wave='default'):
+        ''' Play a complex wave
+        (pitch = [1000], amplitude = [5000], duration = [1], starttime = [0],
+        pitch_envelope = ['default'], amplitude_envelope,
+        wave = ['default'] ) '''
+        self._play(pitch, amplitude, duration, starttime, pitch_envelope,
+                   amplitude_envelope, _envelope(wave, 10))
+
+    def _play(self, pitch, amplitude, duration, starttime, pitch_envelope,
+              amplitude_envelope, wavetable):
+        self.addNote(1, starttime, duration, pitch, amplitude,
+                     _envelope(pitch_envelope, 99),
+                     _envelope(amplitude_envelope, 100), wavetable)
+
+    def playFrequencyModulation(self, pitch=500, amplitude=5000, duration=2,
+                                starttime=0, carrier=1, modulator=.5,
+                                index=5, pitch_envelope='default',
+                                amplitude_envelope='default',
+                                carrier_envelope='default',
+                                modulator_envelope='default',
+                                index_envelope='default', wave='default'):
+        ''' Play a frequency modulation synthesis sound (pitch = [100],
+        amplitude = [5000], duration = [2], starttime = [0], carrier =
+        [1], modulator = [.5], index = [5], pitch_envelope = ['default'],
+        amplitude_envelope = ['default'], carrier_envelope = ['default'],
+        modulator_envelope = ['default'], index_envelope = ['default'],
+        wave = ['default'] ) '''
+        self.addNote(7, starttime, duration, pitch, amplitude, carrier,
+                     modulator, index, _envelope(wave, 1),
+                     _envelope(pitch_envelope, 99),
+                     _envelope(amplitude_envelope, 100),
+                     _envelope(carrier_envelope, 99),
+                     _envelope(modulator_envelope, 99),
+                     _envelope(index_envelope, 99))
+
+    def playPluck(self, pitch=100, amplitude=5000, duration=2, starttime=0,
+                  pitch_envelope='default', amplitude_envelope='default'):
+        ''' Play a string physical modeling sound (pitch = [100],
+        amplitude = [5000], duration = [2], starttime = [0],
+        pitch_envelope = ['default'], amplitude_envelope ) '''
+        self.addNote(8, starttime, duration, pitch, amplitude,
+                     _envelope(pitch_envelope, 99),
+                     _envelope(amplitude_envelope, 100))
+
+    def playWave(self, sound='horse', pitch=1, amplitude=1, loop=False,
+                 duration=1, starttime=0, pitch_envelope='default',
+                 amplitude_envelope='default'):
+        ''' Play a wave file (sound = ['horse'], pitch = [1], amplitude =
+        [1], loop = [False], duration = [1], starttime = [0],
+        pitch_envelope=['default'], amplitude_envelope=['default']) '''
+        if '/' in sound:
+            fullname = sound
+        else:
+            fullname = get_sound_index().get_path(sound)
+            if fullname is None:
+                raise SoundLibraryNotFoundError()
 
-    if wave == 'default':
-        wavetable = 1
-    else:
-        wavetable = wave
-
-    if not 7 in instrlist:
-        orchlines.append('instr 7\n')
-        orchlines.append('kpitenv oscil 1, 1/p3, p10\n')
-        orchlines.append('kenv oscil 1, 1/p3, p11\n')
-        orchlines.append('kcarenv oscil 1, 1/p3, p12\n')
-        orchlines.append('kmodenv oscil 1, 1/p3, p13\n')
-        orchlines.append('kindenv oscil 1, 1/p3, p14\n')
-        orchlines.append('asig foscil p5*kenv, p4*kpitenv, p6*kcarenv, '
-                         'p7*kmodenv, p8*kindenv, p9\n')
-        orchlines.append('out asig\n')
-        orchlines.append('endin\n\n')
-        instrlist.append(7)
-
-    scorelines.append('i7 %s %s %s %s %s %s %s %s %s %s %s %s %s\n' %
-                      (str(starttime), str(duration), str(pitch),
-                       str(amplitude), str(carrier), str(modulator),
-                       str(index), str(wavetable),  str(pitenv), str(ampenv),
-                       str(carenv), str(modenv), str(indenv)))
-
-
-def playPluck(pitch=100, amplitude=5000, duration=2, starttime=0,
-              pitch_envelope='default', amplitude_envelope='default'):
-    ''' Play a string physical modeling sound (pitch = [100],
-    amplitude = [5000], duration = [2], starttime = [0],
-    pitch_envelope = ['default'], amplitude_envelope ) '''
-    if pitch_envelope == 'default':
-        pitenv = 99
-    else:
-        pitenv = pitch_envelope
+        if loop:
+            lp = 1
+        else:
+            lp = 0
+
+        self.addNote(9, float(starttime), float(duration), fullname, pitch,
+                     amplitude, lp, _envelope(pitch_envelope, 99),
+                     _envelope(amplitude_envelope, 100))
+
+    def orchestraLines(self):
+        ''' The csound orchestra of the instruments the notes use '''
+        lines = []
+        for instrument in sorted(self.instruments):
+            lines.extend(INSTRUMENTS[instrument])
+        return lines
+
+    def scoreLines(self):
+        ''' The csound score: the f-tables, then the notes '''
+        lines = []
+        for number in sorted(self.tables):
+            gen, size, args = self.tables[number]
+            lines.append('f%d 0 %d %d %s\n' %
+                         (number, size, gen, ' '.join(str(a) for a in args)))
+
+        for note in self.notes:
+            params = ["'%s'" % p if isinstance(p, str) else str(p)
+                      for p in note.params]
+            lines.append('i%d %s %s %s\n' %
+                         (note.instrument, note.start, note.duration,
+                          ' '.join(params)))
+        return lines
+
+    def audioOut(self, file=None, wait=None):
+        ''' Render the score and play it in the background. If a string
+        is given as argument, it write a wave file on disk instead of
+        sending sound to hp, and returns once the file is written.
+        (file = [None], wait = [None]: True with a file, False without)
+
+        The notes are taken out of the score, the next audioOut() only
+        plays the notes added after this one.
+
+        Return a Playback: playback.wait() waits until the sound has
+        ended (or the file is written), playback.stop() stops it. A
+        program which ends still plays its sound to the end. '''
+        path = _get_temp_path()
+        if file is not None:
+            file = os.path.join(path, '%s.wav' % file)
+        if wait is None:
+            wait = file is not None
+
+        playback = Playback()
+        args = (path, file, self.orchestraLines(), self.scoreLines(),
+                dict(self.tables), list(self.notes))
+        if wait:
+            playback._run(*args)
+        else:
+            # Not a daemon: the interpreter waits for the sound before
+            # exiting
+            thread = threading.Thread(target=playback._run, args=args)
+            thread.start()
 
-    if amplitude_envelope == 'default':
-        ampenv = 100
-    else:
-        ampenv = amplitude_envelope
-
-    if not 8 in instrlist:
-        orchlines.append('instr 8\n')
-        orchlines.append('kpitenv oscil 1, 1/p3, p6\n')
-        orchlines.append('kenv oscil 1, 1/p3, p7\n')
-        orchlines.append('asig pluck p5*kenv, p4*kpitenv, 40, 0, 6\n')
-        orchlines.append('asig butterlp asig, 4000\n')
-        orchlines.append('out asig\n')
-        orchlines.append('endin\n\n')
-        instrlist.append(8)
-
-    scorelines.append('i8 %s %s %s %s %s %s\n' %
-                      (str(starttime), str(duration), str(pitch),
-                       str(amplitude), str(pitenv), str(ampenv)))
-
-
-def playWave(sound='horse', pitch=1, amplitude=1, loop=False, duration=1,
-             starttime=0, pitch_envelope='default',
-             amplitude_envelope='default'):
-    ''' Play a wave file (sound = ['horse'], pitch = [1], amplitude =
-    [1], loop = [False], duration = [1], starttime = [0],
-    pitch_envelope=['default'], amplitude_envelope=['default']) '''
-    if '/' in sound:
-        fullname = sound
-    else:
-        fullname = os.path.join(finddir(), sound)
+        self.notes = []
+        self.starts = []
+        self.instruments = set()
+        return playback
 
-    if loop:
-        lp = 1
-    else:
-        lp = 0
 
-    if pitch_envelope == 'default':
-        pitenv = 99
-    else:
-        pitenv = pitch_envelope
+def getSoundList():
+    finddir()
+    return sorted(get_sound_index().sounds)
 
-    if amplitude_envelope == 'default':
-        ampenv = 100
-    else:
-        ampenv = amplitude_envelope
 
-    if not 9 in instrlist:
-        orchlines.append('instr 9\n')
-        orchlines.append('kpitenv oscil 1, 1/p3, p8\n')
-        orchlines.append('aenv oscil 1, 1/p3, p9\n')
-        orchlines.append('asig diskin p4, p5*kpitenv, 0, p7\n')
-        orchlines.append('out asig*p6*aenv\n')
-        orchlines.append('endin\n\n')
-        instrlist.append(9)
+def getSoundInfo(sound='horse'):
+    ''' Duration (in seconds), sample rate and channels of a sound of
+    the library, as a dict (sound = ['horse']) '''
+    finddir()
+    info = get_sound_index().sounds.get(sound)
+    if info is None:
+        raise ValueError('%s is not in the sound library' % sound)
+    return dict(info)
 
-    scorelines.append("i9 %f %f '%s' %s %s %s %s %s\n" %
-                      (float(starttime), float(duration), fullname, str(pitch),
-                       str(amplitude), str(lp), str(pitenv), str(ampenv)))
+temp_path = None
 
 
-def getSoundList():
-    return sorted(os.listdir(finddir()))
+class Playback:
+    ''' A score started by audioOut. It renders and plays in the
+    background: wait() blocks until it has finished, stop() ends it
+    early and is_playing() tells whether it still runs. '''
 
-temp_path = None
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._stopped = False
+        self._process = None  # csound or aplay
+        self._channel = None  # pygame mixer channel
+
+    def is_playing(self):
+        ''' True while the score is rendered or played '''
+        return not self._done.is_set()
+
+    def wait(self, timeout=None):
+        ''' Wait until the score has finished, or timeout seconds.
+        Return True if it has finished. '''
+        return self._done.wait(timeout)
+
+    def stop(self):
+        ''' Stop the rendering or the sound '''
+        with self._lock:
+            self._stopped = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+            if self._channel is not None:
+                self._channel.stop()
+
+    def _start_process(self, args, **kwargs):
+        # None if stop() came first
+        with self._lock:
+            if self._stopped:
+                return None
+            self._process = subprocess.Popen(
+                args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                **kwargs)
+            return self._process
+
+    def _run(self, path, file, orchestra, score_lines, tables, notes):
+        try:
+            use_numpy = _use_numpy()
+            if cache_size > 0:
+                wav = self._render_cached(path, use_numpy, orchestra,
+                                          score_lines, tables, notes)
+                if wav is None:
+                    pass
+                elif file is not None:
+                    shutil.copyfile(wav, file)
+                elif not self._stopped:
+                    self._play_wav(wav)
+                return
+
+            if use_numpy:
+                samples = _render_numpy(tables, notes)
+                if samples is not None:
+                    if file is not None:
+                        synth.write_wav(file, samples)
+                    elif not self._stopped:
+                        data = io.BytesIO()
+                        synth.write_wav(data, samples)
+                        data.seek(0)
+                        self._play_wav(data)
+                    return
+
+            self._run_csound(path, file, orchestra, score_lines)
+        finally:
+            self._done.set()
+
+    def _render_cached(self, path, use_numpy, orchestra, score_lines, tables,
+                       notes):
+        # Return the WAV file of the score in the cache, rendered now if
+        # it is not there. None if rendering failed or was stopped.
+        cache_dir = os.path.join(path, 'cache')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        wav = os.path.join(cache_dir, '%s.wav' % _cache_key(
+            use_numpy, orchestra, score_lines, notes))
+        try:
+            os.utime(wav)  # Now it is the most recently used
+            return wav
+        except OSError:
+            pass  # Not rendered yet (or evicted)
+
+        # Rendered under another name first, so other programs never play
+        # a file which is only half written
+        fd, temp = tempfile.mkstemp(suffix='.part', dir=cache_dir)
+        os.close(fd)
+        try:
+            samples = _render_numpy(tables, notes) if use_numpy else None
+            if samples is not None:
+                synth.write_wav(temp, samples)
+            elif not self._run_csound(path, temp, orchestra, score_lines):
+                return None
+            os.replace(temp, wav)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        _trim_cache(cache_dir, wav)
+        return wav
+
+    def _play_wav(self, wav):
+        # Play a WAV file (name or file object), with pygame's mixer or
+        # else ALSA's aplay
+        try:
+            import pygame
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(16000, -16, 1)
+            with self._lock:
+                if not self._stopped:
+                    self._channel = pygame.mixer.Sound(file=wav).play()
+        except ImportError:
+            pass
+        except pygame.error:
+            pass
+
+        if self._channel is None:
+            if isinstance(wav, str):
+                args, data = ['aplay', '-q', wav], None
+            else:
+                args, data = ['aplay', '-q', '-'], wav.getvalue()
+            try:
+                process = self._start_process(args, stdin=subprocess.PIPE)
+            except OSError:
+                print('Cannot play sound: neither pygame nor aplay work')
+                return
+            if process is not None:
+                try:
+                    process.communicate(data)
+                except OSError:
+                    pass  # stopped
+            return
+
+        while self._channel.get_busy():
+            time.sleep(0.01)
+
+    def _run_csound(self, path, file, orchestra, score_lines):
+        # Every score gets its own file, so programs playing at the same
+        # time do not overwrite each other's
+        fd, csd_path = tempfile.mkstemp(prefix='temp', suffix='.csd',
+                                        dir=path)
+        try:
+            with os.fdopen(fd, 'w') as csd:
+                _write_csd(csd, file, orchestra, score_lines)
+            try:
+                process = self._start_process(['csound', csd_path])
+            except OSError:
+                print('Cannot play sound: csound is not installed')
+                return False
+            return process is not None and process.wait() == 0
+        finally:
+            os.remove(csd_path)
+
+
+def _use_numpy():
+    if backend == 'numpy' and synth is None:
+        print('NumPy is not installed, using csound')
+    return synth is not None and backend in (None, 'numpy')
+
+
+def _render_numpy(tables, notes):
+    # None if the score cannot be rendered with NumPy
+    try:
+        return synth.render(tables, notes)
+    except (ValueError, IOError) as e:
+        print('Cannot render the score with NumPy (%s), using csound' % e)
+        return None
+
+
+def _cache_key(use_numpy, orchestra, score_lines, notes):
+    # A hash of everything the sound depends on: the program which
+    # renders it, the orchestra, the score and the sound files it plays
+    digest = hashlib.sha1()
+    digest.update(('numpy\n' if use_numpy else 'csound\n').encode())
+    _write_csd(_HashWriter(digest), 'cache', orchestra, score_lines)
+    sounds = set(note.params[0] for note in notes if note.instrument == 9)
+    for path in sorted(sounds):
+        try:
+            stat = os.stat(path)
+            stamp = '%d %d\n' % (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = 'missing\n'
+        digest.update(stamp.encode())
+    return digest.hexdigest()
+
+
+class _HashWriter:
+    # A file object feeding what is written into a hash
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, text):
+        self.digest.update(text.encode('utf-8'))
+
+
+def _trim_cache(cache_dir, keep):
+    # Remove the least recently used files until the cache is small enough
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.wav'):
+            wav = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(wav)
+            except OSError:
+                continue  # Removed by another program
+            entries.append((stat.st_mtime, stat.st_size, wav))
+
+    total = sum(size for mtime, size, wav in entries)
+    for mtime, size, wav in sorted(entries):
+        if total <= cache_size:
+            break
+        if wav == keep:
+            continue
+        try:
+            os.remove(wav)
+        except OSError:
+            pass
+        total -= size
 
 
-def audioOut(file=None):
-    ''' Compile a .csd file and start csound to run it. If a string is
-    given as argument, it write a wave file on disk instead of sending
-    sound to hp. (file = [None]) '''
+def _get_temp_path():
     global temp_path
     if temp_path is None:
         temp_path = os.path.join(env.get_profile_path(), 'pippy')
         if not os.path.isdir(temp_path):
             os.mkdir(temp_path)
-    path = temp_path
-    csd = open(os.path.join(path, 'temp.csd'), 'w')
+    return temp_path
+
+
+def _write_csd(csd, file, orchestra, score_lines):
     csd.write('<CsoundSynthesizer>\n\n')
     csd.write('<CsOptions>\n')
     if file is None:
         csd.write('-+rtaudio=alsa -odevaudio -m0 -d -b256 -B512\n')
     else:
-        file = os.path.join(path, '%s.wav' % file)
         csd.write('-+rtaudio=alsa -o%s -m0 -W -d -b256 -B512\n' % file)
     csd.write('</CsOptions>\n\n')
     csd.write('<CsInstruments>\n\n')
     csd.write('sr=16000\n')
     csd.write('ksmps=50\n')
     csd.write('nchnls=1\n\n')
-    for line in orchlines:
+    for line in orchestra:
         csd.write(line)
     csd.write('\n</CsInstruments>\n\n')
     csd.write('<CsScore>\n\n')
-    csd.write('f1 0 2048 10 1\n')
-    csd.write('f2 0 2048 10 1 0 .33 0 .2 0 .143 0 .111\n')
-    csd.write('f3 0 2048 10 1 .5 .33 .25 .2 .175 .143 .125 .111 .1\n')
-    csd.write('f10 0 2048 10 1 0 0 .3 0 .2 0 0 .1\n')
-    csd.write('f99 0 2048 7 1 2048 1\n')
-    csd.write('f100 0 2048 7 0. 10 1. 1900 1. 132 0.\n')
-    for line in scorelines:
+    for line in score_lines:
         csd.write(line)
     csd.write('e\n')
     csd.write('\n</CsScore>\n')
     csd.write('\n</CsoundSynthesizer>')
-    csd.close()
 
-    os.system('csound ' + path + '/temp.csd >/dev/null 2>/dev/null')
+
+# The score of the module functions
+score = Score()
+
+defTable = score.defTable
+defAdsr = score.defAdsr
+defLineSegments = score.defLineSegments
+defComplexWave = score.defComplexWave
+playSine = score.playSine
+playSquare = score.playSquare
+playSawtooth = score.playSawtooth
+playComplex = score.playComplex
+playFrequencyModulation = score.playFrequencyModulation
+playPluck = score.playPluck
+playWave = score.playWave
+audioOut = score.audioOut
+clear = score.clear
+
+
+def __getattr__(name):
+    # The lists the module kept before the Score, made from the score.
+    # They are tuples: the score can't be changed through them (appending
+    # csound lines never worked with the NumPy synth), use the functions.
+    if name == 'orchlines':
+        return tuple(score.orchestraLines())
+    if name == 'scorelines':
+        return tuple(score.scoreLines())
+    if name == 'instrlist':
+        return tuple(sorted(score.instruments))
+    if name == 'fnum':
+        # fnum[0] was the number of the last table defined
+        return (score.last_table,)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
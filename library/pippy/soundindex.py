@@ -0,0 +1,232 @@
+"""Index of the TamTam sound library, for pippy.sound and the activity.
+
+Finding the library means listing the activity directories, so the
+index is built once and saved in a JSON file together with the
+modification times of those directories. As long as they did not
+change, later processes read the file instead:
+
+    index = soundindex.SoundIndex(env.get_user_activities_path(),
+                                  cache_file)
+    index.directory           # the Sounds directory, None if not found
+    index.sounds['horse']     # {'path', 'duration', 'rate', 'channels'}
+
+This module only uses the standard library, the activity loads it
+without the rest of pippy.
+"""
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+import json
+import os
+import tempfile
+import wave
+
+try:
+    import aifc
+except ImportError:
+    aifc = None  # removed in Python 3.13
+
+# Bump when the saved format changes
+VERSION = 2
+
+# Activities which bring the sound library
+BUNDLES = ['TamTamMini.activity', 'TamTamJam.activity',
+           'TamTamEdit.activity', 'TamTamSynthLab.activity',
+           'MusicKeyboard.activity']
+
+
+def search_paths(user_activities_path):
+    ''' The directories with activities, in the order they are searched '''
+    paths = []
+    for path in ['/usr/share/sugar/activities', user_activities_path,
+                 os.path.join(os.path.expanduser('~'), 'Activities')]:
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def find_directory(paths):
+    ''' Look for the Sounds directory of a TamTam bundle in paths (the
+    last one found wins). Return it, or None. '''
+    sound_candidate_dirs = None
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for f in os.listdir(path):
+            if f in BUNDLES:
+                bundle_dir = os.path.join(path, f)
+                tamtam_subdir = str(
+                    os.path.join(bundle_dir, 'common', 'Resources', 'Sounds'))
+                sound_candidate_dirs = [
+                    os.path.expandvars('$SUGAR_PATH/activities')
+                    + tamtam_subdir,
+                    tamtam_subdir
+                ]
+
+    if sound_candidate_dirs is not None:
+        for directory in sound_candidate_dirs:
+            if os.path.isdir(directory):
+                return directory
+
+    return None
+
+
+def read_info(path):
+    ''' Read the header of a WAV or AIFF file. Return a dict of duration
+    (seconds), rate and channels, the values are None for other files. '''
+    readers = [wave.open]
+    if aifc is not None:
+        readers.append(aifc.open)
+
+    for reader in readers:
+        try:
+            f = reader(path, 'rb')
+        except (wave.Error, EOFError, getattr(aifc, 'Error', wave.Error),
+                OSError):
+            continue
+        try:
+            rate = f.getframerate()
+            return {'duration': f.getnframes() / float(rate) if rate else 0.0,
+                    'rate': rate,
+                    'channels': f.getnchannels()}
+        finally:
+            f.close()
+
+    return {'duration': None, 'rate': None, 'channels': None}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _file_stamp(path):
+    # A file rewritten in place does not change the mtime of its directory
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class SoundIndex:
+    ''' The sounds of the TamTam library: their paths and duration,
+    sample rate and channels. Loaded from cache_file if the activity
+    directories and the Sounds directory did not change since it was
+    saved, built (and saved) otherwise. The headers of sounds whose
+    size or mtime changed are read again. '''
+
+    def __init__(self, user_activities_path, cache_file=None):
+        self.paths = search_paths(user_activities_path)
+        self.cache_file = cache_file
+        self.directory = None
+        self.sounds = {}  # name: {'path', 'duration', 'rate', 'channels'}
+        self.files = {}  # name: [mtime, size] when the header was read
+
+        if not self.load():
+            self.build()
+            self.save()
+
+    def _stamps(self, directory):
+        # What the index depends on: the search paths (a bundle was
+        # installed or removed) and the Sounds directory (files changed)
+        stamps = [[path, _mtime(path)] for path in self.paths]
+        if directory is not None:
+            stamps.append([directory, _mtime(directory)])
+        return stamps
+
+    def load(self):
+        ''' Read the saved index. Return False if there is none or it is
+        out of date. '''
+        if self.cache_file is None:
+            return False
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or data.get('version') != VERSION or \
+                data.get('stamps') != self._stamps(data.get('directory')):
+            return False
+
+        self.directory = data['directory']
+        self.sounds = data['sounds']
+        self.files = data['files']
+
+        changed = False
+        for name, info in self.sounds.items():
+            stamp = _file_stamp(info['path'])
+            if stamp != self.files.get(name):
+                self._read(name, info['path'], stamp)
+                changed = True
+        if changed:
+            self.save()
+        return True
+
+    def _read(self, name, path, stamp):
+        info = read_info(path)
+        info['path'] = path
+        self.sounds[name] = info
+        self.files[name] = stamp
+
+    def build(self):
+        ''' Search the library and read the headers of its sounds '''
+        self.directory = find_directory(self.paths)
+        self.sounds = {}
+        self.files = {}
+        if self.directory is None:
+            return
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                self._read(name, path, _file_stamp(path))
+
+    def save(self):
+        ''' Write the index to cache_file, if given '''
+        if self.cache_file is None:
+            return
+        data = {'version': VERSION,
+                'directory': self.directory,
+                'stamps': self._stamps(self.directory),
+                'sounds': self.sounds,
+                'files': self.files}
+
+        directory = os.path.dirname(self.cache_file)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            # Written under another name first, so that a process reading
+            # it at the same time never sees half of it
+            fd, temp = tempfile.mkstemp(suffix='.part', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(temp, self.cache_file)
+            finally:
+                if os.path.exists(temp):
+                    os.remove(temp)
+        except (IOError, OSError) as e:
+            print('Cannot save the sound index: %s' % e)
+
+    def get_path(self, name):
+        ''' The path of a sound, None if the library was not found '''
+        if self.directory is None:
+            return None
+        info = self.sounds.get(name)
+        if info is None:
+            return os.path.join(self.directory, name)
+        return info['path']
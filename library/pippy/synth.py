@@ -0,0 +1,314 @@
+"""Render the instruments of pippy.sound with NumPy, without csound.
+
+The f-tables and notes are the ones of the csound score pippy.sound
+writes, so the same envelopes (defAdsr, defLineSegments) and waves
+(defComplexWave) are used:
+
+    samples = synth.render(tables, notes)
+    synth.write_wav('out.wav', samples)
+
+The instruments are those of the pippy.sound orchestra: 1 (oscil, for
+sine, square, sawtooth and complex waves), 7 (foscil), 8 (pluck) and
+9 (diskin).
+"""
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+import math
+import wave
+
+import numpy
+
+try:
+    import aifc
+except ImportError:
+    aifc = None  # removed in Python 3.13
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+SR = 16000  # Sample rate of the pippy.sound orchestra
+TABLE_SIZE = 2048
+ZERO_DBFS = 32768.0  # Amplitude of full scale in csound
+
+
+def make_table(gen, size, args):
+    ''' Compute an f-table of csound's GEN routines 7 (straight line
+    segments) or 10 (sum of harmonics). A negative gen is not rescaled
+    to a peak of 1. '''
+    if gen == 10 or gen == -10:
+        x = numpy.arange(size) * (2 * math.pi / size)
+        table = numpy.zeros(size)
+        for harmonic, amplitude in enumerate(args):
+            if amplitude:
+                table += amplitude * numpy.sin((harmonic + 1) * x)
+
+    elif gen == 7 or gen == -7:
+        # value, length, value, length, value ...; the rest stays 0
+        table = numpy.zeros(size)
+        start = 0
+        value = args[0]
+        for i in range(1, len(args) - 1, 2):
+            length = int(args[i])
+            end = min(start + length, size)
+            if end > start:
+                table[start:end] = numpy.linspace(
+                    value, args[i + 1], length, endpoint=False)[:end - start]
+            start += length
+            value = args[i + 1]
+
+    else:
+        raise ValueError('GEN%d is not supported' % gen)
+
+    if gen > 0:
+        peak = numpy.abs(table).max()
+        if peak:
+            table /= peak
+    return table
+
+
+def _oscil(table, phase):
+    # Like csound's oscil: the table is read without interpolation
+    size = len(table)
+    return table[(phase * size).astype(numpy.intp) % size]
+
+
+def _phase(frequency, sr):
+    # The phase (in cycles) of an oscillator at a varying frequency
+    phase = numpy.empty(len(frequency))
+    phase[0] = 0.0
+    numpy.cumsum(frequency[:-1], out=phase[1:])
+    return phase / sr
+
+
+def render(tables, notes, sr=SR):
+    ''' Play the notes into one buffer
+
+    Parameters:
+      tables .. {number: (gen, size, [arguments])} of the f-tables
+      notes ... [(instrument, start, duration, [p4, p5, ...])]
+      sr ...... sample rate
+
+    Return: float array of the samples, full scale is -1 .. 1 '''
+    cache = {}
+
+    def table(number):
+        number = int(number)
+        if number not in cache:
+            if number not in tables:
+                raise ValueError('f-table %d is not defined' % number)
+            gen, size, args = tables[number]
+            cache[number] = make_table(gen, size, args)
+        return cache[number]
+
+    length = 0
+    for instrument, start, duration, p in notes:
+        length = max(length, int(round((start + duration) * sr)))
+    out = numpy.zeros(length)
+
+    samples = {}  # Sound files, loaded once
+    for instrument, start, duration, p in notes:
+        n = int(round(duration * sr))
+        if n <= 0:
+            continue
+        # Envelopes are read once over the duration of the note
+        envelope = numpy.arange(n) / float(n)
+
+        if instrument == 1:
+            pitch, amp, pitenv, ampenv, wave_ = p[:5]
+            frequency = pitch * _oscil(table(pitenv), envelope)
+            signal = amp * _oscil(table(ampenv), envelope) * \
+                _oscil(table(wave_), _phase(frequency, sr))
+
+        elif instrument == 7:
+            pitch, amp, carrier, modulator, index, wave_, pitenv, ampenv, \
+                carenv, modenv, indenv = p[:11]
+            fn = table(wave_)
+            base = pitch * _oscil(table(pitenv), envelope)
+            mod_frequency = base * modulator * _oscil(table(modenv), envelope)
+            deviation = index * _oscil(table(indenv), envelope) * \
+                mod_frequency * _oscil(fn, _phase(mod_frequency, sr))
+            frequency = base * carrier * _oscil(table(carenv), envelope) + \
+                deviation
+            signal = amp * _oscil(table(ampenv), envelope) * \
+                _oscil(fn, _phase(frequency, sr))
+
+        elif instrument == 8:
+            pitch, amp, pitenv, ampenv = p[:4]
+            signal = amp * _oscil(table(ampenv), envelope) * _lowpass(
+                _pluck(pitch, _oscil(table(pitenv), envelope), sr), 4000, sr)
+
+        elif instrument == 9:
+            path, pitch, amp, loop, pitenv, ampenv = p[:6]
+            if path not in samples:
+                samples[path] = read_sound(path)
+            data, file_sr = samples[path]
+            speed = pitch * _oscil(table(pitenv), envelope) * file_sr / sr
+            signal = amp * _oscil(table(ampenv), envelope) * \
+                _resample(data, _phase(speed, 1), loop)
+
+        else:
+            raise ValueError('instrument %d is not defined' % instrument)
+
+        first = int(round(start * sr))
+        out[first:first + n] += signal[:length - first]
+
+    return out / ZERO_DBFS
+
+
+def _pluck(pitch, pitch_envelope, sr):
+    # Karplus-Strong: a burst of noise in a delay line of one period,
+    # averaged with its neighbour on every pass (which delays it by
+    # another half sample)
+    period = max(2, int(round(sr / float(pitch) - 0.5)))
+    n = len(pitch_envelope)
+    position = _phase(pitch_envelope, 1)
+    passes = int(position[-1]) // period + 2
+
+    line = numpy.random.RandomState(0).uniform(-1.0, 1.0, period)
+    string = numpy.empty(passes * period)
+    for i in range(passes):
+        string[i * period:(i + 1) * period] = line
+        line = 0.5 * (line + numpy.roll(line, 1))
+
+    return _resample(string, position[:n], False)
+
+
+def _lowpass(signal, cutoff, sr):
+    # Second order Butterworth low pass, like csound's butterlp
+    c = 1.0 / math.tan(math.pi * cutoff / sr)
+    a1 = 1.0 / (1.0 + math.sqrt(2.0) * c + c * c)
+    a2 = 2.0 * a1
+    b1 = 2.0 * (1.0 - c * c) * a1
+    b2 = (1.0 - math.sqrt(2.0) * c + c * c) * a1
+
+    if lfilter is not None:
+        return lfilter([a1, a2, a1], [1.0, b1, b2], signal)
+
+    # Without SciPy: the filter is the sum of a constant gain and two
+    # one pole filters, with the complex conjugate poles p and p*
+    # (partial fractions of (a1 + a2 z + a1 z^2) / (1 + b1 z + b2 z^2)
+    # in z = 1 / z)
+    p = (-b1 + numpy.sqrt(complex(b1 * b1 - 4.0 * b2))) / 2.0
+    gain = a1 / b2
+    c0 = a1 - gain
+    c1 = a2 - gain * b1
+    residue = (c0 + c1 / p) / (1.0 - p.conjugate() / p)
+    return gain * signal + \
+        2.0 * _one_pole(p, residue * signal.astype(complex)).real
+
+
+def _one_pole(pole, x):
+    # y[n] = pole * y[n - 1] + x[n] without a loop over the samples.
+    # Within a block y[j] = pole^j * cumsum(x[i] / pole^i), the blocks
+    # are short enough for pole^-j not to overflow. The states at the
+    # ends of the blocks follow the same recurrence with pole^block.
+    n = len(x)
+    magnitude = abs(pole)
+    if magnitude == 0.0 or n == 0:
+        return x.copy()
+    block = n
+    if magnitude < 1.0:
+        block = min(n, max(2, int(100.0 / -math.log10(magnitude)) + 1))
+
+    powers = pole ** numpy.arange(block)
+    if block == n:
+        return powers * numpy.cumsum(x / powers)
+
+    blocks = -(-n // block)
+    padded = numpy.zeros(blocks * block, dtype=complex)
+    padded[:n] = x
+    y = powers * numpy.cumsum(padded.reshape(blocks, block) / powers, axis=1)
+
+    ends = _one_pole(pole ** block, y[:, -1])
+    y[1:] += ends[:-1, None] * (pole * powers)
+    return y.ravel()[:n]
+
+
+def _resample(data, position, loop):
+    # Read data at fractional positions, with linear interpolation
+    length = len(data)
+    if not length:
+        return numpy.zeros(len(position))
+    if loop:
+        position = position % length
+        following = numpy.append(data[1:], data[:1])
+    else:
+        following = numpy.append(data[1:], 0.0)
+
+    index = position.astype(numpy.intp)
+    inside = index < length
+    index = numpy.minimum(index, length - 1)
+    fraction = position - index
+    signal = data[index] * (1.0 - fraction) + following[index] * fraction
+    signal[~inside] = 0.0
+    return signal
+
+
+def read_sound(path):
+    ''' Load a WAV (or AIFF) file, mixed down to one channel
+
+    Return: (samples in csound's scale (-32768 .. 32768), sample rate) '''
+    readers = [wave.open]
+    if aifc is not None:
+        readers.append(aifc.open)
+
+    for reader in readers:
+        try:
+            f = reader(path, 'rb')
+        except (wave.Error, EOFError, getattr(aifc, 'Error', wave.Error)):
+            continue
+        try:
+            channels = f.getnchannels()
+            width = f.getsampwidth()
+            rate = f.getframerate()
+            frames = f.readframes(f.getnframes())
+        finally:
+            f.close()
+        big_endian = reader is not wave.open
+        break
+    else:
+        raise ValueError('%s is not a WAV or AIFF file' % path)
+
+    if width == 1:
+        data = numpy.frombuffer(frames, numpy.uint8) - 128.0
+        data *= 256.0
+    elif width in (2, 4):
+        dtype = numpy.dtype('>i%d' % width if big_endian else
+                            '<i%d' % width)
+        data = numpy.frombuffer(frames, dtype) / float(2 ** (width * 8 - 16))
+    else:
+        raise ValueError('%d bit samples are not supported' % (width * 8))
+
+    data = data.reshape(-1, channels).mean(axis=1)
+    return data, rate
+
+
+def write_wav(f, samples, sr=SR):
+    ''' Write samples (full scale -1 .. 1) as a 16 bit mono WAV file
+
+    Parameters:
+      f ......... file name or file object
+      samples ... float array
+      sr ........ sample rate '''
+    data = numpy.clip(numpy.asarray(samples) * 32767.0, -32768, 32767)
+    out = wave.open(f, 'wb')
+    try:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sr)
+        out.writeframes(data.astype('<i2').tobytes())
+    finally:
+        out.close()
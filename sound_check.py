@@ -15,43 +15,48 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import importlib.util
 import os
 from gettext import gettext as _
 
 from sugar3 import env
 
 
+def _load_soundindex():
+    # The index of the sound library is shared with pippy.sound. Only
+    # that module of the Pippy library is loaded, not the pippy package
+    # (which would import pygame).
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'library', 'pippy', 'soundindex.py')
+    spec = importlib.util.spec_from_file_location('pippy_soundindex', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+soundindex = _load_soundindex()
+_sound_index = None
+
+
 class SoundLibraryNotFoundError(Exception):
     def __init__(self):
         Exception.__init__(self, _('Cannot find TamTamEdit sound library.'
                                    ' Did you install TamTamEdit?'))
 
 
+def get_sound_index():
+    # Read or built once per process, and saved where pippy.sound finds
+    # it, so the programs started by Pippy do not search again
+    global _sound_index
+    if _sound_index is None:
+        _sound_index = soundindex.SoundIndex(
+            env.get_user_activities_path(),
+            os.path.join(env.get_profile_path(), 'pippy', 'sounds.json'))
+    return _sound_index
+
+
 def finddir():
-    paths = ['/usr/share/sugar/activities', env.get_user_activities_path()]
-    paths.append(os.path.join(os.path.expanduser('~'), 'Activities'))
-
-    sound_candidate_dirs = None
-
-    for path in paths:
-        if not os.path.exists(path):
-            continue
-        for f in os.listdir(path):
-            if f in ['TamTamMini.activity', 'TamTamJam.activity',
-                     'TamTamEdit.activity', 'TamTamSynthLab.activity',
-                     'MusicKeyboard.activity']:
-                bundle_dir = os.path.join(path, f)
-                tamtam_subdir = str(
-                    os.path.join(bundle_dir, 'common', 'Resources', 'Sounds'))
-                sound_candidate_dirs = [
-                    os.path.expandvars('$SUGAR_PATH/activities') +
-                    tamtam_subdir,
-                    tamtam_subdir
-                ]
-
-    if sound_candidate_dirs is not None:
-        for directory in sound_candidate_dirs:
-            if os.path.isdir(directory):
-                return directory
-
-    raise SoundLibraryNotFoundError()
+    directory = get_sound_index().directory
+    if directory is None:
+        raise SoundLibraryNotFoundError()
+    return directory
@@ -0,0 +1,344 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'library'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from pippy.physics.myelements import Elements
+except ImportError:
+    Elements = None
+
+try:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+except ImportError:
+    pygame = None
+
+
+@unittest.skipIf(Elements is None, 'needs Box2D')
+class TestAdaptiveQuality(unittest.TestCase):
+
+    def setUp(self):
+        self.world = Elements((400, 400), renderer='null')
+        self.world.add.ground()
+        self.world.add.ball((100, 100), 10)
+
+    def test_few_iterations_do_not_raise_quality(self):
+        self.world.set_adaptiveQuality(budget=1.0)
+        self.world.update(vel_iterations=2, pos_iterations=1)
+        self.assertEqual(self.world.iterations, (2, 1))
+
+        self.world.update()
+        self.assertEqual(self.world.iterations, (10, 8))
+        self.assertLessEqual(self.world.quality, 1.0)
+
+    def test_lowered_to_min_iterations(self):
+        self.world.set_adaptiveQuality(budget=0.0, min_iterations=(3, 2))
+        for i in range(30):
+            self.world.update()
+        self.assertEqual(self.world.iterations, (3, 2))
+
+        self.world.set_adaptiveQuality(budget=1.0)
+        self.world.quality = 0.3
+        for i in range(30):
+            self.world.update()
+        self.assertEqual(self.world.iterations, (10, 8))
+        self.assertEqual(self.world.quality, 1.0)
+
+
+@unittest.skipIf(Elements is None, 'needs Box2D')
+class TestRegistryColors(unittest.TestCase):
+
+    def setUp(self):
+        self.world = Elements((400, 400), renderer='null')
+        self.world.add.ground()
+        self.ball = self.world.add.ball((100, 100), 10)
+
+    def drawn_color(self):
+        self.world.draw()
+        return dict(self.world.registry.items())[self.ball]
+
+    def test_recolor_through_userdata(self):
+        self.ball.userData['color'] = (1, 2, 3)
+        self.assertEqual(self.drawn_color(), (1, 2, 3))
+        self.assertEqual(self.world.registry.get_color(self.ball), (1, 2, 3))
+
+        self.ball.userData['color'] = [4, 5, 6]
+        self.assertEqual(self.drawn_color(), (4, 5, 6))
+
+    def test_recolor_with_hex(self):
+        self.ball.userData['color'] = '#ff0000'
+        self.assertEqual(self.drawn_color(), (255, 0, 0))
+        self.assertEqual(self.ball.userData['color'], '#ff0000')
+
+    def test_json_load_hex_color(self):
+        self.ball.userData['color'] = '#00ff00'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'world.json')
+            self.world.json_save(path)
+            self.world.json_load(path)
+
+        world = self.world.world
+        self.assertEqual(world.groundBody.userData, {})
+        self.world.draw()
+        colors = self.world.registry.get_colors(world.bodies)
+        self.assertIn((0, 255, 0), colors)
+        for color in colors:
+            self.assertEqual(len(color), 3)
+            self.assertTrue(all(isinstance(c, int) for c in color))
+
+    def test_destroyed_bodies_are_not_walked(self):
+        for i in range(50):
+            body = self.world.add.ball((200, 100), 5)
+            self.world.world.DestroyBody(body)
+        self.world.draw()
+        self.assertEqual(len(self.world.registry.items()), 3)
+        self.assertEqual(len(self.world.registry.get_live_handles()), 3)
+
+    def test_set_color(self):
+        self.world.registry.set_color(self.ball, (7, 8, 9))
+        self.assertEqual(self.ball.userData['color'], (7, 8, 9))
+        self.assertEqual(self.drawn_color(), (7, 8, 9))
+
+    def test_recolor_with_stepper(self):
+        self.ball.userData['color'] = (1, 2, 3)
+        self.world.stepper.start()
+        try:
+            snapshot = self.world.stepper.snapshot
+        finally:
+            self.world.stepper.stop()
+        self.assertIn((1, 2, 3), [body[0] for body in snapshot.bodies])
+
+
+@unittest.skipIf(Elements is None or pygame is None, 'needs Box2D and pygame')
+class TestLayerCache(unittest.TestCase):
+
+    def setUp(self):
+        pygame.display.init()
+        surface = pygame.display.set_mode((400, 400))
+        self.world = Elements((400, 400), renderer='pygame')
+        self.world.renderer.set_surface(surface)
+        self.world.add.ground()
+        self.ball = self.world.add.ball((100, 100), 10)
+
+        self.layers = 0
+        start_layer = self.world.renderer.start_layer
+
+        def counting_start_layer(key):
+            self.layers += 1
+            start_layer(key)
+        self.world.renderer.start_layer = counting_start_layer
+
+    def test_redrawn_only_on_changes(self):
+        self.world.draw()
+        self.world.draw()
+        self.assertEqual(self.layers, 1)
+
+        self.ball.awake = False
+        self.world.draw()
+        self.assertEqual(self.layers, 2)
+
+        self.ball.userData['color'] = '#0000ff'
+        self.world.draw()
+        self.assertEqual(self.layers, 3)
+
+        self.world.add.rect((200, 100), 10, 10, dynamic=False)
+        self.world.draw()
+        self.world.draw()
+        self.assertEqual(self.layers, 4)
+
+
+@unittest.skipIf(Elements is None, 'needs Box2D')
+class TestReusedBodies(unittest.TestCase):
+
+    # Box2D reuses the memory of destroyed bodies, and the Python proxies
+    # of bodies compare by address
+
+    def setUp(self):
+        self.world = Elements((400, 400), renderer='null')
+        self.world.add.ground()
+
+    def replace_body(self, body, new_body):
+        self.world.world.DestroyBody(body)
+        new = new_body()
+        self.assertEqual(new, body)  # The same address
+        return new
+
+    def test_contact_callbacks(self):
+        from pippy.physics.myelements.locals import CALLBACK_CONTACT_ADD
+        hits = []
+        ball = self.world.add.ball((100, 300), 10)
+        self.world.callbacks.add(CALLBACK_CONTACT_ADD, hits.append, ball)
+
+        self.replace_body(ball, lambda: self.world.add.ball((100, 300), 10))
+        for i in range(100):
+            self.world.update()
+        self.assertEqual(hits, [])
+
+    def test_stepper_shapes(self):
+        stepper = self.world.stepper
+        ball = self.world.add.ball((100, 300), 10)
+        stepper.publish()
+
+        self.replace_body(ball, lambda: self.world.add.rect((100, 300),
+                                                            10, 10))
+        stepper.publish()
+        kinds = [shape[0] for clr, xform, shapes in stepper.snapshot.bodies
+                 for shape in shapes]
+        self.assertNotIn('circle', kinds)
+
+
+@unittest.skipIf(Elements is None or numpy is None, 'needs Box2D and NumPy')
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.world = Elements((400, 400), renderer='null')
+        self.world.add.ground()
+        self.ball = self.world.add.ball((100, 100), 10)
+        self.world.recorder.start(50)
+
+    def test_rewind_round_trip(self):
+        for i in range(10):
+            self.world.update()
+        position = self.ball.position.tuple
+        for i in range(10):
+            self.world.update()
+        self.assertNotEqual(self.ball.position.tuple, position)
+
+        self.world.recorder.rewind(9.5)
+        self.assertEqual(len(self.world.recorder), 10)
+        self.assertAlmostEqual(self.ball.position.x, position[0], 5)
+        self.assertAlmostEqual(self.ball.position.y, position[1], 5)
+
+        self.world.update()
+        self.assertEqual(len(self.world.recorder), 11)
+
+    def test_bodies_added_and_destroyed(self):
+        for i in range(5):
+            self.world.update()
+        other = self.world.add.ball((200, 100), 10)
+        for i in range(5):
+            self.world.update()
+        self.world.world.DestroyBody(other)
+        self.world.update()
+
+        # Adding and destroying a body keeps the older frames
+        recorder = self.world.recorder
+        self.assertEqual(len(recorder), 11)
+        track = recorder.trajectory(self.ball)
+        self.assertEqual(track.shape, (11, 6))
+        self.assertFalse(numpy.isnan(track).any())
+        self.assertNotIn(other, [body for body in recorder.bodies if body])
+
+        recorder.rewind(2)
+        self.assertEqual(len(recorder), 3)
+
+
+def resting_scene(world, restitution):
+    world.add.rect((200, 380), 200, 10, dynamic=False)
+    # Static bodies nothing touches never fall asleep
+    world.add.rect((50, 100), 10, 10, dynamic=False)
+    world.add.rect((200, 300), 20, 20, restitution=restitution)
+
+
+@unittest.skipIf(Elements is None, 'needs Box2D')
+class TestBatch(unittest.TestCase):
+
+    def test_time_to_rest_with_static_bodies(self):
+        from pippy.physics import batch
+        results = batch.sweep(resting_scene, {'restitution': [0.0]},
+                              steps=1000, processes=1, size=(400, 400))
+        time_to_rest = results['time_to_rest'][0]
+        self.assertIsNotNone(time_to_rest)
+        self.assertEqual(time_to_rest, time_to_rest)  # Not NaN
+        self.assertLess(results['steps'][0], 1000)
+
+
+@unittest.skipIf(Elements is None, 'needs Box2D')
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.world = Elements((400, 400), renderer='null')
+        self.world.add.ground()
+        self.ball = self.world.add.ball((100, 100), 10)
+        self.ball.userData['color'] = '#ff8000'
+        self.box = self.world.add.rect((200, 100), 20, 10, restitution=0.5)
+        self.world.add.joint(self.ball, self.box, (100, 100), (200, 100))
+        self.world.add.joint(self.box, (200, 100))
+        for i in range(10):
+            self.world.update()
+
+        fd, self.path = tempfile.mkstemp(suffix='.snapshot')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def state(self, world):
+        registry = world.registry
+        registry.sync()
+        bodies = []
+        for body, clr in registry.items():
+            if body == world.world.groundBody:
+                continue
+            fixture = body.fixtures[0]
+            bodies.append((body.position.tuple, body.angle,
+                           body.linearVelocity.tuple, clr, fixture.type,
+                           fixture.restitution))
+        joints = sorted(type(joint).__name__ for joint in world.world.joints)
+        return bodies, joints
+
+    def round_trip(self, use_mmap):
+        before = self.state(self.world)
+        self.world.snapshot_save(self.path, {'level': 3})
+
+        loaded = Elements((400, 400), renderer='null')
+        variables = loaded.snapshot_load(self.path, use_mmap)
+        self.assertEqual(variables, {'level': 3})
+        self.assertEqual(self.state(loaded), before)
+        self.assertIn((255, 128, 0), [body[3] for body in before[0]])
+        return loaded
+
+    def test_round_trip(self):
+        self.round_trip(False)
+
+    def test_round_trip_mmap(self):
+        self.round_trip(True)
+
+    def test_load_keeps_the_world_usable(self):
+        loaded = self.round_trip(False)
+        for i in range(10):
+            self.world.update()
+            loaded.update()
+
+        # The contacts are not saved, so the worlds drift apart a little
+        bodies, joints = self.state(self.world)
+        loaded_bodies, loaded_joints = self.state(loaded)
+        self.assertEqual(loaded_joints, joints)
+        for body, loaded_body in zip(bodies, loaded_bodies):
+            for a, b in zip(body[0], loaded_body[0]):
+                self.assertAlmostEqual(a, b, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
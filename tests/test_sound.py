@@ -0,0 +1,190 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'library'))
+
+try:
+    import numpy
+    from pippy import synth
+except ImportError:
+    synth = None
+
+from pippy import soundindex
+
+try:
+    from pippy import sound
+except ImportError:
+    sound = None  # Needs sugar3
+
+
+@unittest.skipIf(synth is None, 'needs NumPy')
+class TestSynth(unittest.TestCase):
+
+    tables = {
+        1: (10, 2048, (1,)),  # Sine
+        99: (7, 2048, (1, 2048, 1)),  # Constant 1
+    }
+
+    def peak_frequency(self, samples):
+        spectrum = numpy.abs(numpy.fft.rfft(samples))
+        return numpy.argmax(spectrum) * synth.SR / float(len(samples))
+
+    def test_sine(self):
+        notes = [(1, 0.25, 0.5, (440, 16384, 99, 99, 1))]
+        samples = synth.render(self.tables, notes)
+        self.assertEqual(len(samples), int(0.75 * synth.SR))
+
+        start = int(0.25 * synth.SR)
+        self.assertFalse(samples[:start].any())
+        self.assertAlmostEqual(numpy.abs(samples).max(), 0.5, 2)
+        self.assertAlmostEqual(self.peak_frequency(samples[start:]), 440,
+                               delta=2)
+
+    def test_notes_are_mixed(self):
+        notes = [(1, 0, 1, (440, 8192, 99, 99, 1)),
+                 (1, 0.5, 1, (880, 8192, 99, 99, 1))]
+        samples = synth.render(self.tables, notes)
+        self.assertEqual(len(samples), int(1.5 * synth.SR))
+        half = synth.SR // 2
+        self.assertAlmostEqual(self.peak_frequency(samples[:half]), 440,
+                               delta=2)
+        self.assertAlmostEqual(self.peak_frequency(samples[-half:]), 880,
+                               delta=2)
+
+    def test_undefined_table(self):
+        notes = [(1, 0, 1, (440, 8192, 99, 99, 5))]
+        self.assertRaises(ValueError, synth.render, self.tables, notes)
+
+
+class TestSoundIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.sounds = os.path.join(self.path, 'TamTamMini.activity',
+                                   'common', 'Resources', 'Sounds')
+        os.makedirs(self.sounds)
+        # Not in the activities directory, whose mtime is in the index
+        self.cache_path = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_path, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_path)
+
+    def write_sound(self, name, rate, frames):
+        f = wave.open(os.path.join(self.sounds, name), 'wb')
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b'\0\0' * frames)
+        f.close()
+
+    def index(self):
+        return soundindex.SoundIndex(self.path, self.cache_file)
+
+    def test_sound_rewritten_in_place(self):
+        self.write_sound('horse', 16000, 16000)
+        self.assertEqual(self.index().sounds['horse']['duration'], 1.0)
+
+        # The directory does not change when a file is rewritten
+        stat = os.stat(self.sounds)
+        self.write_sound('horse', 8000, 16000)
+        os.utime(self.sounds, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        info = self.index().sounds['horse']
+        self.assertEqual(info['rate'], 8000)
+        self.assertEqual(info['duration'], 2.0)
+        with open(self.cache_file) as f:
+            self.assertIn('8000', f.read())
+
+
+@unittest.skipIf(sound is None, 'needs sugar3')
+class SoundTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.temp_path = sound.temp_path
+        sound.temp_path = self.path
+        sound.clear()
+
+    def tearDown(self):
+        sound.clear()
+        sound.temp_path = self.temp_path
+        shutil.rmtree(self.path)
+
+
+class TestScore(SoundTestCase):
+
+    def test_module_lists(self):
+        number = sound.defAdsr(0.1, 0.2, 0.5, 0.1)
+        sound.playSine(440, starttime=0.5)
+        self.assertEqual(sound.fnum, (number,))
+        self.assertEqual(sound.instrlist, (1,))
+        self.assertIn('instr 1\n', sound.orchlines)
+        self.assertTrue(sound.scorelines[-1].startswith('i1 0.5 '))
+
+        # They can't be changed, rather than silently dropping the change
+        self.assertFalse(hasattr(sound.scorelines, 'append'))
+        with self.assertRaises(TypeError):
+            sound.fnum[0] += 1
+
+    def test_audio_out_takes_the_instruments(self):
+        sound.playSine(440, duration=0.1)
+        sound.audioOut('first').wait()
+        self.assertEqual(sound.instrlist, ())
+        self.assertEqual(sound.orchlines, ())
+
+        sound.playPluck(220, duration=0.1)
+        self.assertEqual(sound.instrlist, (8,))
+
+
+@unittest.skipIf(synth is None, 'needs NumPy')
+class TestCache(SoundTestCase):
+
+    def render(self, name):
+        sound.playSine(440, duration=0.2)
+        sound.audioOut(name).wait()
+        with open(os.path.join(self.path, '%s.wav' % name), 'rb') as f:
+            return f.read()
+
+    def test_same_score_is_rendered_once(self):
+        rendered = []
+        render = synth.render
+
+        def counting_render(tables, notes, *args):
+            rendered.append(notes)
+            return render(tables, notes, *args)
+
+        synth.render = counting_render
+        try:
+            first = self.render('first')
+            second = self.render('second')
+            sound.playSine(880, duration=0.2)
+            sound.audioOut('third').wait()
+        finally:
+            synth.render = render
+
+        self.assertEqual(len(rendered), 2)
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith(b'RIFF'))
+
+
+if __name__ == '__main__':
+    unittest.main()